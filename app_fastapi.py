@@ -1,16 +1,30 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Security
+import time
+APP_IMPORT_STARTED = time.perf_counter()
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Security, Request, Response
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from fastapi.security.api_key import APIKeyHeader, APIKey
 from typing import List
+from contextlib import asynccontextmanager
 import os
+import asyncio
 import shutil
 import tempfile
-from src.components.deepface_module_fastapi import extract_embedding
-from src.components.pinecone_module_fastapi import insert_to_index, query_index, remove_from_index, update_index, insert_to_index_full
+from src.components.deepface_module_fastapi import (extract_embedding, extract_face_embeddings, configure_pipeline,
+                                                    shutdown_pipeline, get_inference_executor, get_batching_stats,
+                                                    get_cache_stats, warm_up_pipeline, embedding_settings,
+                                                    IMAGE_EXTENSIONS)
+from src.components.pinecone_module_fastapi import (insert_to_index, query_index, query_index_batch, remove_from_index,
+                                                    update_index, insert_to_index_full, match_message)
+from src.components.vector_index import create_index
+from src.components.admission import AdmissionController, AdmissionRejected
+from src.components.metrics import (REGISTRY, HTTP_REQUEST_SECONDS, HTTP_IN_FLIGHT, STARTUP_SECONDS, stage_timer,
+                                   stats_collector)
+from src.components.startup import Readiness, timed_import
+from src.logger import logging, configure_logging, get_logging_stats
 from src.exception import CustomException
-import pinecone
-import tempfile
 import warnings
 import json
+import zipfile
 warnings.filterwarnings("ignore")
 
 
@@ -21,26 +35,207 @@ def load_config(file_path):
 
 config = load_config('config.json')
 
+# Queue-backed JSON logging to a size-rotated file; chatty modules can be sampled
+configure_logging(
+    level=config.get('LOG_LEVEL', 'INFO'),
+    format=config.get('LOG_FORMAT', 'json'),
+    max_bytes=config.get('LOG_MAX_BYTES', 50 * 1024 * 1024),
+    backup_count=config.get('LOG_BACKUP_COUNT', 5),
+    max_field_chars=config.get('LOG_MAX_FIELD_CHARS', 2048),
+    sample_rates=config.get('LOG_SAMPLE_RATES', {}),
+)
+
 
 API_KEY = config['API_KEY_Fastapi']
 API_KEY_NAME = "access_token"
 API_KEY_HEADER = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
 
 
-app = FastAPI()
+# Index backend (Pinecone, the HTTP client or a local index), selected by INDEX_BACKEND; created at startup
+index = None
+
+# /readyz reports ready once the index is connected and the models are warm
+readiness = Readiness('index', 'models')
+
+# Embedding model: the DeepFace Keras model, or its ONNX export under ONNX Runtime
+EMBEDDING_BACKEND = config.get('EMBEDDING_BACKEND', 'tensorflow')
+
+# Heavy modules imported, and timed, by the background warm-up (MTCNN needs TensorFlow either way)
+WARM_UP_IMPORTS = (('cv2', 'tensorflow', 'onnxruntime', 'mtcnn') if EMBEDDING_BACKEND == 'onnx'
+                   else ('cv2', 'tensorflow', 'deepface.DeepFace', 'mtcnn'))
+
+# Files processed at once by /AddImagesToIndexMultiple
+MULTI_UPLOAD_CONCURRENCY = config.get('MULTI_UPLOAD_CONCURRENCY', 8)
+
+# Images validated at once by /ValidateImagesBatch, and the largest image it accepts
+BATCH_VALIDATE_CONCURRENCY = config.get('BATCH_VALIDATE_CONCURRENCY', 8)
+BATCH_VALIDATE_MAX_IMAGE_BYTES = config.get('BATCH_VALIDATE_MAX_IMAGE_BYTES', 20 * 1024 * 1024)
+
+# In-memory image pipeline; temp files only when explicitly enabled
+UPLOAD_TEMPFILE_FALLBACK = config.get('UPLOAD_TEMPFILE_FALLBACK', False)
+configure_pipeline(
+    tempfile_fallback=UPLOAD_TEMPFILE_FALLBACK,
+    batching=config.get('EMBEDDING_BATCHING', True),
+    batch_max_size=config.get('EMBEDDING_BATCH_MAX_SIZE', 16),
+    batch_max_wait_ms=config.get('EMBEDDING_BATCH_MAX_WAIT_MS', 5.0),
+    cache=config.get('EMBEDDING_CACHE', True),
+    cache_max_bytes=config.get('EMBEDDING_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+    cache_disk_path=config.get('EMBEDDING_CACHE_DISK_PATH'),
+    cache_disk_capacity=config.get('EMBEDDING_CACHE_DISK_CAPACITY', 1 << 20),
+    executor=config.get('INFERENCE_EXECUTOR', 'thread'),
+    process_workers=config.get('INFERENCE_WORKERS'),
+    intra_op_threads=config.get('INFERENCE_INTRA_OP_THREADS', 1),
+    inter_op_threads=config.get('INFERENCE_INTER_OP_THREADS', 1),
+    detection_max_side=config.get('DETECTION_MAX_SIDE'),
+    detection_min_face_size=config.get('DETECTION_MIN_FACE_SIZE'),
+    **embedding_settings(config),
+)
+
+# Bounded admission in front of the embedding endpoints; excess requests get a fast 429
+admission = AdmissionController(
+    max_concurrency=config.get('ADMISSION_MAX_CONCURRENCY', 8),
+    max_queue=config.get('ADMISSION_MAX_QUEUE', 32),
+    max_queue_wait_s=config.get('ADMISSION_MAX_QUEUE_WAIT_S', 2.0),
+    per_key_limit=config.get('ADMISSION_PER_KEY_LIMIT'),
+)
+
+# Stats kept by the pipeline components, exported as gauges on /metrics at scrape time
+REGISTRY.register_collector(stats_collector('face_embedding_cache', "Embedding cache statistics.", get_cache_stats))
+REGISTRY.register_collector(stats_collector('face_embedding_batcher', "Embedding batcher statistics.",
+                                            get_batching_stats))
+REGISTRY.register_collector(stats_collector('face_admission', "Admission queue statistics.", admission.stats))
+REGISTRY.register_collector(stats_collector('face_logging', "Log queue statistics.", get_logging_stats))
+
+
+
+async def warm_up_models():
+    """
+    Imports the heavy modules, loads the models and runs a dummy forward pass.
+
+    It runs in the background after startup, so /healthz answers at once while
+    TensorFlow loads, and /readyz turns ready only when the worker can serve a
+    request at full speed.
+    """
+    if not config.get('WARM_UP_MODELS', True):
+        readiness.mark_ready('models', warmed_up=False)
+        return
+    try:
+        start = time.perf_counter()
+        imports = {}
+        for module in WARM_UP_IMPORTS:
+            imports[module] = round(await asyncio.to_thread(timed_import, module), 3)
+        if config.get('INFERENCE_EXECUTOR', 'thread') == 'process':
+            # The worker processes load and warm the models themselves
+            executor = await asyncio.to_thread(get_inference_executor)
+            if not await asyncio.to_thread(executor.warm_up):
+                raise RuntimeError("Not all inference workers started in time.")
+            timings = {}
+        else:
+            timings = await asyncio.to_thread(warm_up_pipeline)
+        elapsed = time.perf_counter() - start
+        STARTUP_SECONDS.set(elapsed, phase='warm_up')
+        readiness.mark_ready('models', warm_up_s=round(elapsed, 3), imports_s=imports,
+                             **{key: round(value, 3) for key, value in timings.items()})
+    except Exception as e:
+        logging.error(f"Model warm-up failed: {str(e)}")
+        readiness.mark_failed('models', str(e))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global index
+    start = time.perf_counter()
+    try:
+        # The http backend's requests run on this loop; the others are built the same either way
+        index = await asyncio.to_thread(create_index, config, asynchronous=True)
+    except Exception as e:
+        readiness.mark_failed('index', str(e))
+        raise
+    readiness.mark_ready('index', backend=config.get('INDEX_BACKEND', 'pinecone'))
+    if hasattr(index, 'stats'):
+        REGISTRY.register_collector(stats_collector('face_index', "Index backend statistics.", index.stats))
+    STARTUP_SECONDS.set(time.perf_counter() - start, phase='index')
+
+    warm_up_task = asyncio.create_task(warm_up_models())
+    try:
+        yield
+    finally:
+        warm_up_task.cancel()
+        await asyncio.to_thread(shutdown_pipeline)
+        if hasattr(index, 'aclose'):
+            await index.aclose()
+        elif hasattr(index, 'close'):
+            await asyncio.to_thread(index.close)
+
 
-# Pinecone Configuration
-API_KEY_PINECONE = config['API_KEY_PINECONE']
-ENVIRONMENT = config['ENVIRONMENT']
-INDEX_NAME = config['INDEX_NAME']
-DIMENSIONS = 128
+app = FastAPI(lifespan=lifespan)
 
-# Initialize Pinecone index
-pinecone.init(      
-	api_key=API_KEY_PINECONE,      
-	environment=ENVIRONMENT      
-)      
-index = pinecone.Index(INDEX_NAME)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    # Label by route template, not the raw path, to keep the number of series bounded
+    start = time.perf_counter()
+    route = request.url.path if request.url.path in ROUTE_PATHS else "unmatched"
+    HTTP_IN_FLIGHT.inc(route=route)
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_IN_FLIGHT.dec(route=route)
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, route=route, method=request.method, status=status)
+
+
+
+@asynccontextmanager
+async def uploaded_image(file: UploadFile):
+    """
+    Yields the uploaded image in the form extract_embedding should receive it.
+
+    By default the upload is read straight into memory and decoded from the buffer.
+    With UPLOAD_TEMPFILE_FALLBACK enabled in config.json the upload is copied to a
+    temporary file instead, and its path is yielded and removed afterwards.
+    """
+    if not UPLOAD_TEMPFILE_FALLBACK:
+        with stage_timer('upload'):
+            data = await file.read()
+        yield data
+        return
+
+    with stage_timer('upload'), \
+            tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
+        shutil.copyfileobj(file.file, temp_file)
+        temp_file_name = temp_file.name
+    try:
+        yield temp_file_name
+    finally:
+        os.unlink(temp_file_name)
+
+
+
+def match_results(query_response):
+    """
+    Converts a query response into the id/score/message list returned by the validate endpoints.
+    """
+    results = []
+    for match in query_response.matches:
+        results.append({"id": match.id, "score": match.score, "message": match_message(match.score)})
+    return results
+
+
+
+def partial_result(query_responses):
+    """
+    Returns ``{"partial": True, "missing_shards": [...]}`` if any of the query responses was
+    answered by a sharded index without some of its shards, otherwise an empty dict.
+    """
+    partial = [query_response for query_response in query_responses if query_response.partial]
+    if not partial:
+        return {}
+    return {"partial": True,
+            "missing_shards": sorted({shard for query_response in partial for shard in query_response.missing_shards})}
 
 
 
@@ -52,24 +247,29 @@ async def get_api_key(api_key_header: str = Security(API_KEY_HEADER)):
 
 
 
+async def admit_request(api_key: APIKey = Depends(get_api_key)):
+    """
+    Holds an admission slot for the rest of the request, or rejects it with 429 and Retry-After.
+    """
+    try:
+        async with admission.admit(api_key):
+            yield api_key
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
 
-@app.post("/AddImageToIndex")
-async def add_image(file: UploadFile = File(...), api_key: APIKey = Depends(get_api_key)):
-    # Create a temporary file to save the uploaded image
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
-        shutil.copyfileobj(file.file, temp_file)
-        temp_file_name = temp_file.name
 
-    try:
-        embedding, error = await extract_embedding(temp_file_name)
+
+
+@app.post("/AddImageToIndex")
+async def add_image(file: UploadFile = File(...), api_key: APIKey = Depends(admit_request)):
+    async with uploaded_image(file) as image_input:
+        embedding, error = await extract_embedding(image_input)
         if error:
             raise HTTPException(status_code=500, detail=error)
 
         file_id = os.path.splitext(file.filename)[0]
         await insert_to_index(index, file_id, embedding)
         return {"message": "Image added successfully", "id": file_id}
-    finally:
-        os.unlink(temp_file_name)
 
 
 
@@ -87,51 +287,155 @@ async def delete_vector(user_id: str, api_key: APIKey = Depends(get_api_key)):
 
 
 @app.post("/ValidateImage")
-async def query_index_endpoint(file: UploadFile = File(...), api_key: APIKey = Depends(get_api_key)):
-    # Create a temporary file to save the uploaded image
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
-        shutil.copyfileobj(file.file, temp_file)
-        temp_file_name = temp_file.name
+async def query_index_endpoint(response: Response, file: UploadFile = File(...), all_faces: bool = False,
+                               api_key: APIKey = Depends(admit_request)):
+    """
+    Endpoint to find the closest indexed images to an uploaded one.
+    By default the most prominent face is matched and a list of matches is returned.
+    With all_faces=true every face in the image is embedded in one batch, the index is
+    queried for all of them together, and the response lists each face's box,
+    confidence, landmarks and matches.
+    When a sharded index answers without some of its shards, the matches may miss
+    images held there: the list response then carries the X-Partial-Result and
+    X-Missing-Shards headers, and the all_faces response "partial" and "missing_shards".
+    """
+    async with uploaded_image(file) as image_input:
+        if all_faces:
+            faces, error = await extract_face_embeddings(image_input)
+            if error:
+                raise HTTPException(status_code=500, detail=error)
 
-    try:
-        embedding, error = await extract_embedding(temp_file_name)
+            query_responses = await query_index_batch(index, [face.pop("embedding") for face in faces], top_k=1)
+            for face, query_response in zip(faces, query_responses):
+                face["matches"] = match_results(query_response)
+            return {"faces": faces, **partial_result(query_responses)}
+
+        embedding, error = await extract_embedding(image_input)
         if error:
             raise HTTPException(status_code=500, detail=error)
 
         query_response = await query_index(index, embedding, top_k=1)
+        partial = partial_result([query_response])
+        if partial:
+            response.headers["X-Partial-Result"] = "true"
+            response.headers["X-Missing-Shards"] = ",".join(str(shard) for shard in partial["missing_shards"])
     
-        results = []
-        for match in query_response['matches']:
-            score = match['score']
-            id_value = match['id']
-            message = "Exact image found" if score < 15 else "Similar image found" if score < 100 else "No similar image found"
-            results.append({"id": id_value, "score": score, "message": message})
-        return results
-    finally:
-        os.unlink(temp_file_name)
+        return match_results(query_response)
         
         
         
         
         
+def _upload_sources(files, zip_file):
+    # Yields (name, loader) pairs; loaders read one image only when its turn comes
+    for file in files or []:
+        async def load(file=file):
+            data = await file.read(BATCH_VALIDATE_MAX_IMAGE_BYTES + 1)
+            if len(data) > BATCH_VALIDATE_MAX_IMAGE_BYTES:
+                raise ValueError(f"Image is larger than {BATCH_VALIDATE_MAX_IMAGE_BYTES} bytes.")
+            return data
+        yield file.filename, load
+
+    if zip_file is not None:
+        for info in zip_file.infolist():
+            if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            async def load(info=info):
+                if info.file_size > BATCH_VALIDATE_MAX_IMAGE_BYTES:
+                    raise ValueError(f"Image is larger than {BATCH_VALIDATE_MAX_IMAGE_BYTES} bytes.")
+                return await asyncio.to_thread(zip_file.read, info)
+            yield info.filename, load
+
+
+async def _validate_one(position, name, load, top_k, api_key):
+    result = {"index": position, "filename": name}
+    try:
+        # Every image takes its own admission slot, like a single-image request
+        async with admission.admit(api_key):
+            embedding, error = await extract_embedding(await load())
+            if error:
+                result.update(status="error", error=error)
+            else:
+                query_response = await query_index(index, embedding, top_k=top_k)
+                result.update(status="ok", matches=match_results(query_response),
+                              **partial_result([query_response]))
+    except AdmissionRejected as e:
+        result.update(status="rejected", error=str(e), retry_after=e.retry_after)
+    except Exception as e:
+        result.update(status="error", error=str(e))
+    return result
+
+
+async def _validate_stream(sources, top_k, api_key, zip_file=None):
+    # At most BATCH_VALIDATE_CONCURRENCY images are in memory at a time; lines are sent as they finish
+    concurrency = min(BATCH_VALIDATE_CONCURRENCY, admission.per_key_limit or BATCH_VALIDATE_CONCURRENCY)
+    pending = set()
+    sources = enumerate(sources)
+    exhausted = False
+    try:
+        while pending or not exhausted:
+            while not exhausted and len(pending) < concurrency:
+                source = next(sources, None)
+                if source is None:
+                    exhausted = True
+                else:
+                    position, (name, load) = source
+                    pending.add(asyncio.create_task(_validate_one(position, name, load, top_k, api_key)))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield json.dumps(task.result()) + "\n"
+    finally:
+        # Also runs when the client disconnects: stop the remaining work
+        for task in pending:
+            task.cancel()
+        if zip_file is not None:
+            zip_file.close()
+
+
+
+@app.post("/ValidateImagesBatch")
+async def validate_images_batch(files: List[UploadFile] = File(None), archive: UploadFile = File(None),
+                                top_k: int = 1, api_key: APIKey = Depends(get_api_key)):
+    """
+    Endpoint to validate many images in one request.
+    Accepts image files and/or a zip archive of images, runs decode, detection, embedding
+    and the index query for several images at once, and streams one NDJSON line per image
+    as soon as it is done. Lines carry the image's position in the request, so they may
+    arrive out of order.
+    Each image is admitted separately, so a batch uses as many admission slots as it has
+    images in flight. An image turned away by admission control gets a line with status
+    "rejected" and its retry_after. An image matched by a sharded index without some of
+    its shards gets "partial" and "missing_shards" on its line.
+    """
+    if not files and archive is None:
+        raise HTTPException(status_code=400, detail="Send image files or a zip archive.")
+
+    zip_file = None
+    if archive is not None:
+        try:
+            zip_file = zipfile.ZipFile(archive.file)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="The archive is not a zip file.")
+
+    return StreamingResponse(_validate_stream(_upload_sources(files, zip_file), top_k, api_key, zip_file),
+                             media_type="application/x-ndjson")        
+        
+        
+        
+        
 @app.post("/UpdateImage")
-async def update_vector_endpoint(user_id: str, file: UploadFile = File(...), api_key: APIKey = Depends(get_api_key)):
+async def update_vector_endpoint(user_id: str, file: UploadFile = File(...), api_key: APIKey = Depends(admit_request)):
     """
     Endpoint to update a vector in the Pinecone index.
     Accepts a user ID and an image file, extracts the embedding from the image,
     and updates the vector associated with the user ID.
     """
-    # Create a temporary file to save the uploaded image
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
-        shutil.copyfileobj(file.file, temp_file)
-        temp_file_name = temp_file.name
-
     try:
-        # Extract embedding from the image file
-        embedding, error = await extract_embedding(temp_file_name)
-
-        # Cleanup: remove the temporary file
-        os.unlink(temp_file_name)
+        # Extract embedding from the uploaded image
+        async with uploaded_image(file) as image_input:
+            embedding, error = await extract_embedding(image_input)
 
         # Check for errors in embedding extraction
         if error:
@@ -145,9 +449,9 @@ async def update_vector_endpoint(user_id: str, file: UploadFile = File(...), api
             raise HTTPException(status_code=500, detail=f"Error updating vector: {update_error}")
 
         return {"message": "Vector updated successfully", "update_response": update_response}
+    except HTTPException:
+        raise
     except Exception as e:
-        # Cleanup: remove the temporary file in case of an error
-        os.unlink(temp_file_name)
         raise HTTPException(status_code=500, detail=str(e))
     
     
@@ -155,32 +459,67 @@ async def update_vector_endpoint(user_id: str, file: UploadFile = File(...), api
     
 @app.post("/AddImagesToIndexMultiple")
 async def add_images(files: List[UploadFile] = File(...), api_key: APIKey = Depends(get_api_key)):
-    embeddings = []
-    file_ids = []
-    temp_files = []
-
-    for file in files:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
-            shutil.copyfileobj(file.file, temp_file)
-            temp_files.append(temp_file.name)
-
-    try:
-        for temp_file_name, file in zip(temp_files, files):
-            embedding, error = await extract_embedding(temp_file_name)
-            if error:
-                raise HTTPException(status_code=500, detail=error)
-
-            file_id = os.path.splitext(file.filename)[0]
-            embeddings.append(embedding)
-            file_ids.append(file_id)
-
-        if embeddings:
-            await insert_to_index_full(index, file_ids, embeddings)
-        
-        return {"message": "Images added successfully", "ids": file_ids}
-    finally:
-        for temp_file_name in temp_files:
-            os.unlink(temp_file_name)
+    """
+    Endpoint to add several images at once.
+    Files are processed concurrently (up to MULTI_UPLOAD_CONCURRENCY at a time), a failure
+    in one file does not affect the others, and every embedding that was extracted is
+    inserted with one batched write. The response reports the outcome per file.
+    Files whose names share a stem (e.g. a.jpg and a.png) map to the same id: only the
+    first of them is inserted, the others are reported as "skipped_existing".
+    Each file is admitted separately around its extraction, like the images of
+    /ValidateImagesBatch; a file turned away gets status "rejected" and its
+    retry_after, and the request fails with 429 if every file was turned away.
+    """
+    semaphore = asyncio.Semaphore(min(MULTI_UPLOAD_CONCURRENCY,
+                                      admission.per_key_limit or MULTI_UPLOAD_CONCURRENCY))
+
+    async def process(file):
+        async with semaphore:
+            try:
+                async with admission.admit(api_key):
+                    async with uploaded_image(file) as image_input:
+                        embedding, error = await extract_embedding(image_input)
+                        return embedding, error, None
+            except AdmissionRejected as e:
+                return None, str(e), e
+            except Exception as e:
+                return None, str(e), None
+
+    outcomes = await asyncio.gather(*(process(file) for file in files))
+    rejections = [rejected for _, _, rejected in outcomes if rejected is not None]
+    if len(rejections) == len(files):
+        retry_after = max(rejected.retry_after for rejected in rejections)
+        raise HTTPException(status_code=429, detail=str(rejections[0]), headers={"Retry-After": str(retry_after)})
+
+    results = []
+    # One upload per id goes to the index, so each id's outcome belongs to exactly one file
+    inserting = {}
+    for file, (embedding, error, rejected) in zip(files, outcomes):
+        file_id = os.path.splitext(file.filename)[0]
+        result = {"filename": file.filename, "id": file_id}
+        if rejected is not None:
+            result.update(status="rejected", error=error, retry_after=rejected.retry_after)
+        elif error:
+            result.update(status="error", error=error)
+        elif file_id in inserting:
+            result.update(status="skipped_existing")
+        else:
+            inserting[file_id] = (result, embedding)
+        results.append(result)
+
+    report = {}
+    if inserting:
+        report = await insert_to_index_full(index, list(inserting),
+                                            [embedding for _, embedding in inserting.values()])
+
+    for status in ("inserted", "skipped_existing", "invalid", "failed"):
+        for file_id in report.get(status, []):
+            inserting[file_id][0].setdefault("status", status)
+    for result, _ in inserting.values():
+        result.setdefault("status", "failed")
+
+    added = [result["id"] for result in results if result["status"] == "inserted"]
+    return {"message": f"{len(added)} of {len(files)} images added", "ids": added, "results": results}
             
             
             
@@ -188,22 +527,15 @@ async def add_images(files: List[UploadFile] = File(...), api_key: APIKey = Depe
             
             
 @app.post("/ReplaceImage")
-async def update_vector(user_id: str, file: UploadFile = File(...), api_key: APIKey = Depends(get_api_key)):
+async def update_vector(user_id: str, file: UploadFile = File(...), api_key: APIKey = Depends(admit_request)):
     """
     Endpoint to replace a vector in the Pinecone index.
     Deletes the vector associated with the provided user ID and inserts a new vector with the new image name as ID.
     """
-    # Create a temporary file to save the uploaded image
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
-        shutil.copyfileobj(file.file, temp_file)
-        temp_file_name = temp_file.name
-
     try:
-        # Extract embedding from the image file
-        embedding, error = await extract_embedding(temp_file_name)
-
-        # Cleanup: remove the temporary file
-        os.unlink(temp_file_name)
+        # Extract embedding from the uploaded image
+        async with uploaded_image(file) as image_input:
+            embedding, error = await extract_embedding(image_input)
 
         # Check for errors in embedding extraction
         if error:
@@ -219,15 +551,81 @@ async def update_vector(user_id: str, file: UploadFile = File(...), api_key: API
         await insert_to_index(index, new_user_id, embedding)
 
         return {"message": "Vector replaced successfully", "old_id": user_id, "new_id": new_user_id}
+    except HTTPException:
+        raise
     except Exception as e:
-        # Cleanup: remove the temporary file in case of an error
-        os.unlink(temp_file_name)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 
 
 
+@app.get("/EmbeddingBatchStats")
+async def embedding_batch_stats(api_key: APIKey = Depends(get_api_key)):
+    """
+    Endpoint exposing the embedding batcher's queue depth and batch fill metrics.
+    """
+    return get_batching_stats()
+
+
+
+@app.get("/EmbeddingCacheStats")
+async def embedding_cache_stats(api_key: APIKey = Depends(get_api_key)):
+    """
+    Endpoint exposing the embedding cache's hit, miss and eviction counters.
+    """
+    return get_cache_stats()
+
+
+
+@app.get("/AdmissionStats")
+async def admission_stats(api_key: APIKey = Depends(get_api_key)):
+    """
+    Endpoint exposing the admission queue length, wait times and rejections, for autoscaling.
+    """
+    return admission.stats()
+
+
+
+
+
+@app.get("/healthz")
+async def healthz():
+    """
+    Liveness probe: answers as soon as the worker's event loop is running.
+    """
+    return {"status": "ok"}
+
+
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness probe: 200 once the index is connected and the models are warm, 503 before
+    that or if start-up failed, with the state and timings of each check.
+    """
+    return JSONResponse(readiness.status(), status_code=200 if readiness.ready else 503)
+
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Endpoint exposing per-stage latency histograms, in-flight gauges, model load times,
+    index call counters and cache, batcher and admission statistics in the Prometheus
+    text format. It has no API key so that Prometheus can scrape it.
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+
+# Paths of the routes above, used as bounded metric labels
+ROUTE_PATHS = {route.path for route in app.routes}
+
+STARTUP_SECONDS.set(time.perf_counter() - APP_IMPORT_STARTED, phase='app_import')
+
+
+
 # Run the FastAPI app with uvicorn
 if __name__ == "__main__":
     import uvicorn
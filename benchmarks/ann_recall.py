@@ -0,0 +1,119 @@
+"""
+Recall-vs-latency report for the IVF approximate index against exact search.
+
+Both indexes are filled with the same 128-d embeddings. Held-out embeddings are
+used as queries, and for every probe fraction (or fixed nprobe) the report shows
+recall@k (the share of the exact top-k that the IVF index also returns), the mean
+and p95 query latency, and the speed-up over exact search. The IVF index is
+trained whatever the gallery size, although the service searches galleries
+smaller than its train size exactly.
+
+Use real Facenet embeddings exported to a .npy file (shape (n, 128)) for numbers
+that carry over to production. Without --embeddings a synthetic gallery is
+generated: a few embeddings per identity scattered around identity centres.
+
+Usage:
+    python benchmarks/ann_recall.py --embeddings gallery.npy --top-k 10
+    python benchmarks/ann_recall.py --size 200000 --probe-fraction 0.1 0.2 0.4 --output ann_report.json
+    python benchmarks/ann_recall.py --size 200000 --nprobe 1 4 16 64 --pq-m 16
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from src.components.ivf_index import IVFIndex
+from src.components.vector_index import NumpyIndex
+
+
+def synthetic_embeddings(size, dimension=128, per_identity=4, seed=0):
+    # Facenet embeddings have norms of roughly 10-15; same-person spread is a fraction of that
+    rng = np.random.default_rng(seed)
+    identities = max(1, size // per_identity)
+    centres = rng.normal(scale=1.0, size=(identities, dimension)).astype(np.float32)
+    labels = rng.integers(0, identities, size=size)
+    return centres[labels] + rng.normal(scale=0.35, size=(size, dimension)).astype(np.float32)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def time_queries(index, queries, top_k, **kwargs):
+    results, timings = [], []
+    for query in queries:
+        start = time.perf_counter()
+        response = index.query(vector=query, top_k=top_k, **kwargs)
+        timings.append((time.perf_counter() - start) * 1000)
+        results.append([match['id'] for match in response['matches']])
+    return results, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--embeddings', help=".npy file with an (n, d) float array of embeddings")
+    parser.add_argument('--size', type=int, default=100000, help="Synthetic gallery size when no file is given")
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--metric', default='euclidean', choices=['euclidean', 'cosine'])
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--probe-fraction', type=float, nargs='+', default=[0.05, 0.1, 0.2, 0.3, 0.4, 0.5],
+                        help="Shares of the lists to scan per query")
+    parser.add_argument('--nprobe', type=int, nargs='+', help="Fixed list counts to scan instead of --probe-fraction")
+    parser.add_argument('--pq-m', type=int, default=None)
+    parser.add_argument('--output', help="Also write the report as JSON to this path")
+    args = parser.parse_args()
+
+    data = np.load(args.embeddings).astype(np.float32) if args.embeddings else synthetic_embeddings(args.size + args.queries)
+    rng = np.random.default_rng(1)
+    order = rng.permutation(len(data))
+    queries, gallery = data[order[:args.queries]], data[order[args.queries:]]
+    ids = [str(i) for i in range(len(gallery))]
+    dimension = gallery.shape[1]
+
+    exact = NumpyIndex(dimension=dimension, metric=args.metric, initial_capacity=len(gallery))
+    exact.upsert(list(zip(ids, gallery)))
+    start = time.perf_counter()
+    ivf = IVFIndex(dimension=dimension, metric=args.metric, nlist=args.nlist, pq_m=args.pq_m,
+                   train_size=len(gallery), auto_rebuild=False, initial_capacity=len(gallery))
+    ivf.upsert(list(zip(ids, gallery)))
+    ivf.rebuild()
+    build_seconds = time.perf_counter() - start
+
+    truth, exact_timings = time_queries(exact, queries, args.top_k)
+    exact_mean = sum(exact_timings) / len(exact_timings)
+    stats = ivf.describe_index_stats()
+    print(f"gallery: {len(gallery)} x {dimension}, queries: {len(queries)}, top_k: {args.top_k}, "
+          f"nlist: {stats['nlist']}, pq_m: {args.pq_m}, build: {build_seconds:.1f}s")
+    print(f"exact: mean {exact_mean:.3f} ms, p95 {percentile(exact_timings, 0.95):.3f} ms")
+    print(f"{'fraction':>10}{'nprobe':>8}{'recall@k':>12}{'recall@1':>10}{'mean_ms':>12}{'p95_ms':>12}{'speedup':>10}")
+
+    nprobes = args.nprobe or [max(1, int(np.ceil(fraction * stats['nlist']))) for fraction in args.probe_fraction]
+    rows = []
+    for nprobe in nprobes:
+        approx, timings = time_queries(ivf, queries, args.top_k, nprobe=nprobe)
+        recall = np.mean([len(set(a) & set(t)) / max(len(t), 1) for a, t in zip(approx, truth)])
+        recall_1 = np.mean([bool(a) and bool(t) and a[0] == t[0] for a, t in zip(approx, truth)])
+        mean = sum(timings) / len(timings)
+        row = {'nprobe': nprobe, 'probe_fraction': nprobe / stats['nlist'], 'recall': float(recall),
+               'recall_at_1': float(recall_1), 'mean_ms': mean, 'p95_ms': percentile(timings, 0.95),
+               'speedup': exact_mean / mean}
+        rows.append(row)
+        print(f"{row['probe_fraction']:>10.3f}{nprobe:>8}{recall:>12.4f}{recall_1:>10.4f}{mean:>12.3f}"
+              f"{row['p95_ms']:>12.3f}{row['speedup']:>10.1f}")
+
+    if args.output:
+        report = {
+            'gallery_size': len(gallery), 'dimension': dimension, 'queries': len(queries),
+            'top_k': args.top_k, 'metric': args.metric, 'nlist': stats['nlist'], 'pq_m': args.pq_m,
+            'build_seconds': build_seconds, 'exact_mean_ms': exact_mean,
+            'exact_p95_ms': percentile(exact_timings, 0.95), 'results': rows,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compares MTCNN detection at full resolution with detection on a downscaled copy.
+
+For each image the face is detected both ways. The benchmark reports the detection
+latency, the IoU between the two boxes and the mean absolute pixel difference
+between the two face crops (both are cropped from the full-resolution image, so
+matching boxes give matching crops). Needs mtcnn and photos that contain faces.
+
+Usage:
+    python benchmarks/detection_benchmark.py photos/*.jpg --max-side 1024 --iterations 5
+"""
+import argparse
+import statistics
+import time
+
+import cv2
+import numpy as np
+
+from src.components.face_detection import FaceDetector
+from src.components.model_registry import get_registry
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    union = aw * ah + bw * bh - w * h
+    return w * h / union if union else 0.0
+
+
+def time_detection(detector, img, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        results = detector._detect(img)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='+')
+    parser.add_argument('--max-side', type=int, default=1024)
+    parser.add_argument('--min-face-size', type=int, default=None)
+    parser.add_argument('--iterations', type=int, default=3)
+    args = parser.parse_args()
+
+    detector = get_registry().get_detector(args.min_face_size)
+    full = FaceDetector(detector)
+    downscaled = FaceDetector(detector, max_side=args.max_side)
+
+    print(f"{'image':<32}{'size':>12}{'full_ms':>10}{'down_ms':>10}{'speedup':>9}{'iou':>7}{'crop_mad':>10}")
+    for path in args.images:
+        img = cv2.imread(path)
+        if img is None:
+            print(f"{path:<32} could not be read")
+            continue
+        full.detector.detect_faces(cv2.cvtColor(img[:64, :64], cv2.COLOR_BGR2RGB))  # warm up the graph
+        full_ms, full_results = time_detection(full, img, args.iterations)
+        down_ms, down_results = time_detection(downscaled, img, args.iterations)
+        size = f"{img.shape[1]}x{img.shape[0]}"
+        if not full_results or not down_results:
+            print(f"{path[-32:]:<32}{size:>12}{full_ms:>10.1f}{down_ms:>10.1f}{full_ms / down_ms:>9.1f}"
+                  f"{'no face' if not down_results else 'missed':>17}")
+            continue
+
+        box_full, box_down = full_results[0]['box'], down_results[0]['box']
+        x, y, w, h = box_full
+        crop_full = img[y:y + h, x:x + w]
+        x, y, w, h = box_down
+        crop_down = cv2.resize(img[y:y + h, x:x + w], (crop_full.shape[1], crop_full.shape[0]))
+        mad = float(np.abs(crop_full.astype(np.int16) - crop_down.astype(np.int16)).mean())
+        print(f"{path[-32:]:<32}{size:>12}{full_ms:>10.1f}{down_ms:>10.1f}{full_ms / down_ms:>9.1f}"
+              f"{iou(box_full, box_down):>7.2f}{mad:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Compares the ONNX Runtime embedding backend with the TensorFlow (DeepFace) one.
+
+Faces are detected once with MTCNN (or, with --crops, the images are taken as face
+crops already) and embedded by both backends. The report covers:
+
+- drift: per-face distance between two embeddings of the same crop, in the squared
+  L2 units of the match scores, plus relative error and cosine similarity. Each
+  section changes one thing against the TensorFlow model on the ``preprocess_faces``
+  input of the ONNX backend: "conversion" runs the ONNX model on that same input,
+  isolating the export and quantization; "preprocessing" keeps the TensorFlow model
+  and preprocesses as DeepFace does (Haar re-detection, the TensorFlow default, see
+  ``EMBEDDING_HAAR_REDETECT``); "end_to_end" compares the ONNX backend with the
+  default TensorFlow one, as the existing gallery sees a switch.
+- decisions: for every pair of faces, whether both backends give the same
+  "Exact" / "Similar" / "No match" answer of the validate endpoints (``match_message``),
+  and whether each face's nearest neighbour is the same.
+- throughput: faces per second of each backend at batch size 1 and --batch-size,
+  and the time to import and load each model.
+
+The ONNX model comes from ``python -m src.components.embedding_backend``. Needs
+TensorFlow, deepface and onnxruntime, and photos that contain faces.
+
+Usage:
+    python benchmarks/embedding_parity.py photos/*.jpg --onnx models/facenet-int8.onnx --output parity.json
+    python benchmarks/embedding_parity.py crops/*.png --crops --onnx models/facenet.onnx --threads 4
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from src.components.pinecone_module_fastapi import EXACT_MATCH_SCORE, SIMILAR_MATCH_SCORE
+from src.components.startup import timed_import
+
+THRESHOLDS = (EXACT_MATCH_SCORE, SIMILAR_MATCH_SCORE)
+
+
+def summarize(values):
+    values = np.sort(np.asarray(values, dtype=np.float64))
+    if len(values) == 0:
+        return {}
+    return {'min': float(values[0]), 'mean': float(values.mean()), 'p50': float(values[len(values) // 2]),
+            'p99': float(values[min(len(values) - 1, int(len(values) * 0.99))]), 'max': float(values[-1])}
+
+
+def drift(reference, other):
+    difference = ((reference - other) ** 2).sum(axis=1)
+    relative = np.sqrt(difference) / np.linalg.norm(reference, axis=1)
+    cosine = (reference * other).sum(axis=1) / (np.linalg.norm(reference, axis=1) * np.linalg.norm(other, axis=1))
+    return {'squared_l2': summarize(difference), 'relative_error': summarize(relative),
+            'cosine': summarize(cosine)}
+
+
+def pair_distances(embeddings):
+    sq_norms = (embeddings ** 2).sum(axis=1)
+    distances = np.maximum(sq_norms[:, None] + sq_norms[None, :] - 2 * embeddings @ embeddings.T, 0)
+    np.fill_diagonal(distances, np.inf)
+    return distances
+
+
+def decisions(reference, other):
+    reference_distances, other_distances = pair_distances(reference), pair_distances(other)
+    upper = np.triu_indices(len(reference), k=1)
+    reference_classes = np.digitize(reference_distances[upper], THRESHOLDS)
+    other_classes = np.digitize(other_distances[upper], THRESHOLDS)
+    agree = reference_classes == other_classes
+    report = {'pairs': int(len(agree)), 'agreement': float(agree.mean()) if len(agree) else None,
+              'nearest_neighbour_agreement': float((reference_distances.argmin(axis=1) ==
+                                                    other_distances.argmin(axis=1)).mean())}
+    for level, name in enumerate(('exact', 'similar')):
+        in_reference = reference_classes == level
+        report[f'{name}_pairs'] = int(in_reference.sum())
+        report[f'{name}_kept'] = float((other_classes[in_reference] == level).mean()) if in_reference.any() else None
+    return report
+
+
+def throughput(embed, faces, batch_size, repeat):
+    embed(faces[:batch_size])  # warm-up
+    rates = {}
+    for size in sorted({1, batch_size}):
+        batches = [faces[i:i + size] for i in range(0, len(faces) - size + 1, size)] or [faces[:size]]
+        timings = []
+        for _ in range(repeat):
+            for batch in batches:
+                start = time.perf_counter()
+                embed(batch)
+                timings.append(time.perf_counter() - start)
+        rates[f'batch_{size}'] = {'faces_per_s': round(len(batches[0]) / statistics.median(timings), 1),
+                                  'p50_ms': round(statistics.median(timings) * 1000, 2)}
+    return rates
+
+
+def load_faces(paths, crops, min_face_size):
+    import cv2
+    faces = []
+    detector = None
+    if not crops:
+        from src.components.face_detection import FaceDetector
+        detector = FaceDetector(min_face_size=min_face_size)
+    for path in paths:
+        img = cv2.imread(path)
+        if img is None:
+            print(f"{path} could not be read", file=sys.stderr)
+            continue
+        if detector is None:
+            faces.append(img)
+            continue
+        face = detector.detect_face(img)
+        if face is None:
+            print(f"{path}: no face detected", file=sys.stderr)
+            continue
+        faces.append(np.ascontiguousarray(face[:, :, ::-1]))  # the detector returns RGB
+    return faces
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='+')
+    parser.add_argument('--onnx', required=True, help="The exported .onnx model")
+    parser.add_argument('--crops', action='store_true', help="The images are face crops; skip detection")
+    parser.add_argument('--min-face-size', type=int, default=None)
+    parser.add_argument('--threads', type=int, default=None, help="ONNX Runtime intra-op threads")
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help="Write the report as JSON")
+    args = parser.parse_args()
+
+    from src.components.embedding_backend import OnnxBackend, TensorFlowBackend
+    from src.components.model_registry import get_registry
+
+    # ONNX Runtime first, so its import time is not hidden behind TensorFlow's
+    load = {'onnx': {'import_s': timed_import('onnxruntime')}}
+    onnx_backend = OnnxBackend(args.onnx, intra_op_threads=args.threads)
+    start = time.perf_counter()
+    onnx_backend.load()
+    load['onnx']['load_s'] = time.perf_counter() - start
+    load['tensorflow'] = {'import_s': timed_import('tensorflow') + timed_import('deepface.DeepFace')}
+    tf_backend = TensorFlowBackend(get_registry(), haar_redetect=False)
+    start = time.perf_counter()
+    tf_backend.load()
+    load['tensorflow']['load_s'] = time.perf_counter() - start
+    # Shares the Keras model held by the registry; only the preprocessing differs
+    deepface_backend = TensorFlowBackend(get_registry(), haar_redetect=True)
+
+    faces = load_faces(args.images, args.crops, args.min_face_size)
+    if len(faces) < 2:
+        parser.error("Need at least two faces to compare match decisions.")
+    print(f"{len(faces)} faces; ONNX model {onnx_backend.name}")
+
+    def embed_all(fn):
+        return np.concatenate([np.asarray(fn(faces[i:i + args.batch_size]), dtype=np.float64)
+                               for i in range(0, len(faces), args.batch_size)])
+
+    reference = embed_all(tf_backend.embed)
+    deepface_reference = embed_all(deepface_backend.embed)
+    onnx = embed_all(lambda batch: onnx_backend.forward(tf_backend.preprocess(batch)))
+    compared = {'conversion': (reference, onnx), 'preprocessing': (reference, deepface_reference),
+                'end_to_end': (deepface_reference, onnx)}
+
+    report = {
+        'faces': len(faces),
+        'onnx_model': onnx_backend.name,
+        'drift': {kind: drift(*pair) for kind, pair in compared.items()},
+        'decisions': {kind: decisions(*pair) for kind, pair in compared.items()},
+        'load': {backend: {key: round(value, 3) for key, value in times.items()} for backend, times in load.items()},
+        'throughput': {'tensorflow': throughput(tf_backend.embed, faces, args.batch_size, args.repeat),
+                       'onnx': throughput(onnx_backend.embed, faces, args.batch_size, args.repeat)},
+    }
+    report['speedup'] = {size: round(report['throughput']['onnx'][size]['faces_per_s'] /
+                                     report['throughput']['tensorflow'][size]['faces_per_s'], 2)
+                         for size in report['throughput']['onnx']}
+
+    for kind in compared:
+        d, a = report['drift'][kind], report['decisions'][kind]
+        print(f"{kind:<13} drift: squared L2 p50 {d['squared_l2']['p50']:.4f} p99 {d['squared_l2']['p99']:.4f} "
+              f"max {d['squared_l2']['max']:.4f}, cosine min {d['cosine']['min']:.5f}; decisions agree on "
+              f"{a['agreement']:.2%} of {a['pairs']} pairs, nearest neighbour on {a['nearest_neighbour_agreement']:.2%}")
+    for backend in ('tensorflow', 'onnx'):
+        rates = report['throughput'][backend]
+        print(f"{backend:<13} import {report['load'][backend]['import_s']:.2f}s, load "
+              f"{report['load'][backend]['load_s']:.2f}s, "
+              + ", ".join(f"{size} {rate['faces_per_s']} faces/s" for size, rate in rates.items()))
+    print(f"ONNX speedup: {report['speedup']}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
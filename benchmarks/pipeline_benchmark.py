@@ -0,0 +1,165 @@
+"""
+Compares the legacy temp-file image hand-off with the in-memory pipeline.
+
+Legacy path (per request):
+    upload -> temp file -> cv2.imread -> crop -> JPEG temp file -> cv2.imread (inside DeepFace)
+In-memory path:
+    upload bytes -> cv2.imdecode -> crop -> BGR array handed to the model
+
+The benchmark times only the image hand-off, so it runs without MTCNN or Facenet.
+Pass --with-models to also time the full extract_embedding call both ways.
+Syscall and byte counters come from /proc/self/io and are only available on Linux.
+
+Usage:
+    python benchmarks/pipeline_benchmark.py --iterations 200 --width 4000 --height 3000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from src.components.deepface_module_fastapi import decode_image
+
+
+def make_upload(width, height, seed=0):
+    # Smooth gradients plus noise compress like a photo rather than like flat colour
+    rng = np.random.default_rng(seed)
+    ys, xs = np.mgrid[0:height, 0:width]
+    img = np.stack([(xs * 255 // width), (ys * 255 // height), ((xs + ys) * 255 // (width + height))], axis=-1)
+    img = (img + rng.integers(0, 24, size=img.shape)).clip(0, 255).astype(np.uint8)
+    ok, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    if not ok:
+        raise RuntimeError("Could not encode the synthetic image.")
+    return encoded.tobytes()
+
+
+def face_box(img):
+    # Stand-in for the MTCNN box: a centred crop of a typical face size
+    h, w = img.shape[:2]
+    size = min(h, w) // 4
+    return (w - size) // 2, (h - size) // 2, size, size
+
+
+def legacy_handoff(upload):
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
+        temp_file.write(upload)
+        upload_path = temp_file.name
+    try:
+        img = cv2.imread(upload_path)
+        x, y, w, h = face_box(img)
+        face = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)[y:y + h, x:x + w]
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmpfile:
+            Image.fromarray(face).save(tmpfile.name)
+        try:
+            return cv2.imread(tmpfile.name)
+        finally:
+            os.unlink(tmpfile.name)
+    finally:
+        os.unlink(upload_path)
+
+
+def in_memory_handoff(upload):
+    img = decode_image(upload)
+    x, y, w, h = face_box(img)
+    face = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)[y:y + h, x:x + w]
+    return np.ascontiguousarray(face[:, :, ::-1])
+
+
+def read_proc_io():
+    try:
+        with open('/proc/self/io') as f:
+            return {key: int(value) for key, value in (line.split(':') for line in f)}
+    except OSError:
+        return None
+
+
+def run(name, fn, upload, iterations):
+    fn(upload)  # warm caches and lazy imports
+    before = read_proc_io()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(upload)
+        timings.append((time.perf_counter() - start) * 1000)
+    after = read_proc_io()
+
+    timings.sort()
+    result = {
+        'name': name,
+        'mean_ms': statistics.fmean(timings),
+        'p50_ms': timings[len(timings) // 2],
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+    }
+    if before and after:
+        # The counters include the reads of /proc/self/io itself, which cancel out across runs
+        for key in ('syscr', 'syscw', 'wchar'):
+            result[f'{key}_per_call'] = (after[key] - before[key]) / iterations
+    return result
+
+
+def run_with_models(upload, iterations):
+    from src.components.deepface_module_fastapi import extract_embedding, configure_pipeline
+    from src.components.model_registry import get_registry
+
+    get_registry().warm_up()
+
+    async def legacy():
+        configure_pipeline(tempfile_fallback=True)
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
+            temp_file.write(upload)
+        try:
+            return await extract_embedding(temp_file.name)
+        finally:
+            os.unlink(temp_file.name)
+
+    async def in_memory():
+        configure_pipeline(tempfile_fallback=False)
+        return await extract_embedding(upload)
+
+    results = []
+    for name, fn in (('legacy+models', legacy), ('in_memory+models', in_memory)):
+        results.append(run(name, lambda _: asyncio.run(fn()), upload, iterations))
+    return results
+
+
+def print_results(results):
+    keys = ['mean_ms', 'p50_ms', 'p95_ms', 'syscr_per_call', 'syscw_per_call', 'wchar_per_call']
+    print(f"{'path':<20}" + ''.join(f'{key:>16}' for key in keys))
+    for result in results:
+        print(f"{result['name']:<20}" + ''.join(
+            f'{result[key]:>16.2f}' if key in result else f"{'n/a':>16}" for key in keys))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--image', help="Use this image file as the upload instead of a synthetic one")
+    parser.add_argument('--with-models', action='store_true', help="Also time the full extract_embedding call")
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, 'rb') as f:
+            upload = f.read()
+    else:
+        upload = make_upload(args.width, args.height)
+
+    results = [
+        run('legacy', legacy_handoff, upload, args.iterations),
+        run('in_memory', in_memory_handoff, upload, args.iterations),
+    ]
+    if args.with_models:
+        results.extend(run_with_models(upload, args.iterations))
+    print(f"upload size: {len(upload) / 1024:.1f} KiB, iterations: {args.iterations}")
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Payload and latency of lean query projections, and of batched multi-vector queries.
+
+A local index server is filled with a synthetic gallery. For every top_k value the
+report shows the response size on the wire and the client latency (request, JSON
+parsing and decoding into a QueryResponse) of the ``values`` projection, which the
+query path used to request, against the ``ids`` projection the endpoints need.
+
+It then compares ways of answering --batch query vectors: one request per vector,
+concurrent requests, one multi-vector request, and in process a loop of single
+queries against NumpyIndex.query_many.
+
+Usage:
+    python benchmarks/query_payload_benchmark.py --index-size 50000 --top-k 1 10 50 100
+    python benchmarks/query_payload_benchmark.py --batch 32 --output query_report.json
+"""
+import argparse
+import json
+import time
+
+import httpx
+import numpy as np
+
+from src.components.index_client import IndexClient
+from src.components.index_server import IndexServer
+from src.components.vector_index import NumpyIndex, QueryResponse, projection_options
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def timed(fn, inputs):
+    fn(inputs[0])
+    timings = []
+    for value in inputs:
+        start = time.perf_counter()
+        fn(value)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'p50_ms': percentile(timings, 0.5), 'p95_ms': percentile(timings, 0.95),
+            'mean_ms': sum(timings) / len(timings)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--index-size', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, nargs='+', default=[1, 10, 50, 100])
+    parser.add_argument('--batch', type=int, default=16, help="Query vectors per batched call")
+    parser.add_argument('--output', help="Write the report as JSON")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    gallery = rng.standard_normal((args.index_size, 128)).astype(np.float32)
+    queries = gallery[rng.choice(args.index_size, args.queries)] + 0.01
+    index = NumpyIndex()
+    index.upsert([(f"vec-{i}", row) for i, row in enumerate(gallery)])
+    report = {'projection': [], 'batch': {}}
+
+    with IndexServer(index) as server, httpx.Client(base_url=server.url) as http:
+        client = IndexClient(server.url)
+        print(f"{'top_k':>6} {'projection':>10} {'bytes':>10} {'p50_ms':>9} {'p95_ms':>9}")
+        for top_k in args.top_k:
+            for projection in ('values', 'ids'):
+                options = projection_options(projection)
+                payload = {'vector': queries[0].tolist(), 'topK': top_k, 'includeValues': options['include_values']}
+                size = len(http.post('/query', json=payload).content)
+                latency = timed(lambda q: QueryResponse.decode(client.query(q, top_k=top_k, **options)), queries)
+                report['projection'].append({'top_k': top_k, 'projection': projection, 'bytes': size, **latency})
+                print(f"{top_k:>6} {projection:>10} {size:>10} {latency['p50_ms']:>9.2f} {latency['p95_ms']:>9.2f}")
+
+        batches = [queries[i:i + args.batch] for i in range(0, len(queries) - args.batch + 1, args.batch)]
+        top_k = max(args.top_k)
+        multi = IndexClient(server.url, multi_query_size=args.batch)
+        report['batch'] = {
+            'http_sequential': timed(lambda b: [client.query(q, top_k=top_k) for q in b], batches),
+            'http_concurrent': timed(lambda b: client.query_many(list(b), top_k=top_k), batches),
+            'http_multi_query': timed(lambda b: multi.query_many(list(b), top_k=top_k), batches),
+            'numpy_loop': timed(lambda b: [index.query(q, top_k=top_k) for q in b], batches),
+            'numpy_query_many': timed(lambda b: index.query_many(b, top_k=top_k), batches),
+        }
+        multi.close()
+        client.close()
+
+    print(f"\n{args.batch} vectors per call, top_k {top_k}:")
+    for name, latency in report['batch'].items():
+        print(f"{name:>18} p50 {latency['p50_ms']:8.2f} ms  p95 {latency['p95_ms']:8.2f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+Offline benchmark suite for the image pipeline and the index operations.
+
+Stages measured on a fixed local image corpus:
+    decode          cv2.imdecode of the encoded upload
+    detect          FaceDetector.detect_face at full resolution
+    detect_<side>   FaceDetector.detect_face on a copy downscaled to --detection-max-side
+    embed           one face crop through the embedding model
+    embed_batch     --batch-size crops in one forward pass (per-crop figures)
+    index_<op>      upsert, fetch, query, update and delete against a local index,
+                    in process (numpy) and over HTTP through the index client and the
+                    local index server (http)
+
+Each stage reports throughput and p50/p95/p99 latency. The detect and embed stages
+are skipped, with the reason recorded, when mtcnn or deepface cannot be loaded.
+
+The corpus is read from --corpus. If that folder has no images, a seeded synthetic
+corpus is generated into it first, so later runs measure the same inputs. Use a
+folder of real photos for detection numbers that mean something.
+
+Results go to --output as JSON. With --baseline the run is compared against an
+earlier result: a stage regresses when its p50 or p95 grows, or its throughput
+drops, by more than --threshold, and the script then exits with status 1.
+
+Usage:
+    python benchmarks/run_benchmarks.py --corpus benchmarks/corpus --output results.json
+    python benchmarks/run_benchmarks.py --corpus benchmarks/corpus --baseline baseline.json --threshold 0.15
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from src.components.deepface_module_fastapi import IMAGE_EXTENSIONS, decode_image
+from src.components.model_registry import get_registry
+from src.components.vector_index import NumpyIndex
+
+
+def synthetic_photo(rng, width, height):
+    # A face-like drawing on a noisy gradient: enough structure for realistic decode and detection cost
+    ys, xs = np.mgrid[0:height, 0:width]
+    img = np.stack([xs * 200 // width, ys * 200 // height, (xs + ys) * 120 // (width + height)], axis=-1)
+    img = (img + rng.integers(0, 30, size=img.shape)).clip(0, 255).astype(np.uint8)
+    size = int(min(width, height) * rng.uniform(0.2, 0.4))
+    cx = int(rng.integers(size, width - size))
+    cy = int(rng.integers(size, height - size))
+    cv2.ellipse(img, (cx, cy), (size // 2, int(size * 0.65)), 0, 0, 360, (140, 170, 220), -1)
+    for dx in (-size // 5, size // 5):
+        cv2.circle(img, (cx + dx, cy - size // 6), max(2, size // 14), (40, 30, 30), -1)
+    cv2.ellipse(img, (cx, cy + size // 4), (size // 5, max(2, size // 14)), 0, 0, 180, (60, 60, 150), -1)
+    return img
+
+
+def load_corpus(folder, size, width, height, seed=0):
+    os.makedirs(folder, exist_ok=True)
+    paths = sorted(entry.path for entry in os.scandir(folder) if entry.name.lower().endswith(IMAGE_EXTENSIONS))
+    if not paths:
+        print(f"Generating a synthetic corpus of {size} images in {folder}", flush=True)
+        rng = np.random.default_rng(seed)
+        for i in range(size):
+            path = os.path.join(folder, f"synthetic_{i:04d}.jpg")
+            cv2.imwrite(path, synthetic_photo(rng, width, height), [cv2.IMWRITE_JPEG_QUALITY, 90])
+            paths.append(path)
+    uploads = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            uploads.append((os.path.basename(path), f.read()))
+    return uploads
+
+
+def summarize(timings, items=None):
+    # timings are seconds per call; items is the number of items each call handled
+    ordered = sorted(timings)
+    total = sum(ordered)
+    items = items or 1
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000 / items
+
+    return {
+        'calls': len(ordered),
+        'throughput_per_s': len(ordered) * items / total if total else 0.0,
+        'mean_ms': total * 1000 / len(ordered) / items,
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+    }
+
+
+def measure(fn, inputs, repeat=1, warmup=1, items=None):
+    for value in inputs[:warmup]:
+        fn(value)
+    timings = []
+    for _ in range(repeat):
+        for value in inputs:
+            start = time.perf_counter()
+            fn(value)
+            timings.append(time.perf_counter() - start)
+    return summarize(timings, items)
+
+
+def centre_crop(img):
+    # Stand-in face crop for the embedding stages, so they run even when nothing is detected
+    h, w = img.shape[:2]
+    size = min(h, w) // 3
+    return np.ascontiguousarray(img[(h - size) // 2:(h + size) // 2, (w - size) // 2:(w + size) // 2])
+
+
+def bench_models(images, args, results, skipped):
+    try:
+        from src.components.face_detection import FaceDetector
+        get_registry().get_detector()
+    except Exception as e:
+        skipped['detect'] = f"MTCNN unavailable: {e}"
+    else:
+        detector = FaceDetector()
+        results['detect'] = measure(detector.detect_face, images, args.repeat)
+        downscaled = FaceDetector(max_side=args.detection_max_side)
+        results[f'detect_{args.detection_max_side}'] = measure(downscaled.detect_face, images, args.repeat)
+
+    try:
+        from src.components.deepface_module_fastapi import _represent, _represent_batch
+        get_registry().get_embedding_backend().load()
+    except Exception as e:
+        skipped['embed'] = f"Embedding model unavailable: {e}"
+        return
+    crops = [centre_crop(img) for img in images]
+    results['embed'] = measure(_represent, crops, args.repeat)
+    batches = [crops[i:i + args.batch_size] for i in range(0, len(crops) - args.batch_size + 1, args.batch_size)]
+    if batches:
+        results['embed_batch'] = measure(_represent_batch, batches, args.repeat, items=args.batch_size)
+
+
+def bench_index(index, prefix, args, results):
+    rng = np.random.default_rng(1)
+    gallery = rng.standard_normal((args.index_size, 128)).astype(np.float32)
+    ids = [f"vec-{i}" for i in range(args.index_size)]
+    batch = 100
+
+    upserts = [[(ids[j], gallery[j]) for j in range(i, min(i + batch, args.index_size))]
+               for i in range(0, args.index_size, batch)]
+    results[f'{prefix}_upsert'] = measure(lambda vectors: index.upsert(vectors=vectors), upserts, warmup=0,
+                                          items=batch)
+
+    queries = list(gallery[rng.choice(args.index_size, args.queries)] + 0.01)
+    results[f'{prefix}_query'] = measure(lambda q: index.query(vector=q, top_k=args.top_k), queries)
+
+    fetches = [ids[i:i + batch] for i in range(0, min(args.index_size, batch * 20), batch)]
+    results[f'{prefix}_fetch'] = measure(lambda chunk: index.fetch(ids=chunk), fetches, items=batch)
+
+    updates = list(range(min(args.queries, args.index_size)))
+    results[f'{prefix}_update'] = measure(lambda i: index.update(id=ids[i], values=gallery[i] * 0.5), updates)
+
+    deletes = [[ids[i]] for i in range(min(args.queries, args.index_size))]
+    results[f'{prefix}_delete'] = measure(lambda chunk: index.delete(ids=chunk), deletes, warmup=0)
+
+
+def compare(results, baseline, threshold, min_delta_ms=0.05):
+    """
+    Returns the regressions of ``results`` against ``baseline`` as readable strings.
+
+    Changes smaller than ``min_delta_ms`` are ignored, so microsecond-scale stages do
+    not flag timer noise as a regression.
+    """
+    regressions = []
+    for stage, current in results.items():
+        previous = baseline.get(stage)
+        if previous is None:
+            continue
+        for key in ('p50_ms', 'p95_ms'):
+            if previous[key] > 0 and current[key] > previous[key] * (1 + threshold) \
+                    and current[key] - previous[key] > min_delta_ms:
+                regressions.append(f"{stage}: {key} {previous[key]:.3f} -> {current[key]:.3f} "
+                                   f"(+{(current[key] / previous[key] - 1) * 100:.0f}%)")
+        if previous['throughput_per_s'] > 0 and \
+                current['throughput_per_s'] < previous['throughput_per_s'] * (1 - threshold) and \
+                current['mean_ms'] - previous['mean_ms'] > min_delta_ms:
+            regressions.append(f"{stage}: throughput {previous['throughput_per_s']:.1f} -> "
+                               f"{current['throughput_per_s']:.1f}/s "
+                               f"({(current['throughput_per_s'] / previous['throughput_per_s'] - 1) * 100:.0f}%)")
+    return regressions
+
+
+def print_results(results, skipped):
+    keys = ['throughput_per_s', 'p50_ms', 'p95_ms', 'p99_ms']
+    print(f"{'stage':<20}" + ''.join(f'{key:>18}' for key in keys))
+    for stage, result in results.items():
+        print(f"{stage:<20}" + ''.join(f'{result[key]:>18.3f}' for key in keys))
+    for stage, reason in skipped.items():
+        print(f"{stage:<20}skipped: {reason}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default='benchmarks/corpus')
+    parser.add_argument('--corpus-size', type=int, default=32)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--repeat', type=int, default=3, help="Passes over the corpus per image stage")
+    parser.add_argument('--detection-max-side', type=int, default=1024)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--index-size', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--skip-models', action='store_true', help="Do not run the detect and embed stages")
+    parser.add_argument('--skip-http', action='store_true', help="Do not run the index stages over HTTP")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help="Earlier results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Allowed relative slowdown per stage")
+    parser.add_argument('--min-delta-ms', type=float, default=0.05, help="Ignore slowdowns smaller than this")
+    args = parser.parse_args(argv)
+
+    uploads = load_corpus(args.corpus, args.corpus_size, args.width, args.height)
+    results, skipped = {}, {}
+
+    results['decode'] = measure(decode_image, [data for _, data in uploads], args.repeat)
+    images = [decode_image(data) for _, data in uploads]
+    if args.skip_models:
+        skipped['detect'] = skipped['embed'] = "--skip-models"
+    else:
+        bench_models(images, args, results, skipped)
+
+    bench_index(NumpyIndex(), 'index_numpy', args, results)
+    if args.skip_http:
+        skipped['index_http'] = "--skip-http"
+    else:
+        from src.components.index_client import IndexClient
+        from src.components.index_server import IndexServer
+        with IndexServer() as server:
+            client = IndexClient(server.url)
+            try:
+                bench_index(client, 'index_http', args, results)
+            finally:
+                client.close()
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'corpus': {'folder': args.corpus, 'images': len(uploads),
+                       'mean_bytes': int(np.mean([len(data) for _, data in uploads]))},
+            'args': vars(args),
+        },
+        'results': results,
+        'skipped': skipped,
+    }
+    print_results(results, skipped)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.threshold, args.min_delta_ms)
+        report['regressions'] = regressions
+        if regressions:
+            print(f"\n{len(regressions)} regressions against {args.baseline} (threshold {args.threshold:.0%}):")
+            for regression in regressions:
+                print(f"  {regression}")
+            status = 1
+        else:
+            print(f"\nNo regressions against {args.baseline} (threshold {args.threshold:.0%}).")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# admission.py
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request is turned away instead of being queued.
+
+    Attributes:
+        reason (str): ``queue_full``, ``queue_timeout`` or ``key_quota``.
+        retry_after (int): Suggested seconds before the client retries.
+    """
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Request rejected by admission control: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounded admission in front of the inference endpoints.
+
+    At most ``max_concurrency`` requests run at once. Up to ``max_queue`` more wait for
+    a slot, each for at most ``max_queue_wait_s`` seconds. Anything beyond that is
+    rejected immediately with a Retry-After estimate, instead of piling up on the
+    thread pool until latency and memory run away. With ``per_key_limit`` set, one API
+    key cannot hold more than that many running plus queued requests.
+
+    The controller is used from a single event loop, so plain counters are safe.
+    """
+
+    def __init__(self, max_concurrency=8, max_queue=32, max_queue_wait_s=2.0, per_key_limit=None):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1.")
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_wait_s = max_queue_wait_s
+        self.per_key_limit = per_key_limit
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._per_key = {}
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = {'queue_full': 0, 'queue_timeout': 0, 'key_quota': 0}
+        self.total_queue_wait_s = 0.0
+        self.max_observed_queue_wait_s = 0.0
+        # Exponentially weighted service time, used for the Retry-After estimate
+        self._service_time_s = 0.5
+
+    def retry_after(self):
+        # Time for the running and queued requests ahead to drain through the slots
+        backlog = self.in_flight + self.queued + 1
+        return max(1, math.ceil(self._service_time_s * backlog / self.max_concurrency))
+
+    def _reject(self, reason):
+        self.rejected[reason] += 1
+        raise AdmissionRejected(reason, self.retry_after())
+
+    async def _wait_for_slot(self):
+        self.queued += 1
+        enqueued = time.monotonic()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_queue_wait_s)
+        except asyncio.TimeoutError:
+            self._reject('queue_timeout')
+        finally:
+            self.queued -= 1
+            waited = time.monotonic() - enqueued
+            self.total_queue_wait_s += waited
+            self.max_observed_queue_wait_s = max(self.max_observed_queue_wait_s, waited)
+
+    @asynccontextmanager
+    async def admit(self, key=None):
+        """
+        Holds an execution slot for the duration of the ``async with`` block.
+
+        Args:
+            key (str, optional): The caller's API key, for per-key quotas.
+
+        Raises:
+            AdmissionRejected: If the queue is full, the queue-time budget runs out or
+                the key is over its quota.
+        """
+        if self.per_key_limit is not None and key is not None and self._per_key.get(key, 0) >= self.per_key_limit:
+            self._reject('key_quota')
+        if self._semaphore.locked() and self.queued >= self.max_queue:
+            self._reject('queue_full')
+
+        if key is not None:
+            self._per_key[key] = self._per_key.get(key, 0) + 1
+        try:
+            if self._semaphore.locked():
+                await self._wait_for_slot()
+            else:
+                # A free slot is taken without suspending, so only real waiters count as queued
+                await self._semaphore.acquire()
+
+            self.in_flight += 1
+            self.admitted += 1
+            started = time.monotonic()
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+                self._semaphore.release()
+                self._service_time_s = 0.8 * self._service_time_s + 0.2 * (time.monotonic() - started)
+        finally:
+            if key is not None:
+                self._per_key[key] -= 1
+                if not self._per_key[key]:
+                    del self._per_key[key]
+
+    def stats(self):
+        """
+        Returns queue and rejection metrics for dashboards and autoscaling.
+        """
+        waits = self.admitted + self.rejected['queue_timeout']  # immediate admissions count as zero wait
+        return {
+            'max_concurrency': self.max_concurrency,
+            'max_queue': self.max_queue,
+            'max_queue_wait_s': self.max_queue_wait_s,
+            'in_flight': self.in_flight,
+            'queued': self.queued,
+            'utilization': (self.in_flight + self.queued) / (self.max_concurrency + self.max_queue),
+            'admitted': self.admitted,
+            'rejected': dict(self.rejected),
+            'mean_queue_wait_s': self.total_queue_wait_s / waits if waits else 0.0,
+            'max_queue_wait_observed_s': self.max_observed_queue_wait_s,
+            'service_time_ewma_s': self._service_time_s,
+        }
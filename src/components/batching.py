@@ -0,0 +1,139 @@
+# batching.py
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from src.exception import CustomException
+from src.logger import logging
+
+
+class MicroBatcher:
+    """
+    Collects items submitted from many threads and processes them in batches.
+
+    A single background thread takes the first queued item, then keeps collecting
+    until either ``max_batch_size`` items are gathered or ``max_wait_ms`` has passed
+    since the first one arrived. The whole batch is handed to ``batch_fn`` in one
+    call, and each caller receives its own result through a Future.
+
+    ``batch_fn`` must take a list of items and return a list of results of the same
+    length and order. If it raises, every caller in that batch gets the exception.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=16, max_wait_ms=5.0, name='batcher'):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1.")
+        if max_wait_ms < 0:
+            raise ValueError("max_wait_ms cannot be negative.")
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._last_batch_size = 0
+        self._batch_size_counts = [0] * (max_batch_size + 1)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"{name}-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """
+        Queues an item for the next batch.
+
+        Args:
+            item: The item to process.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the result for this item. Async callers
+            can await it through ``asyncio.wrap_future``.
+        """
+        if self._closed:
+            raise CustomException(f"{self.name} is closed.", sys)
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item):
+        """
+        Submits an item and blocks the calling thread until its result is ready.
+        """
+        return self.submit(item).result()
+
+    def close(self):
+        """
+        Stops the worker after the items already queued have been processed.
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+
+    def stats(self):
+        """
+        Returns queue depth and batch fill metrics.
+
+        Returns:
+            dict: ``queue_depth`` (items waiting), ``batches`` and ``items`` processed so far,
+            ``mean_batch_size``, ``mean_batch_fill`` (mean batch size / max batch size),
+            ``last_batch_size`` and ``batch_size_counts`` (number of batches per size).
+        """
+        with self._stats_lock:
+            mean_batch_size = self._items / self._batches if self._batches else 0.0
+            return {
+                'name': self.name,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'queue_depth': self._queue.qsize(),
+                'batches': self._batches,
+                'items': self._items,
+                'mean_batch_size': mean_batch_size,
+                'mean_batch_fill': mean_batch_size / self.max_batch_size,
+                'last_batch_size': self._last_batch_size,
+                'batch_size_counts': {size: count for size, count in enumerate(self._batch_size_counts) if count},
+            }
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Drain anything already queued without waiting, then wait out the budget
+                entry = self._queue.get_nowait() if remaining <= 0 else self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                self._queue.put(None)  # keep the shutdown marker for the main loop
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            items = [item for item, _ in batch]
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise ValueError(f"{self.name}: batch_fn returned {len(results)} results for {len(items)} items.")
+            except Exception as e:
+                logging.error(f"{self.name}: batch of {len(items)} failed: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._last_batch_size = len(batch)
+                self._batch_size_counts[len(batch)] += 1
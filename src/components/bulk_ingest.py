@@ -0,0 +1,284 @@
+"""
+Resumable, parallel bulk ingest of an image folder into the index.
+
+Images are streamed from the folder and sent to a pool of worker processes, each
+of which loads MTCNN and Facenet once and runs detection and embedding. The parent
+collects the embeddings and upserts them in large batches. After every batch it
+appends the processed file ids to a checkpoint file. If the run crashes or is
+interrupted, the next run with the same checkpoint skips everything already
+written.
+
+Usage:
+    python -m src.components.bulk_ingest /data/images --workers 4 --batch-size 500
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from src.exception import CustomException
+from src.logger import logging
+# deepface_module_fastapi imports its models lazily, so the parent process never loads TensorFlow
+from src.components.deepface_module_fastapi import IMAGE_EXTENSIONS, embedding_settings
+from src.components.pinecone_module_fastapi import insert_to_index_full_sync
+from src.components.vector_index import create_index
+
+
+def iter_images(folder, recursive=False):
+    """
+    Streams the image files of a folder without listing it into memory first.
+
+    Args:
+        folder (str): The folder to scan.
+        recursive (bool): Whether to descend into sub-folders.
+
+    Yields:
+        str: The path of each image file, in directory order.
+    """
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    yield from iter_images(entry.path, recursive)
+            elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield entry.path
+
+
+def file_id_for(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class Checkpoint:
+    """
+    Append-only record of the file ids that are already done.
+
+    Each line is a JSON object ``{"id": ..., "status": ..., ...}`` with status
+    ``inserted``, ``skipped_existing`` or ``failed``.
+    Records are flushed and fsynced per batch, so a crash loses at most the batch
+    that was in flight.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self.failed = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn last line from a crash
+                    (self.failed if record['status'] == 'failed' else self.done).add(record['id'])
+        self._file = open(path, 'a')
+
+    def record(self, records):
+        for record in records:
+            self._file.write(json.dumps(record) + '\n')
+            (self.failed if record['status'] == 'failed' else self.done).add(record['id'])
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def _init_worker(intra_op_threads, detection_max_side=None, detection_min_face_size=None, embedding_settings=None):
+    # Pin TensorFlow's thread pools so N workers do not oversubscribe the CPUs
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(intra_op_threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    os.environ['OMP_NUM_THREADS'] = str(intra_op_threads)
+    from src.components.deepface_module_fastapi import configure_pipeline, warm_up_pipeline
+    # An ONNX session gets the worker's thread share unless its own counts are configured
+    embedding_settings = dict(embedding_settings or {})
+    embedding_settings['onnx_intra_op_threads'] = embedding_settings.get('onnx_intra_op_threads') or intra_op_threads
+    embedding_settings['onnx_inter_op_threads'] = embedding_settings.get('onnx_inter_op_threads') or 1
+    configure_pipeline(detection_max_side=detection_max_side, detection_min_face_size=detection_min_face_size,
+                       **embedding_settings)
+    warm_up_pipeline()
+
+
+def _embed_path(path):
+    from src.components.deepface_module_fastapi import _extract_embedding_sync
+    try:
+        embedding, error = _extract_embedding_sync(path)
+    except Exception as e:
+        embedding, error = None, str(e)
+    return path, embedding, error
+
+
+class Progress:
+    def __init__(self, total, interval=5.0):
+        self.total = total
+        self.interval = interval
+        self.start = time.monotonic()
+        self.last_report = self.start
+        self.processed = 0
+        self.inserted = 0
+        self.failed = 0
+
+    def update(self, processed=0, inserted=0, failed=0, force=False):
+        self.processed += processed
+        self.inserted += inserted
+        self.failed += failed
+        now = time.monotonic()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        elapsed = now - self.start
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        remaining = max(self.total - self.processed, 0)
+        eta = remaining / rate if rate > 0 else float('inf')
+        eta_text = time.strftime('%H:%M:%S', time.gmtime(eta)) if eta != float('inf') else '--:--:--'
+        message = (f"{self.processed}/{self.total} processed, {self.inserted} inserted, {self.failed} failed, "
+                   f"{rate:.1f} img/s, ETA {eta_text}")
+        print(message, flush=True)
+        logging.info(message)
+
+
+def ingest(index, folder, checkpoint_path, workers=None, batch_size=500, recursive=False,
+           retry_failed=False, intra_op_threads=1, progress_interval=5.0, detection_max_side=None,
+           detection_min_face_size=None, embedding_settings=None):
+    """
+    Embeds every image of a folder and upserts the embeddings in batches.
+
+    Args:
+        index: The index to write to (see create_index).
+        folder (str): The image folder. File names without extension become the vector ids.
+        checkpoint_path (str): Where progress is recorded; reusing it resumes a run.
+        workers (int, optional): Worker processes; defaults to the CPU count.
+        batch_size (int): Embeddings per upsert.
+        recursive (bool): Whether to descend into sub-folders.
+        retry_failed (bool): Process images that failed in a previous run again.
+        intra_op_threads (int): TensorFlow intra-op threads per worker.
+        progress_interval (float): Seconds between progress lines.
+        detection_max_side (int, optional): Longest side MTCNN runs at; faces are still cropped at full resolution.
+        detection_min_face_size (int, optional): Smallest face MTCNN looks for, in detection pixels.
+        embedding_settings (dict, optional): The embedding backend of the workers, as returned by
+            ``embedding_settings(config)``; it must match the app's, or the gallery mixes models.
+
+    Returns:
+        dict: Counts of processed, inserted, failed and skipped images.
+    """
+    checkpoint = Checkpoint(checkpoint_path)
+    skip = checkpoint.done if retry_failed else checkpoint.done | checkpoint.failed
+    # Counting is a cheap directory scan; the paths themselves are streamed again below
+    total = sum(1 for path in iter_images(folder, recursive) if file_id_for(path) not in skip)
+    skipped = len(skip)
+    progress = Progress(total, progress_interval)
+    workers = workers or os.cpu_count() or 1
+    print(f"Ingesting {total} images from {folder} with {workers} workers ({skipped} already done).", flush=True)
+
+    pending_ids, pending_embeddings, pending_records = [], [], []
+
+    def flush():
+        if pending_ids:
+            report = insert_to_index_full_sync(index, list(pending_ids), list(pending_embeddings))
+            # Ids whose request failed are not checkpointed, so the next run retries them
+            retry = set(report['failed'])
+            invalid = set(report['invalid'])
+            existing = set(report['skipped_existing'])
+            for record in pending_records:
+                if record['id'] in invalid:
+                    record.update(status='failed', error='Invalid embedding.')
+                elif record['id'] in existing:
+                    record['status'] = 'skipped_existing'
+
+            pending_records[:] = [record for record in pending_records if record['id'] not in retry]
+            progress.update(inserted=len(report['inserted']), failed=len(invalid) + len(retry))
+        checkpoint.record(pending_records)
+        pending_ids.clear()
+        pending_embeddings.clear()
+        pending_records.clear()
+
+    # spawn keeps TensorFlow state out of the children; a bounded window keeps memory flat
+    context = multiprocessing.get_context('spawn')
+    max_in_flight = workers * 4
+    paths = (path for path in iter_images(folder, recursive) if file_id_for(path) not in skip)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=_init_worker,
+                                 initargs=(intra_op_threads, detection_max_side, detection_min_face_size,
+                                           embedding_settings)) as pool:
+            in_flight = set()
+            exhausted = False
+            while in_flight or not exhausted:
+                while not exhausted and len(in_flight) < max_in_flight:
+                    path = next(paths, None)
+                    if path is None:
+                        exhausted = True
+                    else:
+                        in_flight.add(pool.submit(_embed_path, path))
+                if not in_flight:
+                    break
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, embedding, error = future.result()
+                    file_id = file_id_for(path)
+                    if error:
+                        logging.info(f"{error} in image {path}")
+                        pending_records.append({'id': file_id, 'status': 'failed', 'error': error})
+                        progress.update(failed=1)
+                    else:
+                        pending_ids.append(file_id)
+                        pending_embeddings.append(embedding)
+                        pending_records.append({'id': file_id, 'status': 'inserted'})
+                    progress.update(processed=1)
+                if len(pending_records) >= batch_size:
+                    flush()
+            flush()
+    except Exception as e:
+        raise CustomException(e, sys) from e
+    finally:
+        checkpoint.close()
+
+    progress.update(force=True)
+    return {'processed': progress.processed, 'inserted': progress.inserted,
+            'failed': progress.failed, 'skipped': skipped}
+
+
+def load_config(file_path):
+    with open(file_path, 'r') as file:
+        return json.load(file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('folder', help="Folder of images; file names (without extension) become vector ids")
+    parser.add_argument('--config', default='config.json')
+    parser.add_argument('--checkpoint', default=None, help="Progress file (default: <folder>/.ingest_checkpoint.jsonl)")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--intra-op-threads', type=int, default=1)
+    parser.add_argument('--recursive', action='store_true')
+    parser.add_argument('--retry-failed', action='store_true')
+    parser.add_argument('--detection-max-side', type=int, default=None,
+                        help="Run MTCNN on images downscaled to this longest side (default: DETECTION_MAX_SIDE)")
+    parser.add_argument('--min-face-size', type=int, default=None,
+                        help="Smallest face MTCNN looks for (default: DETECTION_MIN_FACE_SIZE)")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    if config.get('INDEX_BACKEND', 'pinecone') == 'pinecone':
+        import pinecone
+        pinecone.init(api_key=config['API_KEY_PINECONE'], environment=config['ENVIRONMENT'])
+        if config['INDEX_NAME'] not in pinecone.list_indexes():
+            pinecone.create_index(name=config['INDEX_NAME'], dimension=config.get('DIMENSIONS', 128))
+            logging.info(f"Created new Pinecone index: {config['INDEX_NAME']}")
+    index = create_index(config)
+
+    checkpoint = args.checkpoint or os.path.join(args.folder, '.ingest_checkpoint.jsonl')
+    summary = ingest(index, args.folder, checkpoint, workers=args.workers, batch_size=args.batch_size,
+                     recursive=args.recursive, retry_failed=args.retry_failed,
+                     intra_op_threads=args.intra_op_threads,
+                     detection_max_side=args.detection_max_side or config.get('DETECTION_MAX_SIDE'),
+                     detection_min_face_size=args.min_face_size or config.get('DETECTION_MIN_FACE_SIZE'),
+                     embedding_settings=embedding_settings(config))
+    print(f"Done: {summary}")
+    return summary
+
+
+if __name__ == "__main__":
+    main()
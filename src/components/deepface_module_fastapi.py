@@ -1,16 +1,336 @@
 import asyncio
-from deepface import DeepFace
-from deepface.commons import functions
-import cv2
 import tempfile
 import sys
-from PIL import Image
+import time
 import numpy as np
 from src.exception import CustomException
 from src.logger import logging
 from src.components.face_detection import FaceDetector
+from src.components.model_registry import get_registry
+from src.components.batching import MicroBatcher
+from src.components.embedding_cache import EmbeddingCache
+from src.components.metrics import stage_timer
+import threading
 import os
 
+# cv2, PIL and the embedding backend (DeepFace loads TensorFlow) are imported inside the
+# functions that use them, so importing this module, and the app with it, takes milliseconds.
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+# Pipeline settings, overridden from config.json through configure_pipeline()
+PIPELINE_SETTINGS = {
+    # Hand the face crop to DeepFace through a temporary JPEG file (legacy behaviour)
+    'tempfile_fallback': False,
+    # Coalesce concurrent face crops into one batched forward pass
+    'batching': False,
+    'batch_max_size': 16,
+    'batch_max_wait_ms': 5.0,
+    # Content-addressed embedding cache keyed by the decoded pixels
+    'cache': False,
+    'cache_max_bytes': 64 * 1024 * 1024,
+    'cache_disk_path': None,
+    'cache_disk_capacity': 1 << 20,
+    # 'thread' runs the models in the asyncio.to_thread worker; 'process' in a process pool
+    'executor': 'thread',
+    'process_workers': None,
+    'intra_op_threads': 1,
+    'inter_op_threads': 1,
+    # Run MTCNN on a copy downscaled to this longest side (None: full resolution) and crop from the original
+    'detection_max_side': None,
+    # Smallest face MTCNN looks for, in pixels of the image it sees (None: MTCNN's default of 20)
+    'detection_min_face_size': None,
+    # 'tensorflow' runs the DeepFace Keras model; 'onnx' its ONNX export under ONNX Runtime
+    'embedding_backend': 'tensorflow',
+    'onnx_model_path': None,
+    'onnx_intra_op_threads': None,
+    'onnx_inter_op_threads': None,
+    # Preprocess crops as DeepFace.represent does, re-running the Haar detector (tensorflow only);
+    # off, crops are only resized and padded, which changes the embeddings of the existing gallery
+    'haar_redetect': True,
+}
+
+# The settings that select the embedding backend, also handed to the process workers
+EMBEDDING_SETTINGS = ('embedding_backend', 'onnx_model_path', 'onnx_intra_op_threads', 'onnx_inter_op_threads',
+                      'haar_redetect')
+
+
+def embedding_settings(config):
+    """
+    Reads the embedding backend settings from config.json.
+
+    Everything that writes to or queries the gallery (the app, bulk ingest) must
+    embed with the same backend and preprocessing, so they all read them here.
+
+    Args:
+        config (dict): The loaded config.json.
+
+    Returns:
+        dict: The EMBEDDING_SETTINGS keys, for configure_pipeline.
+    """
+    return {
+        'embedding_backend': config.get('EMBEDDING_BACKEND', 'tensorflow'),
+        'onnx_model_path': config.get('EMBEDDING_ONNX_PATH'),
+        'onnx_intra_op_threads': config.get('EMBEDDING_ONNX_INTRA_OP_THREADS'),
+        'onnx_inter_op_threads': config.get('EMBEDDING_ONNX_INTER_OP_THREADS'),
+        'haar_redetect': config.get('EMBEDDING_HAAR_REDETECT', True),
+    }
+
+_batcher = None
+_cache = None
+_detector = None
+_executor = None
+_shared_lock = threading.Lock()
+
+
+def configure_pipeline(**settings):
+    """
+    Updates the embedding pipeline settings.
+
+    Args:
+        **settings: Any of the keys of PIPELINE_SETTINGS.
+
+    Raises:
+        ValueError: If an unknown setting is given.
+    """
+    unknown = set(settings) - set(PIPELINE_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown pipeline settings: {sorted(unknown)}")
+    PIPELINE_SETTINGS.update(settings)
+    get_registry().configure_backend(PIPELINE_SETTINGS['embedding_backend'],
+                                     **{key: PIPELINE_SETTINGS[key] for key in EMBEDDING_SETTINGS[1:]})
+
+    # Drop the batcher, cache, detector and executor so the next request builds them with the new settings
+    global _batcher, _cache, _detector, _executor
+    with _shared_lock:
+        _detector = None
+        if _batcher is not None:
+            _batcher.close()
+            _batcher = None
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+        if _cache is not None:
+            _cache.close()
+            _cache = None
+
+
+def get_batcher():
+    """
+    Returns the shared embedding batcher, building it from PIPELINE_SETTINGS on first use.
+
+    Returns:
+        MicroBatcher: The batcher in front of the embedding model.
+    """
+    global _batcher
+    if _batcher is None:
+        with _shared_lock:
+            if _batcher is None:
+                _batcher = MicroBatcher(_represent_batch,
+                                        max_batch_size=PIPELINE_SETTINGS['batch_max_size'],
+                                        max_wait_ms=PIPELINE_SETTINGS['batch_max_wait_ms'],
+                                        name='embedding-batcher')
+    return _batcher
+
+
+def get_face_detector():
+    """
+    Returns the shared face detector, built with the detection settings of PIPELINE_SETTINGS.
+
+    Returns:
+        FaceDetector: The detector used by every request.
+    """
+    global _detector
+    if _detector is None:
+        with _shared_lock:
+            if _detector is None:
+                _detector = FaceDetector(max_side=PIPELINE_SETTINGS['detection_max_side'],
+                                         min_face_size=PIPELINE_SETTINGS['detection_min_face_size'])
+    return _detector
+
+
+def get_batching_stats():
+    """
+    Returns the queue depth and batch fill metrics of the embedding batcher.
+
+    Returns:
+        dict: The batcher statistics, or ``{'enabled': False}`` when batching is off.
+    """
+    if not PIPELINE_SETTINGS['batching']:
+        return {'enabled': False}
+    return {'enabled': True, **get_batcher().stats()}
+
+
+def cache_namespace():
+    """
+    Returns the name the embedding cache is keyed under.
+
+    A cached embedding depends on the embedding model and on how the face was found and
+    cropped, so the name covers the backend's model name, the detection settings and
+    the temporary-file fallback (which re-encodes the crop as JPEG).
+
+    Returns:
+        str: E.g. ``Facenet|detection_max_side=None|detection_min_face_size=None|tempfile_fallback=False``.
+    """
+    return '|'.join([get_registry().embedding_name] +
+                    [f"{key}={PIPELINE_SETTINGS[key]}"
+                     for key in ('detection_max_side', 'detection_min_face_size', 'tempfile_fallback')])
+
+
+def get_embedding_cache():
+    """
+    Returns the shared embedding cache, or None when caching is disabled.
+
+    The cache follows ``cache_namespace``, so switching models, backends, ONNX exports
+    or detection settings invalidates it.
+
+    Returns:
+        EmbeddingCache: The cache in front of detection and embedding.
+    """
+    global _cache
+    if not PIPELINE_SETTINGS['cache']:
+        return None
+    model_name = cache_namespace()
+    # Under the lock, so configure_pipeline cannot close the cache between the check and the rename
+    with _shared_lock:
+        if _cache is None:
+            _cache = EmbeddingCache(model_name,
+                                    max_bytes=PIPELINE_SETTINGS['cache_max_bytes'],
+                                    disk_path=PIPELINE_SETTINGS['cache_disk_path'],
+                                    disk_capacity=PIPELINE_SETTINGS['cache_disk_capacity'])
+        else:
+            _cache.set_model_name(model_name)
+        return _cache
+
+
+def get_inference_executor():
+    """
+    Returns the shared process-pool executor, or None when models run in-thread.
+
+    Returns:
+        ProcessInferenceExecutor: The pool of model worker processes.
+    """
+    global _executor
+    if PIPELINE_SETTINGS['executor'] != 'process':
+        return None
+    if _executor is None:
+        with _shared_lock:
+            if _executor is None:
+                from src.components.inference_executor import ProcessInferenceExecutor
+                _executor = ProcessInferenceExecutor(workers=PIPELINE_SETTINGS['process_workers'],
+                                                     intra_op_threads=PIPELINE_SETTINGS['intra_op_threads'],
+                                                     inter_op_threads=PIPELINE_SETTINGS['inter_op_threads'],
+                                                     detection_max_side=PIPELINE_SETTINGS['detection_max_side'],
+                                                     detection_min_face_size=PIPELINE_SETTINGS['detection_min_face_size'],
+                                                     embedding_settings={key: PIPELINE_SETTINGS[key]
+                                                                         for key in EMBEDDING_SETTINGS})
+    return _executor
+
+
+def shutdown_pipeline():
+    """
+    Stops the batcher and the worker processes and flushes the disk cache.
+    """
+    configure_pipeline()
+
+
+def warm_up_pipeline():
+    """
+    Loads the models and runs a dummy image through detection and embedding.
+
+    The first forward pass of a TensorFlow model traces its graph (and ONNX Runtime
+    allocates its buffers), which would otherwise be paid by the first real request.
+    The warm-up uses the same detection settings and embedding path (batched or not)
+    as real requests.
+
+    Returns:
+        dict: Seconds spent loading the models and on the dummy detection and embedding.
+    """
+    timings = {}
+    start = time.perf_counter()
+    get_registry().warm_up(PIPELINE_SETTINGS['detection_min_face_size'])
+    timings['load_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # _detect rather than detect_face keeps the dummy pass out of the latency metrics
+    get_face_detector()._detect(np.zeros((480, 640, 3), dtype=np.uint8))
+    timings['detect_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    face = np.zeros((160, 160, 3), dtype=np.uint8)
+    if PIPELINE_SETTINGS['batching']:
+        _represent_batch([face])
+    else:
+        _represent(face)
+    timings['embed_s'] = time.perf_counter() - start
+    logging.info(f"Pipeline warmed up: {timings}")
+    return timings
+
+
+def get_cache_stats():
+    """
+    Returns the hit, miss and eviction counters of the embedding cache.
+
+    Returns:
+        dict: The cache statistics, or ``{'enabled': False}`` when caching is off.
+    """
+    cache = get_embedding_cache()
+    if cache is None:
+        return {'enabled': False}
+    return {'enabled': True, **cache.stats()}
+
+
+
+def decode_image(buffer):
+    """
+    Decodes an encoded image (JPEG, PNG, ...) held in memory into a BGR array.
+
+    Args:
+        buffer (bytes, bytearray or memoryview): The encoded image bytes.
+
+    Returns:
+        numpy.ndarray: The decoded image in BGR channel order.
+
+    Raises:
+        ValueError: If the buffer is empty or cannot be decoded.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if data.size == 0:
+        raise ValueError("Image buffer is empty.")
+    import cv2
+    img = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Image buffer cannot be decoded.")
+    return img
+
+
+def load_image(image_input):
+    """
+    Converts any supported image input into a BGR array.
+
+    Args:
+        image_input (str, bytes, numpy.ndarray or PIL.Image.Image): A file path, the encoded
+            image bytes, a BGR array or a PIL image.
+
+    Returns:
+        numpy.ndarray: The image in BGR channel order, as OpenCV expects.
+    """
+    if isinstance(image_input, str):
+        import cv2
+        img = cv2.imread(image_input)
+        if img is None:
+            raise ValueError(f"Image at {image_input} cannot be read.")
+        return img
+    if isinstance(image_input, (bytes, bytearray, memoryview)):
+        return decode_image(image_input)
+    if isinstance(image_input, np.ndarray):
+        return image_input
+    from PIL import Image
+    if isinstance(image_input, Image.Image):
+        img = np.array(image_input.convert('RGB'))
+        return img[:, :, ::-1]  # Convert RGB to BGR, which OpenCV expects
+    raise ValueError("Invalid image input. Must be a file path, image bytes, a numpy array or a PIL image.")
+
 
 
 async def extract_embedding(image_input):
@@ -18,7 +338,8 @@ async def extract_embedding(image_input):
     Extracts the facial embedding from an image asynchronously.
 
     Args:
-        image_input (str or PIL.Image.Image): The path to the image file or the image as a PIL image object.
+        image_input (str, bytes, numpy.ndarray or PIL.Image.Image): The path to the image file,
+            the encoded image bytes (e.g. an upload buffer), a BGR array or a PIL image object.
 
     Returns:
         tuple: A tuple containing the facial embedding (numpy array) and an error message (str).
@@ -35,44 +356,176 @@ async def extract_embedding(image_input):
         raise CustomException(str(e), sys)
 
 def _extract_embedding_sync(image_input):
-    
+
     try:
-        # Check if the input is a file path (string) or an image (PIL image)
-        if isinstance(image_input, str):
-            img = cv2.imread(image_input)
-            if img is None:
-                raise ValueError(f"Image at {image_input} cannot be read.")
-        elif isinstance(image_input, Image.Image):
-            img = np.array(image_input)
-            img = img[:, :, ::-1]  # Convert RGB to BGR, which OpenCV expects
-        else:
-            raise ValueError("Invalid image input. Must be a file path or a PIL image.")
+        with stage_timer('decode'):
+            img = load_image(image_input)
+    except Exception as e:
+        error_info = {
+            "error_message": str(e),
+            "type": str(type(e)),
+            "image_input_type": str(type(image_input)),
+            "image_shape": 'Image not processed',
+            "face_shape": 'Face not detected'
+        }
+        raise CustomException(f"Error during embedding extraction: {error_info}", sys)
 
-        # Initialize the FaceDetector and detect face
-        face_detector = FaceDetector()
-        face = face_detector.detect_face(img)
+    # A repeat image costs one hash and one lookup
+    cache = get_embedding_cache()
+    if cache is not None:
+        cache_key = cache.key(img)
+        embedding = cache.get(cache_key)
+        if embedding is not None:
+            return embedding, None
+
+    executor = get_inference_executor()
+    if executor is not None:
+        # Blocks this thread (not the GIL) while a worker process runs the models
+        with stage_timer('inference'):
+            embedding, error = executor.run(img)
+    else:
+        embedding, error = _embed_image(img)
+    if embedding is not None and cache is not None:
+        cache.put(cache_key, embedding)
+    return embedding, error
+
+
+def _embed_image(img):
+    """
+    Runs face detection and embedding on a decoded BGR image, without the cache.
+
+    Returns:
+        tuple: ``(embedding, error)`` as returned by extract_embedding.
+    """
+    try:
+        # Detect the face with the shared MTCNN detector from the model registry
+        face = get_face_detector().detect_face(img)
         if face is None:
             return None, "No face detected in the image."
-        
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmpfile:
-            face_image = Image.fromarray(face)  # Convert NumPy array to PIL Image
-            face_image.save(tmpfile.name)
-        
-
-        # Proceed with embedding extraction
-        embedding = DeepFace.represent(tmpfile.name, model_name='Facenet', enforce_detection=False)
+
+        # The detector returns an RGB crop; DeepFace expects BGR like cv2.imread gives it
+        face_bgr = np.ascontiguousarray(face[:, :, ::-1])
+        with stage_timer('embed'):
+            if PIPELINE_SETTINGS['tempfile_fallback']:
+                embedding = _represent_via_tempfile(face)
+            elif PIPELINE_SETTINGS['batching']:
+                # Blocks this worker thread until the batch containing the crop has run
+                embedding = get_batcher()(face_bgr)
+            else:
+                embedding = _represent(face_bgr)
         if embedding is None:
             return None, "Embedding could not be created."
-        os.unlink(tmpfile.name)
         return embedding, None
     except Exception as e:
         # Here, we're adding more details to understand the error better
         error_info = {
             "error_message": str(e),
             "type": str(type(e)),
-            "image_input_type": str(type(image_input)),
-            "image_shape": str(img.shape if 'img' in locals() else 'Image not processed'),
-            "face_shape": str(face.shape if 'face' in locals() else 'Face not detected')
+            "image_input_type": str(type(img)),
+            "image_shape": str(img.shape),
+            "face_shape": str(face.shape if 'face' in locals() and face is not None else 'Face not detected')
         }
-        raise CustomException(f"Error during embedding extraction: {error_info}", sys)
\ No newline at end of file
+        raise CustomException(f"Error during embedding extraction: {error_info}", sys)
+
+
+async def extract_face_embeddings(image_input):
+    """
+    Extracts the embeddings of every face in an image asynchronously.
+
+    The image takes the same path as in extract_embedding: the embedding cache first
+    (faces are cached in its memory tier), then the process executor or, in-thread,
+    the shared detector and the embedding model. In-thread, the crops join the micro-
+    batcher's queue when batching is on, and otherwise go through one batched forward
+    pass.
+
+    Args:
+        image_input (str, bytes, numpy.ndarray or PIL.Image.Image): The image, as for extract_embedding.
+
+    Returns:
+        tuple: A list of faces, most confident first, and an error message (str). Each face
+               is a dict with the ``box``, ``confidence``, ``keypoints`` and ``embedding``.
+               If no face is detected the list is empty and the error message says so.
+
+    Raises:
+        CustomException: If any error occurs during the extraction process.
+    """
+    try:
+        return await asyncio.to_thread(_extract_face_embeddings_sync, image_input)
+    except Exception as e:
+        raise CustomException(str(e), sys)
+
+def _extract_face_embeddings_sync(image_input):
+    try:
+        with stage_timer('decode'):
+            img = load_image(image_input)
+    except Exception as e:
+        raise CustomException(f"Error during face embedding extraction: {str(e)}", sys)
+
+    cache = get_embedding_cache()
+    if cache is not None:
+        cache_key = cache.faces_key(img)
+        faces = cache.get_faces(cache_key)
+        if faces is not None:
+            return faces, None
+
+    executor = get_inference_executor()
+    if executor is not None:
+        with stage_timer('inference'):
+            faces, error = executor.run_faces(img)
+    else:
+        faces, error = _embed_faces(img)
+    if faces and cache is not None:
+        cache.put_faces(cache_key, faces)
+    return faces, error
+
+
+def _embed_faces(img):
+    """
+    Runs face detection and embedding of every face on a decoded BGR image, without the cache.
+
+    Returns:
+        tuple: ``(faces, error)`` as returned by extract_face_embeddings.
+    """
+    try:
+        faces = get_face_detector().detect_faces(img)
+        if not faces:
+            return [], "No face detected in the image."
+
+        # The detector returns RGB crops; the model expects BGR like cv2.imread gives it
+        crops = [np.ascontiguousarray(face.pop('face')[:, :, ::-1]) for face in faces]
+        with stage_timer('embed'):
+            if PIPELINE_SETTINGS['batching']:
+                # Each crop joins the shared batch queue, together with other requests' crops
+                batcher = get_batcher()
+                futures = [batcher.submit(crop) for crop in crops]
+                embeddings = [future.result() for future in futures]
+            else:
+                embeddings = _represent_batch(crops)
+        for face, embedding in zip(faces, embeddings):
+            face['embedding'] = embedding
+        return faces, None
+    except Exception as e:
+        raise CustomException(f"Error during face embedding extraction: {str(e)}", sys)
+
+
+def _represent(face_bgr):
+    # The crop never leaves memory
+    return get_registry().get_embedding_backend().embed_one(face_bgr)
+
+
+def _represent_batch(faces_bgr):
+    # One forward pass of the embedding backend for the whole batch
+    return get_registry().get_embedding_backend().embed(faces_bgr)
+
+
+def _represent_via_tempfile(face):
+    # Opt-in fallback: round-trip the RGB crop through a JPEG file as the original pipeline did
+    import cv2
+    from PIL import Image
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmpfile:
+        Image.fromarray(face).save(tmpfile.name)
+    try:
+        # Read back the way DeepFace.represent reads an image path
+        return _represent(cv2.imread(tmpfile.name))
+    finally:
+        os.unlink(tmpfile.name)
@@ -0,0 +1,282 @@
+"""
+Gallery-wide near-duplicate search and identity clustering.
+
+Exports every embedding from the index (or reads an exported file), finds all
+pairs whose squared L2 distance is at most --threshold (the same units as the
+``/ValidateImage`` scores, where under 15 means "Exact image found"), groups the
+pairs into identity clusters with union-find and writes a JSON report.
+
+Pairs are found with blocked matrix multiplication: the gallery is cut into
+tiles sized so that --workers tiles fit in --memory-mb, and each tile is one
+GEMM followed by one max-reduction, so no all-pairs matrix is ever held. Vectors
+are augmented with their norms so that the threshold test is a comparison of the
+GEMM output with zero. Pairs close to the threshold are re-checked in float64.
+
+Usage:
+    python -m src.components.duplicate_clusters --config config.json --ids-file ids.txt --output duplicates.json
+    python -m src.components.duplicate_clusters --embeddings gallery.npz --threshold 15 --memory-mb 1024 --workers 8
+
+With many workers, run with OPENBLAS_NUM_THREADS=1 (or OMP_NUM_THREADS=1) so that
+the workers do not each start a full set of BLAS threads.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from src.logger import logging
+
+
+def export_embeddings(index, ids=None, batch_size=1000, max_in_flight=4):
+    """
+    Returns every embedding of an index as ``(ids, vectors)``.
+
+    Local indexes export their arrays directly. For Pinecone and the HTTP backends,
+    which cannot list their ids, ``ids`` must be given and the vectors are fetched
+    in batches.
+    """
+    if ids is None:
+        if not hasattr(index, 'export_arrays'):
+            raise ValueError("This index backend cannot list its ids; pass the ids to export.")
+        exported_ids, vectors, _ = index.export_arrays()
+        return exported_ids, np.asarray(vectors, dtype=np.float32)
+
+    def fetch(chunk):
+        return index.fetch(ids=chunk)['vectors']
+
+    chunks = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+    exported_ids, rows = [], []
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        for vectors in pool.map(fetch, chunks):
+            for vector_id, vector in vectors.items():
+                exported_ids.append(vector_id)
+                rows.append(vector['values'])
+    missing = len(ids) - len(exported_ids)
+    if missing:
+        logging.warning(f"{missing} of {len(ids)} ids were not found in the index.")
+    if not rows:
+        return exported_ids, np.empty((0, index.describe_index_stats()['dimension']), dtype=np.float32)
+    return exported_ids, np.asarray(rows, dtype=np.float32)
+
+
+class UnionFind:
+    """
+    Disjoint sets over ``0..size-1`` with union by size and path halving.
+    """
+
+    def __init__(self, size):
+        self.parent = list(range(size))
+        self.size = [1] * size
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+
+
+def tile_size(memory_mb, workers):
+    # A tile is a float32 square held once per worker
+    return max(256, int(np.sqrt(memory_mb * 1024 * 1024 / 4 / max(workers, 1))))
+
+
+def find_pairs(vectors, threshold, memory_mb=512, workers=None, max_pairs=50_000_000, progress=None):
+    """
+    Finds every pair ``i < j`` with squared L2 distance at most ``threshold``.
+
+    Rows are augmented as ``[x, 1, -(|x|^2 - threshold) / 2]`` and columns as
+    ``[y, -|y|^2 / 2, 1]``, so one product gives ``x.y - |y|^2/2 - (|x|^2 - t)/2``,
+    which is at least zero exactly when ``|x - y|^2 <= t``. Vectors are sorted by
+    norm first, and tile pairs whose norms differ by more than ``sqrt(t)`` are
+    skipped, since ``|x - y| >= ||x| - |y||``.
+
+    Returns:
+        tuple: ``(i, j, distances)`` arrays, with the distances recomputed in float64.
+    """
+    workers = workers or os.cpu_count() or 1
+    n, dimension = vectors.shape
+    if n < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    sq_norms = np.einsum('ij,ij->i', vectors, vectors, dtype=np.float64)
+    order = np.argsort(sq_norms, kind='stable')
+    vectors, sq_norms = vectors[order], sq_norms[order]
+    norms = np.sqrt(sq_norms)
+    rows = np.empty((n, dimension + 2), dtype=np.float32)
+    rows[:, :dimension] = vectors
+    rows[:, dimension] = 1
+    rows[:, dimension + 1] = -(sq_norms - threshold) / 2
+    columns = np.empty((n, dimension + 2), dtype=np.float32)
+    columns[:, :dimension] = vectors
+    columns[:, dimension] = -sq_norms / 2
+    columns[:, dimension + 1] = 1
+    columns = np.ascontiguousarray(columns.T)
+    # float32 rounding in the product; candidates this close to the threshold are re-checked exactly
+    slack = np.float32(1e-5 * (sq_norms.max(initial=0) + threshold) + 1e-3)
+
+    block = min(n, tile_size(memory_mb, workers))
+    starts = list(range(0, n, block))
+    tasks = [(a, b) for i, a in enumerate(starts) for b in starts[i:]
+             if norms[b] - norms[min(a + block, n) - 1] <= np.sqrt(threshold)]
+    found = []
+    total = [0]
+    lock = threading.Lock()
+    buffers = threading.local()
+
+    def run(task):
+        a, b = task
+        a_end, b_end = min(a + block, n), min(b + block, n)
+        if getattr(buffers, 'tile', None) is None:
+            buffers.tile = np.empty((block, block), dtype=np.float32)
+        tile = buffers.tile[:a_end - a, :b_end - b]
+        np.matmul(rows[a:a_end], columns[:, b:b_end], out=tile)
+        hit_rows = np.flatnonzero(tile.max(axis=1) >= -slack)
+        if len(hit_rows) == 0:
+            return
+        r, c = np.nonzero(tile[hit_rows] >= -slack)
+        i, j = hit_rows[r] + a, c + b
+        keep = i < j
+        i, j = i[keep], j[keep]
+        distances = ((vectors[i].astype(np.float64) - vectors[j]) ** 2).sum(axis=1)
+        keep = distances <= threshold
+        with lock:
+            found.append((i[keep], j[keep], distances[keep]))
+            total[0] += int(keep.sum())
+            if total[0] > max_pairs:
+                raise RuntimeError(f"More than {max_pairs} pairs under threshold {threshold}; lower the threshold.")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for done, _ in enumerate(pool.map(run, tasks), 1):
+            if progress and (done % max(1, len(tasks) // 20) == 0 or done == len(tasks)):
+                progress(done, len(tasks), total[0], time.perf_counter() - start)
+
+    if not found:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    i, j, distances = (np.concatenate(parts) for parts in zip(*found))
+    # Back to the caller's row numbers, smaller index first
+    i, j = order[i], order[j]
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    ranked = np.lexsort((j, i))
+    return i[ranked], j[ranked], distances[ranked]
+
+
+def cluster_pairs(ids, i, j, distances):
+    """
+    Groups the pairs into identity clusters (connected components) with union-find.
+
+    Returns:
+        list: Clusters of two or more ids, largest first, each with its pair count and
+        the smallest and largest pair distance inside it.
+    """
+    sets = UnionFind(len(ids))
+    for a, b in zip(i.tolist(), j.tolist()):
+        sets.union(a, b)
+
+    clusters = {}
+    for a, b, distance in zip(i.tolist(), j.tolist(), distances.tolist()):
+        cluster = clusters.setdefault(sets.find(a), {'members': set(), 'pairs': 0, 'min': distance, 'max': distance})
+        cluster['members'].update((a, b))
+        cluster['pairs'] += 1
+        cluster['min'] = min(cluster['min'], distance)
+        cluster['max'] = max(cluster['max'], distance)
+
+    report = []
+    for cluster in clusters.values():
+        members = sorted(ids[member] for member in cluster['members'])
+        report.append({'size': len(members), 'pairs': cluster['pairs'], 'min_distance': cluster['min'],
+                       'max_distance': cluster['max'], 'ids': members})
+    report.sort(key=lambda cluster: (-cluster['size'], cluster['ids'][0]))
+    return report
+
+
+def load_embeddings(args):
+    if args.embeddings:
+        if args.embeddings.endswith('.npz'):
+            data = np.load(args.embeddings)
+            return [str(vector_id) for vector_id in data['ids']], data['vectors'].astype(np.float32)
+        vectors = np.load(args.embeddings, mmap_mode='r').astype(np.float32)
+        if args.ids_file:
+            with open(args.ids_file) as f:
+                ids = [line.strip() for line in f if line.strip()]
+        else:
+            ids = [str(row) for row in range(len(vectors))]
+        return ids, vectors
+
+    from src.components.vector_index import create_index
+    with open(args.config) as f:
+        config = json.load(f)
+    index = create_index(config)
+    ids = None
+    if args.ids_file:
+        with open(args.ids_file) as f:
+            ids = [line.strip() for line in f if line.strip()]
+    try:
+        return export_embeddings(index, ids)
+    finally:
+        if hasattr(index, 'close'):
+            index.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default='config.json', help="config.json selecting the index to export")
+    parser.add_argument('--ids-file', help="Ids to export (one per line); required for Pinecone and HTTP backends")
+    parser.add_argument('--embeddings', help="Read an exported .npz (ids, vectors) or .npy instead of the index")
+    parser.add_argument('--export-to', help="Also save the exported embeddings as .npz for later runs")
+    parser.add_argument('--threshold', type=float, default=15.0, help="Largest squared L2 distance of a duplicate")
+    parser.add_argument('--memory-mb', type=int, default=512, help="Memory for distance tiles across all workers")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--max-pairs', type=int, default=50_000_000)
+    parser.add_argument('--output', default='duplicates.json')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    ids, vectors = load_embeddings(args)
+    print(f"Loaded {len(ids)} embeddings of dimension {vectors.shape[1]} in {time.perf_counter() - start:.1f}s",
+          flush=True)
+    if args.export_to:
+        np.savez(args.export_to, ids=np.asarray(ids), vectors=vectors)
+
+    def progress(done, total, pairs, elapsed):
+        print(f"  {done}/{total} tiles, {pairs} pairs, {elapsed:.0f}s", flush=True)
+
+    search_start = time.perf_counter()
+    i, j, distances = find_pairs(vectors, args.threshold, args.memory_mb, args.workers, args.max_pairs, progress)
+    search_s = time.perf_counter() - search_start
+    clusters = cluster_pairs(ids, i, j, distances)
+
+    sizes = {}
+    for cluster in clusters:
+        sizes[cluster['size']] = sizes.get(cluster['size'], 0) + 1
+    report = {
+        'vectors': len(ids),
+        'threshold': args.threshold,
+        'pairs': len(i),
+        'clusters': len(clusters),
+        'duplicate_ids': sum(cluster['size'] for cluster in clusters),
+        'cluster_sizes': {str(size): count for size, count in sorted(sizes.items())},
+        'search_s': round(search_s, 2),
+        'total_s': round(time.perf_counter() - start, 2),
+        'identity_clusters': clusters,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"{len(i)} pairs in {len(clusters)} clusters covering {report['duplicate_ids']} ids "
+          f"(search {search_s:.1f}s). Report written to {args.output}")
+    logging.info(f"Duplicate search over {len(ids)} embeddings: {len(i)} pairs, {len(clusters)} clusters.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,463 @@
+# durable_index.py
+import json
+import os
+import shutil
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+from src.logger import logging
+from src.components.vector_index import VectorIndex, _parse_vector
+
+
+# Every WAL record is framed by its payload length and CRC32, so a torn write at the tail is detected
+RECORD_HEADER = struct.Struct('<II')
+HEADER_LENGTH = struct.Struct('<I')
+SNAPSHOT_FORMAT = 1
+SYNC_MODES = ('always', 'interval', 'none')
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _encode(header, values=None):
+    header_bytes = json.dumps(header, separators=(',', ':')).encode()
+    payload = HEADER_LENGTH.pack(len(header_bytes)) + header_bytes
+    if values is not None:
+        payload += np.ascontiguousarray(values, dtype=np.float32).tobytes()
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _decode(payload):
+    (header_length,) = HEADER_LENGTH.unpack_from(payload)
+    header = json.loads(payload[HEADER_LENGTH.size:HEADER_LENGTH.size + header_length])
+    values = None
+    if 'shape' in header:
+        values = np.frombuffer(payload, dtype=np.float32, offset=HEADER_LENGTH.size + header_length)
+        values = values.reshape(header['shape'])
+    return header, values
+
+
+class WriteAheadLog:
+    """
+    Append-only log of index writes.
+
+    The log is split into segment files named after the LSN (log sequence number) of
+    their first record. A snapshot starts a new segment, and the segments it covers
+    are deleted once it is safely on disk. Records are written unbuffered, so an
+    acknowledged write survives a process crash. ``sync`` decides when they are
+    also fsynced: on every write (``always``), every ``sync_interval_s`` by a
+    background thread (``interval``), or never (``none``).
+    """
+
+    def __init__(self, path, sync='always', sync_interval_s=1.0):
+        if sync not in SYNC_MODES:
+            raise ValueError(f"Unknown WAL sync mode {sync!r}. Expected one of {SYNC_MODES}.")
+        self.path = path
+        self.sync = sync
+        self.sync_interval_s = sync_interval_s
+        self.last_lsn = 0
+        self.records = 0
+        self.bytes = 0
+        self._file = None
+        self._dirty = False
+        self._closed = threading.Event()
+        self._sync_thread = None
+        os.makedirs(path, exist_ok=True)
+
+    def _segments(self):
+        names = sorted(name for name in os.listdir(self.path) if name.startswith('wal-') and name.endswith('.log'))
+        return [(int(name[4:-4]), os.path.join(self.path, name)) for name in names]
+
+    def replay(self, after_lsn=0):
+        """
+        Yields ``(lsn, header, values)`` for every record after ``after_lsn``, oldest first.
+
+        A record cut short or failing its checksum ends the log: it can only be the
+        last write before a crash, which was never acknowledged. The segment is
+        truncated there so that new records follow the last valid one.
+        """
+        for first_lsn, segment in self._segments():
+            lsn = first_lsn - 1
+            with open(segment, 'rb') as f:
+                data = f.read()
+            offset = 0
+            while offset + RECORD_HEADER.size <= len(data):
+                length, crc = RECORD_HEADER.unpack_from(data, offset)
+                payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                offset += RECORD_HEADER.size + length
+                lsn += 1
+                self.records += 1
+                self.bytes += RECORD_HEADER.size + length
+                if lsn > after_lsn:
+                    header, values = _decode(payload)
+                    yield lsn, header, values
+            if offset < len(data):
+                logging.warning(f"Truncating {len(data) - offset} bytes of torn WAL records at the end of {segment}.")
+                with open(segment, 'r+b') as f:
+                    f.truncate(offset)
+                    os.fsync(f.fileno())
+            self.last_lsn = max(self.last_lsn, lsn)
+
+    def open(self, last_lsn):
+        """
+        Opens the newest segment for appending; ``last_lsn`` is the LSN recovery ended at.
+        """
+        self.last_lsn = max(self.last_lsn, last_lsn)
+        segments = self._segments()
+        if segments:
+            self._file = open(segments[-1][1], 'ab', buffering=0)
+        else:
+            self._start_segment()
+        if self.sync == 'interval':
+            self._sync_thread = threading.Thread(target=self._sync_periodically, name='wal-sync', daemon=True)
+            self._sync_thread.start()
+
+    def _start_segment(self):
+        path = os.path.join(self.path, f"wal-{self.last_lsn + 1:020d}.log")
+        self._file = open(path, 'ab', buffering=0)
+        _fsync_dir(self.path)
+
+    def append(self, header, values=None):
+        """
+        Writes one record and returns its LSN. The caller serializes appends.
+        """
+        record = _encode(header, values)
+        self._file.write(record)
+        if self.sync == 'always':
+            os.fsync(self._file.fileno())
+        else:
+            self._dirty = True
+        self.last_lsn += 1
+        self.records += 1
+        self.bytes += len(record)
+        return self.last_lsn
+
+    def rotate(self):
+        """
+        Closes the current segment and starts a new one at the next LSN.
+        """
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._start_segment()
+
+    def drop_through(self, lsn):
+        """
+        Deletes the segments whose records all have an LSN of at most ``lsn``.
+        """
+        segments = self._segments()
+        for (first_lsn, segment), (next_first_lsn, _) in zip(segments, segments[1:]):
+            if next_first_lsn - 1 <= lsn:
+                size = os.path.getsize(segment)
+                os.remove(segment)
+                self.records -= next_first_lsn - first_lsn
+                self.bytes -= size
+
+    def _sync_periodically(self):
+        while not self._closed.wait(self.sync_interval_s):
+            self.flush()
+
+    def flush(self):
+        if self._file is not None and self._dirty:
+            self._dirty = False
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._closed.set()
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+
+def write_snapshot(path, lsn, ids, vectors, metadata):
+    """
+    Writes a snapshot directory and makes it the current one.
+
+    ``vectors.f32`` holds the raw float32 matrix, so it can be memory-mapped as is;
+    ``ids.bin`` the UTF-8 ids back to back with their end offsets in ``ids.idx``.
+    The files are written to a temporary directory, fsynced, renamed into place and
+    only then named in ``CURRENT``, so a crash leaves either the old or the new
+    snapshot, never a partial one.
+
+    Returns:
+        str: The snapshot directory name.
+    """
+    name = f"snapshot-{lsn:020d}"
+    tmp = os.path.join(path, f"{name}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    encoded = [vector_id.encode() for vector_id in ids]
+    offsets = np.cumsum([len(vector_id) for vector_id in encoded], dtype=np.int64)
+    files = {
+        'vectors.f32': np.ascontiguousarray(vectors, dtype=np.float32).data,
+        'ids.bin': b''.join(encoded),
+        'ids.idx': offsets.tobytes(),
+        'metadata.json': json.dumps(metadata).encode(),
+        'meta.json': json.dumps({'format': SNAPSHOT_FORMAT, 'lsn': lsn, 'count': len(encoded),
+                                 'dimension': int(vectors.shape[1]), 'created': time.time()}).encode(),
+    }
+    for filename, data in files.items():
+        with open(os.path.join(tmp, filename), 'wb') as f:
+            f.write(data)
+            os.fsync(f.fileno())
+    _fsync_dir(tmp)
+    os.replace(tmp, os.path.join(path, name))
+
+    with open(os.path.join(path, 'CURRENT.tmp'), 'w') as f:
+        f.write(name)
+        os.fsync(f.fileno())
+    os.replace(os.path.join(path, 'CURRENT.tmp'), os.path.join(path, 'CURRENT'))
+    _fsync_dir(path)
+    return name
+
+
+def read_snapshot(path):
+    """
+    Opens the current snapshot without reading the vectors into memory.
+
+    Returns:
+        tuple: ``(meta, ids, vectors, metadata)`` with ``vectors`` a copy-on-write
+        memmap, or None when there is no snapshot yet.
+    """
+    current = os.path.join(path, 'CURRENT')
+    if not os.path.exists(current):
+        return None
+    with open(current) as f:
+        directory = os.path.join(path, f.read().strip())
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta['format'] != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format {meta['format']} in {directory}.")
+
+    with open(os.path.join(directory, 'ids.bin'), 'rb') as f:
+        blob = f.read()
+    ends = np.fromfile(os.path.join(directory, 'ids.idx'), dtype=np.int64).tolist()
+    ids = [blob[start:end].decode() for start, end in zip([0] + ends[:-1], ends)]
+    with open(os.path.join(directory, 'metadata.json')) as f:
+        metadata = json.load(f)
+    if meta['count']:
+        # Copy-on-write: updates after the restart go to private pages, the file stays as written
+        vectors = np.memmap(os.path.join(directory, 'vectors.f32'), dtype=np.float32, mode='c',
+                            shape=(meta['count'], meta['dimension']))
+    else:
+        vectors = np.empty((0, meta['dimension']), dtype=np.float32)
+    return meta, ids, vectors, metadata
+
+
+class DurableIndex(VectorIndex):
+    """
+    Makes an in-process index durable with a write-ahead log and periodic snapshots.
+
+    Every upsert, update and delete is appended to the WAL before it is applied to
+    the wrapped index, and is acknowledged only once it is logged. After
+    ``snapshot_every`` logged writes a compacted snapshot is written in the
+    background and the WAL segments it covers are dropped.
+
+    On start-up the current snapshot is memory-mapped and handed to the wrapped
+    index (``load_arrays``), then the WAL records written after it are replayed, so
+    a restart does not rebuild the vectors as Python objects. Reads go straight to
+    the wrapped index.
+
+    Example:
+        index = DurableIndex('/data/index', lambda: NumpyIndex(dimension=128))
+    """
+
+    def __init__(self, path, factory, sync='always', sync_interval_s=1.0, snapshot_every=100000):
+        """
+        Args:
+            path (str): Directory holding the snapshots and the WAL.
+            factory (callable): Returns an empty index, e.g. ``lambda: NumpyIndex()``.
+            sync (str): When WAL writes are fsynced: ``always``, ``interval`` or ``none``.
+            sync_interval_s (float): The fsync period for ``interval``.
+            snapshot_every (int): Logged writes after which a new snapshot is taken.
+        """
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.snapshots = 0
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_thread = None
+        os.makedirs(path, exist_ok=True)
+
+        start = time.perf_counter()
+        self.index = factory()
+        snapshot = read_snapshot(path)
+        self.snapshot_lsn = 0
+        if snapshot is not None:
+            meta, ids, vectors, metadata = snapshot
+            if meta['dimension'] != self.index.dimension:
+                raise ValueError(f"Snapshot in {path} has dimension {meta['dimension']}, "
+                                 f"the index {self.index.dimension}.")
+            self._load(ids, vectors, metadata)
+            self.snapshot_lsn = meta['lsn']
+
+        self.wal = WriteAheadLog(os.path.join(path, 'wal'), sync, sync_interval_s)
+        replayed = 0
+        for lsn, header, values in self.wal.replay(self.snapshot_lsn):
+            self._apply(header, values, replaying=True)
+            replayed += 1
+        self.wal.open(self.snapshot_lsn)
+        self._remove_stale_snapshots()
+        self.recovery_s = time.perf_counter() - start
+        logging.info(f"Durable index at {path} recovered {len(self.index)} vectors "
+                     f"(snapshot LSN {self.snapshot_lsn}, {replayed} WAL records replayed) in {self.recovery_s:.2f}s.")
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def dimension(self):
+        return self.index.dimension
+
+    def _load(self, ids, vectors, metadata):
+        if hasattr(self.index, 'load_arrays'):
+            self.index.load_arrays(ids, vectors, metadata)
+            return
+        # Indexes that build their own structures (e.g. IVF lists) are filled in chunks
+        for start in range(0, len(ids), 10000):
+            self.index.upsert([(vector_id, vectors[row], metadata.get(vector_id))
+                               for row, vector_id in enumerate(ids[start:start + 10000], start)])
+
+    def _apply(self, header, values, replaying=False):
+        op = header['op']
+        try:
+            if op == 'upsert':
+                metadata = header.get('metadata') or [None] * len(header['ids'])
+                return self.index.upsert(list(zip(header['ids'], values, metadata)))
+            if op == 'update':
+                return self.index.update(header['id'], values=values[0] if values is not None else None,
+                                         set_metadata=header.get('set_metadata'))
+            if op == 'delete':
+                return self.index.delete(ids=header.get('ids'), delete_all=header.get('delete_all', False))
+            raise ValueError(f"Unknown WAL operation {op!r}.")
+        except (KeyError, ValueError) as e:
+            if not replaying:
+                raise
+            # The write failed the same way when it was first applied
+            logging.warning(f"Skipping WAL {op} that cannot be applied: {str(e)}")
+
+    def _write(self, header, values=None):
+        with self._lock:
+            self.wal.append(header, values)
+            result = self._apply(header, values)
+            due = self.wal.last_lsn - self.snapshot_lsn >= self.snapshot_every
+        if due:
+            self._snapshot_in_background()
+        return result
+
+    def upsert(self, vectors):
+        parsed = list(map(_parse_vector, vectors))
+        if not parsed:
+            return {'upserted_count': 0}
+        values = np.stack([np.asarray(values, dtype=np.float32).reshape(-1) for _, values, _ in parsed])
+        if values.shape[1] != self.dimension:
+            raise ValueError(f"Vector dimension {values.shape[1]} does not match index dimension {self.dimension}.")
+        header = {'op': 'upsert', 'ids': [vector_id for vector_id, _, _ in parsed], 'shape': list(values.shape)}
+        if any(metadata is not None for _, _, metadata in parsed):
+            header['metadata'] = [metadata for _, _, metadata in parsed]
+        return self._write(header, values)
+
+    def update(self, id, values=None, set_metadata=None):
+        header = {'op': 'update', 'id': id}
+        if set_metadata is not None:
+            header['set_metadata'] = set_metadata
+        if values is not None:
+            values = np.asarray(values, dtype=np.float32).reshape(1, -1)
+            header['shape'] = list(values.shape)
+        return self._write(header, values)
+
+    def delete(self, ids=None, delete_all=False):
+        header = {'op': 'delete', 'delete_all': True} if delete_all else {'op': 'delete', 'ids': list(ids or [])}
+        return self._write(header)
+
+    def fetch(self, ids):
+        return self.index.fetch(ids)
+
+    def query(self, vector, top_k=10, include_values=False, include_metadata=False):
+        return self.index.query(vector, top_k=top_k, include_values=include_values, include_metadata=include_metadata)
+
+    def query_many(self, vectors, top_k=10, include_values=False, include_metadata=False):
+        return self.index.query_many(vectors, top_k=top_k, include_values=include_values,
+                                     include_metadata=include_metadata)
+
+    def describe_index_stats(self):
+        return self.index.describe_index_stats()
+
+    def export_arrays(self):
+        return self.index.export_arrays()
+
+    def snapshot(self):
+        """
+        Writes a snapshot of the current contents and drops the WAL segments it covers.
+
+        Writes are blocked only while the arrays are copied out of the index; the
+        files are written after the lock is released.
+
+        Returns:
+            int: The LSN the snapshot covers.
+        """
+        with self._snapshot_lock:
+            with self._lock:
+                lsn = self.wal.last_lsn
+                if lsn == self.snapshot_lsn and os.path.exists(os.path.join(self.path, 'CURRENT')):
+                    return lsn
+                self.wal.rotate()
+                ids, vectors, metadata = self.index.export_arrays()
+            start = time.perf_counter()
+            write_snapshot(self.path, lsn, ids, vectors, metadata)
+            self.snapshot_lsn = lsn
+            self.snapshots += 1
+            with self._lock:
+                self.wal.drop_through(lsn)
+            self._remove_stale_snapshots()
+            logging.info(f"Snapshot of {len(ids)} vectors at LSN {lsn} written in {time.perf_counter() - start:.2f}s.")
+            return lsn
+
+    def _snapshot_in_background(self):
+        if self._snapshot_thread is not None and self._snapshot_thread.is_alive():
+            return
+
+        def run():
+            try:
+                self.snapshot()
+            except Exception as e:
+                logging.error(f"Snapshot of the durable index at {self.path} failed: {str(e)}")
+
+        self._snapshot_thread = threading.Thread(target=run, name='index-snapshot', daemon=True)
+        self._snapshot_thread.start()
+
+    def _remove_stale_snapshots(self):
+        current = None
+        if os.path.exists(os.path.join(self.path, 'CURRENT')):
+            with open(os.path.join(self.path, 'CURRENT')) as f:
+                current = f.read().strip()
+        for name in os.listdir(self.path):
+            if name.startswith('snapshot-') and name != current:
+                # A snapshot still mapped by this process stays readable until it is unmapped
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    def stats(self):
+        return {
+            'lsn': self.wal.last_lsn,
+            'snapshot_lsn': self.snapshot_lsn,
+            'wal_records': self.wal.records,
+            'wal_bytes': self.wal.bytes,
+            'snapshots': self.snapshots,
+            'recovery_s': self.recovery_s,
+        }
+
+    def close(self):
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+        with self._lock:
+            self.wal.close()
@@ -0,0 +1,331 @@
+"""
+Embedding backends: the model that turns a face crop into its 128-d embedding.
+
+``tensorflow`` runs the DeepFace Keras model, as the pipeline always has. ``onnx``
+runs the same network exported to ONNX under ONNX Runtime, which imports in a
+fraction of the time, needs no TensorFlow for the embedding and is usually faster
+on CPU, more so with INT8 weights. Both take BGR face crops, preprocess them with
+``preprocess_faces`` and return lists of floats, so the rest of the pipeline does
+not know which one is in use.
+
+The ONNX model is exported once, on a machine with TensorFlow, deepface and
+tf2onnx installed (``--int8`` also needs onnxruntime):
+
+Usage:
+    python -m src.components.embedding_backend --output models/facenet.onnx
+    python -m src.components.embedding_backend --output models/facenet-int8.onnx --int8
+
+Then set ``EMBEDDING_BACKEND`` to ``onnx`` and ``EMBEDDING_ONNX_PATH`` to the file.
+``benchmarks/embedding_parity.py`` compares the two backends before switching.
+"""
+import abc
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from src.exception import CustomException
+from src.logger import logging
+from src.components.metrics import MODEL_LOAD_SECONDS
+
+BACKENDS = ('tensorflow', 'onnx')
+
+
+def preprocess_faces(faces_bgr, target_size=(160, 160)):
+    """
+    Builds a model input batch from BGR face crops without TensorFlow.
+
+    The ONNX backend always uses it; the TensorFlow backend with ``haar_redetect`` off.
+
+    Matches the resize and padding of DeepFace's ``preprocess_face``: each crop is
+    scaled to fit ``target_size`` keeping its aspect ratio, centred on a black
+    canvas and scaled to [0, 1]. DeepFace also re-runs OpenCV's Haar detector on
+    the crop first; this does not, since the crop already comes from MTCNN.
+
+    Args:
+        faces_bgr (list): Face crops as uint8 BGR arrays.
+        target_size (tuple): ``(height, width)`` of the model input.
+
+    Returns:
+        numpy.ndarray: A float32 batch of shape ``(len(faces_bgr), height, width, 3)``.
+    """
+    import cv2
+    height, width = target_size
+    batch = np.zeros((len(faces_bgr), height, width, 3), dtype=np.float32)
+    for row, face in zip(batch, faces_bgr):
+        factor = min(height / face.shape[0], width / face.shape[1])
+        resized = cv2.resize(face, (max(1, int(face.shape[1] * factor)), max(1, int(face.shape[0] * factor))))
+        top = (height - resized.shape[0]) // 2
+        left = (width - resized.shape[1]) // 2
+        row[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    batch /= 255
+    return batch
+
+
+class EmbeddingBackend(abc.ABC):
+    """
+    Interface of an embedding backend.
+
+    Constructing a backend is cheap; the model is loaded by ``load``, or on the first
+    call to ``embed``. ``name`` identifies the model, its weights and its
+    preprocessing, and keys the embedding cache, so embeddings of different backends
+    are never mixed up.
+    """
+
+    name = None
+
+    @abc.abstractmethod
+    def load(self):
+        """
+        Loads the model, once; later calls return at once.
+        """
+
+    @abc.abstractmethod
+    def is_loaded(self):
+        """
+        Returns True once the model is loaded.
+        """
+
+    @abc.abstractmethod
+    def preprocess(self, faces_bgr):
+        """
+        Returns the model input batch for a list of BGR face crops.
+        """
+
+    @abc.abstractmethod
+    def forward(self, batch):
+        """
+        Runs the model on a preprocessed batch and returns a ``(n, 128)`` array.
+        """
+
+    def embed(self, faces_bgr):
+        """
+        Embeds a list of BGR face crops in one forward pass.
+
+        Returns:
+            list: One embedding (list of floats) per crop.
+        """
+        self.load()
+        return [row.tolist() for row in self.forward(self.preprocess(faces_bgr))]
+
+    def embed_one(self, face_bgr):
+        return self.embed([face_bgr])[0]
+
+
+class TensorFlowBackend(EmbeddingBackend):
+    """
+    The DeepFace Keras model.
+
+    The model is the one held by the model registry, so the registry and this
+    backend never build it twice. By default crops go through DeepFace's own
+    ``preprocess_face``, which re-runs OpenCV's Haar detector on each crop as
+    ``DeepFace.represent`` does, so embeddings match the gallery the pipeline has
+    always built. With ``haar_redetect`` off they go through ``preprocess_faces``,
+    as for the ONNX backend, and the two differ only in the model; the embeddings
+    then change, so the gallery has to be re-embedded.
+    """
+
+    def __init__(self, registry, haar_redetect=True):
+        self.registry = registry
+        self.haar_redetect = haar_redetect
+        # The DeepFace preprocessing keeps the plain model name of the original cache entries
+        self.name = registry.model_name if haar_redetect else f"{registry.model_name}-crop"
+        self._model = None
+
+    def load(self):
+        if self._model is None:
+            self._model = self.registry.get_embedding_model()
+
+    def is_loaded(self):
+        return self._model is not None
+
+    def preprocess(self, faces_bgr):
+        self.load()
+        _, height, width, _ = self._model.input_shape
+        if not self.haar_redetect:
+            return preprocess_faces(faces_bgr, (height, width))
+        # Same preprocessing as DeepFace.represent
+        from deepface.commons import functions
+        batch = np.concatenate([
+            functions.preprocess_face(img=face, target_size=(height, width),
+                                      enforce_detection=False, detector_backend='opencv')
+            for face in faces_bgr
+        ])
+        return functions.normalize_input(img=batch, normalization='base')
+
+    def forward(self, batch):
+        self.load()
+        return self._model.predict(batch)
+
+
+class OnnxBackend(EmbeddingBackend):
+    """
+    The embedding model exported to ONNX, run by ONNX Runtime on the CPU.
+
+    One session is shared by all threads; ONNX Runtime allows concurrent ``run``
+    calls on a session. ``intra_op_threads`` and ``inter_op_threads`` size its
+    thread pools (None keeps ONNX Runtime's default of one thread per physical
+    core); set them to the worker's CPU share when several processes share a node.
+    """
+
+    def __init__(self, model_path, model_name='Facenet', intra_op_threads=None, inter_op_threads=None):
+        """
+        Args:
+            model_path (str): The ``.onnx`` file written by ``export_onnx``.
+            model_name (str): The DeepFace model it was exported from.
+            intra_op_threads (int, optional): Threads used inside one operator.
+            inter_op_threads (int, optional): Operators run in parallel.
+        """
+        if not model_path:
+            raise ValueError("The onnx embedding backend needs EMBEDDING_ONNX_PATH.")
+        if not os.path.isfile(model_path):
+            raise ValueError(f"ONNX model {model_path} does not exist; export it first.")
+        self.model_path = model_path
+        self.model_name = model_name
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        # A re-exported or re-quantized model gets a new name, which invalidates the cache
+        self.name = f"{model_name}-onnx-{file_digest(model_path)}"
+        self._lock = threading.Lock()
+        self._session = None
+        self._input_name = None
+        self._input_size = None
+
+    def load(self):
+        if self._session is not None:
+            return
+        with self._lock:
+            if self._session is not None:
+                return
+            try:
+                start = time.perf_counter()
+                import onnxruntime
+                options = onnxruntime.SessionOptions()
+                options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+                options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+                if self.intra_op_threads:
+                    options.intra_op_num_threads = self.intra_op_threads
+                if self.inter_op_threads:
+                    options.inter_op_num_threads = self.inter_op_threads
+                session = onnxruntime.InferenceSession(self.model_path, options,
+                                                       providers=['CPUExecutionProvider'])
+                model_input = session.get_inputs()[0]
+                _, height, width, _ = model_input.shape
+                self._input_name, self._input_size = model_input.name, (height, width)
+                self._session = session
+                MODEL_LOAD_SECONDS.set(time.perf_counter() - start, model=self.name)
+                logging.info(f"{self.name} embedding model loaded from {self.model_path} "
+                             f"({self.intra_op_threads or 'default'} intra-op / "
+                             f"{self.inter_op_threads or 'default'} inter-op threads).")
+            except Exception as e:
+                raise CustomException(e, sys) from e
+
+    def is_loaded(self):
+        return self._session is not None
+
+    def preprocess(self, faces_bgr):
+        self.load()
+        return preprocess_faces(faces_bgr, self._input_size)
+
+    def forward(self, batch):
+        self.load()
+        return self._session.run(None, {self._input_name: np.asarray(batch, dtype=np.float32)})[0]
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=6)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def create_backend(backend, registry, onnx_model_path=None, onnx_intra_op_threads=None, onnx_inter_op_threads=None,
+                   haar_redetect=True):
+    """
+    Builds the embedding backend selected by ``EMBEDDING_BACKEND``.
+
+    Args:
+        backend (str): ``tensorflow`` or ``onnx``.
+        registry (ModelRegistry): Supplies the model name and, for ``tensorflow``, the Keras model.
+        haar_redetect (bool): Preprocess as ``DeepFace.represent`` (``tensorflow`` only; the
+            ONNX backend always uses ``preprocess_faces``).
+
+    Returns:
+        EmbeddingBackend: The backend, with its model not loaded yet.
+    """
+    if backend == 'tensorflow':
+        return TensorFlowBackend(registry, haar_redetect)
+    if backend == 'onnx':
+        return OnnxBackend(onnx_model_path, registry.model_name, onnx_intra_op_threads, onnx_inter_op_threads)
+    raise ValueError(f"Unknown embedding backend: {backend}. Expected one of {BACKENDS}.")
+
+
+def export_onnx(output_path, model_name='Facenet', opset=13, int8=False, per_channel=False, op_types=None):
+    """
+    Converts a DeepFace Keras model to ONNX, optionally with INT8 weights.
+
+    INT8 uses ONNX Runtime's dynamic quantization: weights are stored as 8-bit
+    integers and activations are quantized on the fly, so no calibration images
+    are needed. Check the result with ``benchmarks/embedding_parity.py``.
+
+    Args:
+        output_path (str): Where to write the ``.onnx`` file.
+        model_name (str): The DeepFace model to export.
+        opset (int): ONNX opset of the exported graph.
+        int8 (bool): Quantize the weights to INT8.
+        per_channel (bool): Quantize per output channel rather than per tensor.
+        op_types (list, optional): Operator types to quantize, e.g. ``['Conv', 'MatMul']``;
+            None quantizes every supported type.
+
+    Returns:
+        str: ``output_path``.
+    """
+    import tensorflow as tf
+    import tf2onnx
+    from deepface import DeepFace
+
+    model = DeepFace.build_model(model_name)
+    _, height, width, channels = model.input_shape
+    signature = (tf.TensorSpec((None, height, width, channels), tf.float32, name='input'),)
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+    if not int8:
+        tf2onnx.convert.from_keras(model, input_signature=signature, opset=opset, output_path=output_path)
+        return output_path
+
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+    with tempfile.TemporaryDirectory() as tmp:
+        fp32_path = os.path.join(tmp, 'model.onnx')
+        prepared_path = os.path.join(tmp, 'prepared.onnx')
+        tf2onnx.convert.from_keras(model, input_signature=signature, opset=opset, output_path=fp32_path)
+        # Shape inference and graph folding first, as ONNX Runtime recommends before quantizing
+        quant_pre_process(fp32_path, prepared_path, skip_symbolic_shape=True)
+        quantize_dynamic(prepared_path, output_path, weight_type=QuantType.QInt8, per_channel=per_channel,
+                         op_types_to_quantize=op_types)
+    return output_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', required=True, help="Path of the .onnx file to write")
+    parser.add_argument('--model-name', default='Facenet')
+    parser.add_argument('--opset', type=int, default=13)
+    parser.add_argument('--int8', action='store_true', help="Quantize the weights to INT8 (dynamic quantization)")
+    parser.add_argument('--per-channel', action='store_true', help="Per-channel INT8 scales")
+    parser.add_argument('--op-types', nargs='+', help="Operator types to quantize (default: all supported)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    export_onnx(args.output, args.model_name, args.opset, args.int8, args.per_channel, args.op_types)
+    size_mb = os.path.getsize(args.output) / 1024 / 1024
+    print(f"Exported {args.model_name} to {args.output} ({size_mb:.1f} MB{', INT8' if args.int8 else ''}) "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+# embedding_cache.py
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from src.logger import logging
+
+
+KEY_SIZE = 16
+# Rough per-entry cost of the OrderedDict slot, key bytes and ndarray header
+ENTRY_OVERHEAD = 200
+
+
+def image_key(img, model_name):
+    """
+    Returns the content address of a decoded image for a given embedding model.
+
+    The key covers the pixels, shape and dtype of the array and the model name, so
+    identical pixels re-uploaded under another file name or container format map to
+    the same key, while a model change produces different keys.
+
+    Args:
+        img (numpy.ndarray): The decoded image.
+        model_name (str): The embedding model the cached value was produced with.
+
+    Returns:
+        bytes: A 16-byte BLAKE2b digest.
+    """
+    digest = hashlib.blake2b(digest_size=KEY_SIZE)
+    digest.update(model_name.encode())
+    digest.update(repr((img.shape, img.dtype.str)).encode())
+    digest.update(np.ascontiguousarray(img).data)
+    return digest.digest()
+
+
+class MmapEmbeddingStore:
+    """
+    Fixed-size on-disk embedding table backed by memory-mapped files.
+
+    Keys and embeddings are stored in two parallel memory-mapped arrays that act as
+    an open-addressing hash table: a key's home slot comes from its first 8 bytes and
+    collisions probe the next ``max_probes`` slots. When all of them are taken, the
+    home slot is overwritten and counted as an eviction. A lookup touches only the
+    probed slots, so the store never has to be loaded into memory.
+
+    ``meta.json`` records the model name, dimension and capacity. If any of them
+    differ when the store is opened, the files are recreated empty.
+    """
+
+    def __init__(self, path, model_name, dimension=128, capacity=1 << 20, max_probes=8):
+        self.path = path
+        self.dimension = dimension
+        self.capacity = capacity
+        self.max_probes = max_probes
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._open(model_name)
+
+    def _open(self, model_name):
+        meta_path = os.path.join(self.path, 'meta.json')
+        meta = {'model_name': model_name, 'dimension': self.dimension, 'capacity': self.capacity}
+        existing = None
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                existing = json.load(f)
+        mode = 'r+' if existing == meta else 'w+'
+        if mode == 'w+' and existing is not None:
+            logging.info(f"Embedding cache at {self.path} was built for {existing}; recreating it for {meta}.")
+
+        self._keys = np.memmap(os.path.join(self.path, 'keys.bin'), dtype=np.uint8, mode=mode,
+                               shape=(self.capacity, KEY_SIZE))
+        self._values = np.memmap(os.path.join(self.path, 'embeddings.f32'), dtype=np.float32, mode=mode,
+                                 shape=(self.capacity, self.dimension))
+        if mode == 'w+':
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+        self.model_name = model_name
+
+    def reset(self, model_name):
+        """
+        Empties the store and re-labels it for ``model_name``.
+        """
+        with self._lock:
+            if self._keys is None:
+                return
+            self._keys.flush()
+            self._values.flush()
+            del self._keys, self._values
+            os.remove(os.path.join(self.path, 'meta.json'))
+            self._open(model_name)
+
+    def _probe(self, key):
+        home = int.from_bytes(key[:8], 'little') % self.capacity
+        return [(home + i) % self.capacity for i in range(self.max_probes)]
+
+    def get(self, key):
+        wanted = np.frombuffer(key, dtype=np.uint8)
+        with self._lock:
+            if self._keys is None:
+                return None
+            for slot in self._probe(key):
+                stored = self._keys[slot]
+                if not stored.any():
+                    return None
+                if np.array_equal(stored, wanted):
+                    return np.array(self._values[slot])
+        return None
+
+    def put(self, key, embedding):
+        wanted = np.frombuffer(key, dtype=np.uint8)
+        with self._lock:
+            if self._keys is None:
+                return
+            slots = self._probe(key)
+            target = slots[0]
+            for slot in slots:
+                stored = self._keys[slot]
+                if not stored.any() or np.array_equal(stored, wanted):
+                    target = slot
+                    break
+            else:
+                self.evictions += 1
+            # Write the value before the key so a crash never exposes a key with a stale value
+            self._values[target] = embedding
+            self._keys[target] = wanted
+
+    def flush(self):
+        with self._lock:
+            if self._keys is not None:
+                self._values.flush()
+                self._keys.flush()
+
+    def close(self):
+        """
+        Flushes the store and unmaps its files; later lookups miss and writes are dropped.
+        """
+        with self._lock:
+            if self._keys is None:
+                return
+            self._values.flush()
+            self._keys.flush()
+            self._keys = self._values = None
+
+
+class EmbeddingCache:
+    """
+    Content-addressed cache of embeddings in front of the detection and embedding models.
+
+    An in-memory LRU bounded by ``max_bytes`` serves repeat images with one hash and
+    one dictionary lookup. An optional ``MmapEmbeddingStore`` behind it survives
+    restarts and holds far more entries; memory misses that hit the disk tier are
+    promoted back into the LRU.
+
+    Keys include the model name (see ``image_key``). ``set_model_name`` drops every
+    entry built with a different model. Besides single embeddings, the memory tier
+    holds the every-face results of ``extract_face_embeddings`` under ``faces_key``.
+    """
+
+    def __init__(self, model_name, max_bytes=64 * 1024 * 1024, disk_path=None, disk_capacity=1 << 20,
+                 dimension=128):
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._disk = MmapEmbeddingStore(disk_path, model_name, dimension, disk_capacity) if disk_path else None
+
+    def key(self, img):
+        return image_key(img, self.model_name)
+
+    def faces_key(self, img):
+        """
+        Returns the key of an image's every-face result, distinct from its ``key``.
+        """
+        return image_key(img, f"{self.model_name}|faces")
+
+    def get(self, key):
+        """
+        Returns the cached embedding as a list of floats, or None on a miss.
+        """
+        embedding = self._get_memory(key)
+        if embedding is not None:
+            return embedding.tolist()
+        if self._disk is not None:
+            embedding = self._disk.get(key)
+            if embedding is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._put_memory(key, embedding, embedding.nbytes)
+                return embedding.tolist()
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, embedding):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        self._put_memory(key, embedding, embedding.nbytes)
+        if self._disk is not None:
+            self._disk.put(key, embedding)
+
+    def get_faces(self, key):
+        """
+        Returns the cached faces of an image, as extract_face_embeddings gives them, or None.
+
+        Face lists are kept in the memory tier only, since the disk tier holds one
+        embedding per key. Each call returns fresh dicts that the caller may modify.
+        """
+        faces = self._get_memory(key)
+        if faces is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        return [{**face, 'embedding': list(face['embedding'])} for face in faces]
+
+    def put_faces(self, key, faces):
+        faces = tuple({**face, 'embedding': list(face['embedding'])} for face in faces)
+        self._put_memory(key, faces, sum(8 * len(face['embedding']) + ENTRY_OVERHEAD for face in faces))
+
+    def _get_memory(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def _put_memory(self, key, value, nbytes):
+        size = nbytes + len(key) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                self.evictions += 1
+
+    def set_model_name(self, model_name):
+        """
+        Switches the cache to another model, invalidating every entry of the previous one.
+        """
+        if model_name == self.model_name:
+            return
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.model_name = model_name
+        if self._disk is not None:
+            self._disk.reset(model_name)
+        logging.info(f"Embedding cache invalidated for model {model_name}.")
+
+    def flush(self):
+        """
+        Writes the disk tier's pending changes to its files, if there is a disk tier.
+        """
+        if self._disk is not None:
+            self._disk.flush()
+
+    def close(self):
+        """
+        Flushes and unmaps the disk tier and empties the memory tier. A request still
+        holding the cache afterwards only uses the memory tier.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self._disk is not None:
+            self._disk.close()
+
+    def stats(self):
+        """
+        Returns hit, miss and eviction counters and the memory tier's size.
+        """
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'model_name': self.model_name,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'disk_evictions': self._disk.evictions if self._disk is not None else 0,
+            }
@@ -0,0 +1,311 @@
+# index_client.py
+import asyncio
+import random
+import re
+import threading
+import time
+import httpx
+from src.logger import logging
+from src.components.vector_index import VectorIndex
+
+
+# Responses worth retrying: throttling and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class IndexRequestError(Exception):
+    """
+    Raised when an index request fails after its retries or runs past its deadline.
+
+    Attributes:
+        status (int): The HTTP status of the last attempt, or None for transport errors and timeouts.
+    """
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def _snake_keys(response):
+    # The REST API answers in camelCase; the Python client and the local indexes use snake_case
+    return {re.sub(r'(?<!^)(?=[A-Z])', '_', key).lower(): value for key, value in response.items()}
+
+
+def _as_list(values):
+    return [float(value) for value in values]
+
+
+class AsyncIndexClient:
+    """
+    Async client for the Pinecone REST data plane (``/query``, ``/vectors/upsert`` and so on).
+
+    One ``httpx.AsyncClient`` keeps a pool of keep-alive connections, so concurrent
+    calls are multiplexed over warm connections instead of opening one per request.
+    Each call has a deadline (``timeout`` seconds, or the per-call ``timeout``) that
+    covers all of its attempts. Transport errors, timeouts, 429 and 5xx responses are
+    retried with full-jitter exponential backoff, honouring ``Retry-After``. Every
+    data-plane operation is idempotent (upserts and deletes are keyed by id), so a
+    retry never applies a change twice.
+
+    The client binds to the event loop of its first call; use ``IndexClient`` from
+    synchronous code.
+    """
+
+    def __init__(self, host, api_key=None, timeout=5.0, max_retries=3, backoff_base=0.05, backoff_max=1.0,
+                 max_connections=32, http2=False):
+        self.host = host.rstrip('/') if host.startswith(('http://', 'https://')) else f"https://{host}"
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_connections = max_connections
+        self.http2 = http2
+        self._client = None
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+
+    def _get_client(self):
+        if self._client is None:
+            headers = {'Accept': 'application/json'}
+            if self.api_key:
+                headers['Api-Key'] = self.api_key
+            limits = httpx.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_connections, keepalive_expiry=60.0)
+            self._client = httpx.AsyncClient(base_url=self.host, headers=headers, limits=limits, http2=self.http2)
+        return self._client
+
+    async def _request(self, method, path, payload=None, params=None, timeout=None):
+        timeout = timeout or self.timeout
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.failures += 1
+                raise IndexRequestError(f"{method} {path} exceeded its {timeout}s deadline.")
+
+            retry_after = None
+            try:
+                response = await self._get_client().request(method, path, json=payload, params=params,
+                                                            timeout=remaining)
+                self.requests += 1
+                if response.status_code < 400:
+                    return response.json() if response.content else {}
+                error = IndexRequestError(f"{method} {path} returned {response.status_code}: {response.text[:200]}",
+                                          response.status_code)
+                retryable = response.status_code in RETRY_STATUSES
+                retry_after = response.headers.get('Retry-After')
+            except httpx.TransportError as e:
+                # Connection errors, resets and timeouts of a single attempt
+                self.requests += 1
+                error = IndexRequestError(f"{method} {path} failed: {type(e).__name__}: {e}")
+                retryable = True
+
+            if not retryable or attempt >= self.max_retries:
+                self.failures += 1
+                raise error
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+            if retry_after is not None:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+            if time.monotonic() + delay >= deadline:
+                self.failures += 1
+                raise error
+            attempt += 1
+            self.retries += 1
+            logging.info(f"Retrying {method} {path} in {delay * 1000:.0f} ms (attempt {attempt + 1}): {error}")
+            await asyncio.sleep(delay)
+
+    async def fetch(self, ids, timeout=None):
+        response = await self._request('GET', '/vectors/fetch', params={'ids': list(ids)}, timeout=timeout)
+        return {'vectors': response.get('vectors', {}), 'namespace': response.get('namespace', '')}
+
+    async def upsert(self, vectors, timeout=None):
+        payload = []
+        for vector in vectors:
+            if isinstance(vector, dict):
+                item = {'id': vector['id'], 'values': _as_list(vector['values'])}
+                if vector.get('metadata') is not None:
+                    item['metadata'] = vector['metadata']
+            else:
+                item = {'id': vector[0], 'values': _as_list(vector[1])}
+                if len(vector) == 3 and vector[2] is not None:
+                    item['metadata'] = vector[2]
+            payload.append(item)
+        response = await self._request('POST', '/vectors/upsert', {'vectors': payload}, timeout=timeout)
+        return {'upserted_count': response.get('upsertedCount', len(payload))}
+
+    async def query(self, vector, top_k=10, include_values=False, include_metadata=False, timeout=None):
+        payload = {'vector': _as_list(vector), 'topK': top_k, 'includeValues': include_values,
+                   'includeMetadata': include_metadata}
+        response = await self._request('POST', '/query', payload, timeout=timeout)
+        return {'matches': response.get('matches', []), 'namespace': response.get('namespace', '')}
+
+    async def query_batch(self, vectors, top_k=10, include_values=False, include_metadata=False, timeout=None):
+        """
+        Sends several query vectors in one request (the ``queries`` form of ``/query``)
+        and returns one response per vector, in order.
+        """
+        payload = {'queries': [{'values': _as_list(vector)} for vector in vectors], 'topK': top_k,
+                   'includeValues': include_values, 'includeMetadata': include_metadata}
+        response = await self._request('POST', '/query', payload, timeout=timeout)
+        namespace = response.get('namespace', '')
+        return [{'matches': result.get('matches', []), 'namespace': namespace} for result in response['results']]
+
+    async def query_many(self, vectors, top_k=10, include_values=False, include_metadata=False,
+                         multi_query_size=None):
+        """
+        Runs several queries concurrently and returns the responses in order: one request
+        per vector, or one per ``multi_query_size`` vectors when that is set.
+        """
+        if multi_query_size:
+            chunks = [vectors[i:i + multi_query_size] for i in range(0, len(vectors), multi_query_size)]
+            results = await asyncio.gather(*(self.query_batch(chunk, top_k, include_values, include_metadata)
+                                             for chunk in chunks))
+            return [response for result in results for response in result]
+        return list(await asyncio.gather(*(self.query(vector, top_k, include_values, include_metadata)
+                                           for vector in vectors)))
+
+    async def delete(self, ids=None, delete_all=False, timeout=None):
+        payload = {'deleteAll': True} if delete_all else {'ids': list(ids or [])}
+        return await self._request('POST', '/vectors/delete', payload, timeout=timeout)
+
+    async def update(self, id, values=None, set_metadata=None, timeout=None):
+        payload = {'id': id}
+        if values is not None:
+            payload['values'] = _as_list(values)
+        if set_metadata is not None:
+            payload['setMetadata'] = set_metadata
+        return await self._request('POST', '/vectors/update', payload, timeout=timeout)
+
+    async def describe_index_stats(self, timeout=None):
+        return _snake_keys(await self._request('POST', '/describe_index_stats', {}, timeout=timeout))
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self):
+        return {'requests': self.requests, 'retries': self.retries, 'failures': self.failures}
+
+
+class AsyncHttpIndex(VectorIndex):
+    """
+    ``VectorIndex`` whose ``a*`` methods await ``AsyncIndexClient`` on the caller's event loop.
+
+    This is the ``http`` backend of the app: index requests are coroutines on the app's
+    own loop, with no worker thread and no second loop per call. It has no blocking
+    methods; synchronous code (the ingest and clustering CLIs) uses ``IndexClient``.
+    """
+
+    def __init__(self, host, multi_query_size=None, **client_options):
+        """
+        Args:
+            host (str): The index host, as for IndexClient.
+            multi_query_size (int, optional): Vectors sent per request by ``aquery_many``, as for IndexClient.
+            **client_options: Passed to AsyncIndexClient (api_key, timeout, max_retries, ...).
+        """
+        self.multi_query_size = multi_query_size
+        self.aio = AsyncIndexClient(host, **client_options)
+
+    def _blocking(self, *args, **kwargs):
+        raise TypeError("AsyncHttpIndex is used through its async methods; use IndexClient from synchronous code.")
+
+    fetch = upsert = query = query_many = delete = update = describe_index_stats = _blocking
+
+    async def afetch(self, ids):
+        return await self.aio.fetch(ids)
+
+    async def aupsert(self, vectors):
+        return await self.aio.upsert(vectors)
+
+    async def aquery(self, vector, top_k=10, include_values=False, include_metadata=False):
+        return await self.aio.query(vector, top_k, include_values, include_metadata)
+
+    async def aquery_many(self, vectors, top_k=10, include_values=False, include_metadata=False):
+        return await self.aio.query_many(vectors, top_k, include_values, include_metadata, self.multi_query_size)
+
+    async def adelete(self, ids=None, delete_all=False):
+        return await self.aio.delete(ids, delete_all)
+
+    async def aupdate(self, id, values=None, set_metadata=None):
+        return await self.aio.update(id, values, set_metadata)
+
+    async def adescribe_index_stats(self):
+        return await self.aio.describe_index_stats()
+
+    def stats(self):
+        return self.aio.stats()
+
+    async def aclose(self):
+        await self.aio.aclose()
+
+
+class IndexClient(VectorIndex):
+    """
+    Blocking ``VectorIndex`` over ``AsyncIndexClient``, for synchronous code.
+
+    The async client runs on an event loop in a background thread, so the ingest and
+    clustering CLIs, and the worker threads they start, can call it directly while all
+    requests share the one connection pool. The app uses AsyncHttpIndex instead.
+    ``query_many`` sends several queries concurrently and waits for all of them.
+    """
+
+    def __init__(self, host, multi_query_size=None, **client_options):
+        """
+        Args:
+            host (str): The index host, e.g. ``faces-abc123.svc.us-west1-gcp.pinecone.io`` or
+                ``http://127.0.0.1:8081`` for the local index server.
+            multi_query_size (int, optional): Vectors sent per request by ``query_many``, for
+                servers that accept the ``queries`` form of ``/query``. By default each
+                vector is its own request.
+            **client_options: Passed to AsyncIndexClient (api_key, timeout, max_retries, ...).
+        """
+        self.multi_query_size = multi_query_size
+        self.aio = AsyncIndexClient(host, **client_options)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='index-client', daemon=True)
+        self._thread.start()
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def fetch(self, ids):
+        return self._run(self.aio.fetch(ids))
+
+    def upsert(self, vectors):
+        return self._run(self.aio.upsert(vectors))
+
+    def query(self, vector, top_k=10, include_values=False, include_metadata=False):
+        return self._run(self.aio.query(vector, top_k, include_values, include_metadata))
+
+    def query_many(self, vectors, top_k=10, include_values=False, include_metadata=False):
+        """
+        Runs the queries concurrently and returns the responses in order: one request per
+        vector, or one per ``multi_query_size`` vectors when that is set.
+        """
+        return self._run(self.aio.query_many(vectors, top_k, include_values, include_metadata,
+                                             self.multi_query_size))
+
+    def delete(self, ids=None, delete_all=False):
+        return self._run(self.aio.delete(ids, delete_all))
+
+    def update(self, id, values=None, set_metadata=None):
+        return self._run(self.aio.update(id, values, set_metadata))
+
+    def describe_index_stats(self):
+        return self._run(self.aio.describe_index_stats())
+
+    def stats(self):
+        return self.aio.stats()
+
+    def close(self):
+        self._run(self.aio.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
@@ -0,0 +1,232 @@
+"""
+Local stand-in for the Pinecone REST data plane, with fault injection.
+
+Serves ``/query`` (one vector, or several under ``queries``), ``/vectors/upsert``, ``/vectors/fetch``, ``/vectors/delete``,
+``/vectors/update`` and ``/describe_index_stats`` from an in-process NumpyIndex,
+so the index client, its retries and its deadlines can be exercised offline. Faults
+are injected per request: fixed latency with jitter, a fraction of slow requests
+(tail latency), 503 errors and dropped connections.
+
+Usage:
+    python -m src.components.index_server --port 8081 --latency-ms 2 --slow-rate 0.01 --slow-ms 400 --error-rate 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from src.logger import logging
+from src.components.vector_index import NumpyIndex
+
+
+class FaultInjector:
+    """
+    Decides, per request, how much extra latency to add and whether to fail it.
+
+    Args:
+        latency_ms (float): Latency added to every request.
+        jitter_ms (float): Uniform random latency added on top.
+        slow_rate (float): Fraction of requests delayed by a further ``slow_ms``.
+        slow_ms (float): The extra delay of slow requests.
+        error_rate (float): Fraction of requests answered with 503.
+        drop_rate (float): Fraction of requests whose connection is closed without a response.
+        seed (int, optional): Seed for reproducible fault sequences.
+    """
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, slow_rate=0.0, slow_ms=0.0, error_rate=0.0, drop_rate=0.0,
+                 seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def apply(self):
+        """
+        Sleeps for the injected latency and returns ``'error'``, ``'drop'`` or None.
+        """
+        with self._lock:
+            delay = self.latency_ms + self._random.uniform(0, self.jitter_ms)
+            if self._random.random() < self.slow_rate:
+                delay += self.slow_ms
+            roll = self._random.random()
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if roll < self.drop_rate:
+            return 'drop'
+        if roll < self.drop_rate + self.error_rate:
+            return 'error'
+        return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive between requests, as the real service does
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out as separate writes; without TCP_NODELAY each response waits on a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on this request (e.g. its deadline passed)
+            self.close_connection = True
+
+    def _dispatch(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length)) if length else {}
+        url = urlparse(self.path)
+
+        fault = self.server.faults.apply()
+        if fault == 'drop':
+            self.close_connection = True
+            return
+        if fault == 'error':
+            self._send(503, {'error': 'Injected failure.'})
+            return
+
+        index = self.server.index
+        try:
+            if url.path == '/query' and 'queries' in payload:
+                # Several query vectors in one request, answered in order
+                responses = index.query_many([query['values'] for query in payload['queries']],
+                                             top_k=payload.get('topK', 10),
+                                             include_values=payload.get('includeValues', False),
+                                             include_metadata=payload.get('includeMetadata', False))
+                self._send(200, {'results': responses, 'namespace': ''})
+            elif url.path == '/query':
+                self._send(200, index.query(payload['vector'], top_k=payload.get('topK', 10),
+                                            include_values=payload.get('includeValues', False),
+                                            include_metadata=payload.get('includeMetadata', False)))
+            elif url.path == '/vectors/upsert':
+                result = index.upsert(payload['vectors'])
+                self._send(200, {'upsertedCount': result['upserted_count']})
+            elif url.path == '/vectors/fetch':
+                self._send(200, index.fetch(parse_qs(url.query).get('ids', [])))
+            elif url.path == '/vectors/delete':
+                self._send(200, index.delete(ids=payload.get('ids'), delete_all=payload.get('deleteAll', False)))
+            elif url.path == '/vectors/update':
+                self._send(200, index.update(payload['id'], values=payload.get('values'),
+                                             set_metadata=payload.get('setMetadata')))
+            elif url.path == '/describe_index_stats':
+                stats = index.describe_index_stats()
+                self._send(200, {'dimension': stats['dimension'], 'totalVectorCount': stats['total_vector_count'],
+                                 'namespaces': {'': {'vectorCount': stats['total_vector_count']}}})
+            else:
+                self._send(404, {'error': f"Unknown path {url.path}."})
+        except KeyError as e:
+            self._send(404, {'error': str(e)})
+        except (ValueError, TypeError) as e:
+            self._send(400, {'error': str(e)})
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connects from a pooled client opening many connections at once
+    request_queue_size = 128
+
+
+class IndexServer:
+    """
+    Runs the stand-in server on a background thread.
+
+    Example:
+        with IndexServer(NumpyIndex(), faults=FaultInjector(error_rate=0.05)) as server:
+            client = IndexClient(server.url)
+    """
+
+    def __init__(self, index=None, host='127.0.0.1', port=0, faults=None):
+        self.index = index if index is not None else NumpyIndex()
+        self._server = _Server((host, port), _Handler)
+        self._server.index = self.index
+        self._server.faults = faults or FaultInjector()
+        self._thread = None
+
+    @property
+    def faults(self):
+        return self._server.faults
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='index-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--dimension', type=int, default=128)
+    parser.add_argument('--metric', default='euclidean')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--slow-rate', type=float, default=0.0)
+    parser.add_argument('--slow-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--data-dir', help="Persist the index here (write-ahead log plus snapshots)")
+    args = parser.parse_args(argv)
+
+    faults = FaultInjector(args.latency_ms, args.jitter_ms, args.slow_rate, args.slow_ms, args.error_rate,
+                           args.drop_rate, args.seed)
+    def factory():
+        return NumpyIndex(dimension=args.dimension, metric=args.metric)
+    if args.data_dir:
+        from src.components.durable_index import DurableIndex
+        index = DurableIndex(args.data_dir, factory)
+    else:
+        index = factory()
+    server = IndexServer(index, args.host, args.port, faults)
+    print(f"Index server listening on {server.url}", flush=True)
+    logging.info(f"Index server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if hasattr(index, 'close'):
+            index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+# inference_executor.py
+import math
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import numpy as np
+from src.exception import CustomException
+from src.logger import logging
+
+
+def cpu_limit():
+    """
+    Returns the number of CPUs this process may use.
+
+    The container CPU quota (cgroup v2 ``cpu.max`` or cgroup v1 ``cfs_quota_us``) is
+    honoured, so a pod limited to 4000m reports 4 even on a larger node.
+
+    Returns:
+        int: The usable CPU count, at least 1.
+    """
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        count = os.cpu_count() or 1
+
+    quota = None
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            limit, period = f.read().split()
+            if limit != 'max':
+                quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                limit = int(f.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = int(f.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+    if quota is not None:
+        count = min(count, max(1, math.floor(quota)))
+    return max(1, count)
+
+
+def _init_worker(intra_op_threads, inter_op_threads, detection_max_side, detection_min_face_size,
+                 embedding_settings):
+    # Thread counts must be pinned before TensorFlow creates its thread pools
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(intra_op_threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = str(inter_op_threads)
+    os.environ['OMP_NUM_THREADS'] = str(intra_op_threads)
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+    from src.components.deepface_module_fastapi import configure_pipeline, warm_up_pipeline
+    # An ONNX session gets the worker's thread share unless its own counts are configured
+    embedding_settings = dict(embedding_settings or {})
+    embedding_settings['onnx_intra_op_threads'] = embedding_settings.get('onnx_intra_op_threads') or intra_op_threads
+    embedding_settings['onnx_inter_op_threads'] = embedding_settings.get('onnx_inter_op_threads') or inter_op_threads
+    # The parent process owns the cache; each worker is one batch-of-one model instance
+    configure_pipeline(batching=False, cache=False, executor='thread', detection_max_side=detection_max_side,
+                       detection_min_face_size=detection_min_face_size, **embedding_settings)
+    warm_up_pipeline()
+
+
+def _worker_pid(hold_s):
+    # Holding the worker briefly makes the pool hand the next probe to another worker
+    time.sleep(hold_s)
+    return os.getpid()
+
+
+def _run_in_worker(input_name, shape, dtype, output_name, dimension):
+    # Returns (values written, error message, exception text); exceptions are not pickled
+    from src.components.deepface_module_fastapi import _embed_image
+    input_shm = shared_memory.SharedMemory(name=input_name)
+    output_shm = shared_memory.SharedMemory(name=output_name)
+    img = None
+    try:
+        img = np.ndarray(shape, dtype=dtype, buffer=input_shm.buf)
+        embedding, error = _embed_image(img)
+        if error:
+            return 0, error, None
+        if len(embedding) != dimension:
+            raise ValueError(f"Embedding has {len(embedding)} values, expected {dimension}.")
+        np.ndarray((dimension,), dtype=np.float32, buffer=output_shm.buf)[:] = embedding
+        return len(embedding), None, None
+    except Exception as e:
+        return 0, None, str(e)
+    finally:
+        del img  # release the buffer views before closing the blocks
+        input_shm.close()
+        output_shm.close()
+
+
+def _run_faces_in_worker(input_name, shape, dtype):
+    # Returns (faces, error message, exception text); the faces and their embeddings are small enough to pickle
+    from src.components.deepface_module_fastapi import _embed_faces
+    input_shm = shared_memory.SharedMemory(name=input_name)
+    img = None
+    try:
+        img = np.ndarray(shape, dtype=dtype, buffer=input_shm.buf)
+        faces, error = _embed_faces(img)
+        return faces, error, None
+    except Exception as e:
+        return None, None, str(e)
+    finally:
+        del img
+        input_shm.close()
+
+
+class ProcessInferenceExecutor:
+    """
+    Runs face detection and embedding in a pool of worker processes.
+
+    Each worker loads MTCNN and the embedding backend once at start-up with the
+    intra-op and inter-op thread pools of TensorFlow (and ONNX Runtime) pinned, so
+    the workers neither share a GIL nor compete for cores. The decoded image goes to
+    the worker through a shared-memory block, and the worker writes the embedding
+    into a second block, so pixels are never pickled.
+
+    By default the pool gets one worker per CPU in the container quota divided by
+    ``intra_op_threads``, which gives 4 single-threaded workers on a 4-CPU pod.
+    """
+
+    def __init__(self, workers=None, intra_op_threads=1, inter_op_threads=1, dimension=128,
+                 detection_max_side=None, detection_min_face_size=None, embedding_settings=None):
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.detection_max_side = detection_max_side
+        self.detection_min_face_size = detection_min_face_size
+        self.embedding_settings = embedding_settings
+        self.workers = workers or max(1, cpu_limit() // intra_op_threads)
+        self.dimension = dimension
+        self._lock = threading.Lock()
+        self._pool = self._create_pool()
+        logging.info(f"Process inference executor started with {self.workers} workers "
+                     f"({intra_op_threads} intra-op / {inter_op_threads} inter-op threads each).")
+
+    def _create_pool(self):
+        # spawn, not fork: the parent may already hold TensorFlow threads and locks
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_worker,
+                                   initargs=(self.intra_op_threads, self.inter_op_threads,
+                                             self.detection_max_side, self.detection_min_face_size,
+                                             self.embedding_settings))
+
+    def _share(self, img):
+        # Copies the image into a new shared-memory block
+        img = np.ascontiguousarray(img)
+        input_shm = shared_memory.SharedMemory(create=True, size=max(img.nbytes, 1))
+        np.ndarray(img.shape, dtype=img.dtype, buffer=input_shm.buf)[:] = img
+        return img, input_shm
+
+    def _submit(self, img):
+        img, input_shm = self._share(img)
+        output_shm = shared_memory.SharedMemory(create=True, size=self.dimension * 4)
+        with self._lock:
+            pool = self._pool
+        future = pool.submit(_run_in_worker, input_shm.name, img.shape, img.dtype.str, output_shm.name,
+                             self.dimension)
+        return future, pool, input_shm, output_shm
+
+    def _collect(self, future, pool, input_shm, output_shm):
+        try:
+            count, error, exception = future.result()
+            if exception:
+                raise CustomException(exception, sys)
+            if error:
+                return None, error
+            return np.ndarray((count,), dtype=np.float32, buffer=output_shm.buf).tolist(), None
+        except BrokenProcessPool as e:
+            self._restart(pool)
+            raise CustomException(f"Inference worker died: {str(e)}", sys) from e
+        finally:
+            input_shm.close()
+            input_shm.unlink()
+            output_shm.close()
+            output_shm.unlink()
+
+    def _restart(self, broken_pool):
+        with self._lock:
+            if self._pool is broken_pool:
+                logging.error("Inference worker pool broke; starting a new one.")
+                self._pool = self._create_pool()
+
+    def run(self, img):
+        """
+        Detects the face in a decoded image and returns its embedding, blocking the caller.
+
+        Args:
+            img (numpy.ndarray): The image in BGR channel order.
+
+        Returns:
+            tuple: ``(embedding, error)`` as returned by extract_embedding.
+        """
+        return self._collect(*self._submit(img))
+
+    def run_faces(self, img):
+        """
+        Detects every face in a decoded image and embeds them all, blocking the caller.
+
+        The worker embeds the crops in one batched forward pass. The image goes through
+        shared memory as in ``run``; the faces come back pickled.
+
+        Args:
+            img (numpy.ndarray): The image in BGR channel order.
+
+        Returns:
+            tuple: ``(faces, error)`` as returned by extract_face_embeddings.
+        """
+        img, input_shm = self._share(img)
+        with self._lock:
+            pool = self._pool
+        try:
+            faces, error, exception = pool.submit(_run_faces_in_worker, input_shm.name, img.shape,
+                                                  img.dtype.str).result()
+            if exception:
+                raise CustomException(exception, sys)
+            return faces, error
+        except BrokenProcessPool as e:
+            self._restart(pool)
+            raise CustomException(f"Inference worker died: {str(e)}", sys) from e
+        finally:
+            input_shm.close()
+            input_shm.unlink()
+
+    def warm_up(self, timeout=600.0):
+        """
+        Blocks until every worker process has started and run its model warm-up.
+
+        Workers are spawned, and run their initializer, only once work is submitted, so
+        probes are submitted until every worker has answered one.
+
+        Returns:
+            bool: True if all workers answered within ``timeout`` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        seen = set()
+        while len(seen) < self.workers and time.monotonic() < deadline:
+            with self._lock:
+                pool = self._pool
+            futures = [pool.submit(_worker_pid, 0.2) for _ in range(self.workers)]
+            seen.update(future.result(timeout=max(deadline - time.monotonic(), 0.1)) for future in futures)
+        logging.info(f"{len(seen)} of {self.workers} inference workers warmed up.")
+        return len(seen) >= self.workers
+
+    def shutdown(self):
+        with self._lock:
+            self._pool.shutdown(wait=True, cancel_futures=True)
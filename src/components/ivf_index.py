@@ -0,0 +1,552 @@
+# ivf_index.py
+import threading
+import numpy as np
+from src.logger import logging
+from src.components.vector_index import VectorIndex, _parse_vector
+
+
+def _sq_distances(x, centroids, centroid_sq_norms=None):
+    # Squared L2 distances between every row of x and every centroid
+    if centroid_sq_norms is None:
+        centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+    d = np.einsum('ij,ij->i', x, x)[:, None] - 2 * (x @ centroids.T) + centroid_sq_norms[None, :]
+    return np.maximum(d, 0)
+
+
+def _assign(x, centroids):
+    # Nearest centroid per row, chunked so the distance matrix stays around 64 MB
+    centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+    chunk_size = max(1024, (1 << 24) // len(centroids))
+    labels = np.empty(len(x), dtype=np.int32)
+    for start in range(0, len(x), chunk_size):
+        chunk = x[start:start + chunk_size]
+        labels[start:start + chunk_size] = _sq_distances(chunk, centroids, centroid_sq_norms).argmin(axis=1)
+    return labels
+
+
+def kmeans(x, k, iterations=20, seed=0):
+    """
+    Lloyd's k-means with k-means++ style seeding on a sample.
+
+    Args:
+        x (numpy.ndarray): Training vectors, shape (n, d), float32.
+        k (int): Number of centroids. Must not exceed n.
+        iterations (int): Number of Lloyd iterations.
+        seed (int): Random seed, so that rebuilds are reproducible.
+
+    Returns:
+        numpy.ndarray: The centroids, shape (k, d), float32.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(x)
+    if k > n:
+        raise ValueError(f"Cannot train {k} centroids on {n} vectors.")
+
+    # k-means++ seeding over a bounded sample keeps seeding cost independent of n
+    sample = x[rng.choice(n, size=min(n, 50 * k), replace=False)]
+    centroids = np.empty((k, x.shape[1]), dtype=np.float32)
+    centroids[0] = sample[rng.integers(len(sample))]
+    closest = _sq_distances(sample, centroids[:1])[:, 0]
+    for i in range(1, k):
+        total = closest.sum()
+        index = rng.choice(len(sample), p=closest / total) if total > 0 else rng.integers(len(sample))
+        centroids[i] = sample[index]
+        closest = np.minimum(closest, _sq_distances(sample, centroids[i:i + 1])[:, 0])
+
+    for _ in range(iterations):
+        labels = _assign(x, centroids)
+        counts = np.bincount(labels, minlength=k)
+        empty = counts == 0
+        # Sum each cluster as one contiguous segment of the label-sorted vectors
+        order = np.argsort(labels, kind='stable')
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sums = np.add.reduceat(x[order].astype(np.float64), starts[~empty], axis=0)
+        centroids[~empty] = (sums / counts[~empty, None]).astype(np.float32)
+        # Re-seed empty clusters on random points so every list stays useful
+        if empty.any():
+            centroids[empty] = x[rng.choice(n, size=int(empty.sum()), replace=False)]
+    return centroids
+
+
+class IVFIndex(VectorIndex):
+    """
+    Approximate nearest-neighbour index using an inverted file (IVF).
+
+    Vectors are clustered by k-means into ``nlist`` lists; a query scans only the
+    lists whose centroids are closest to it. By default that is ``probe_fraction`` of
+    the lists, so recall stays put as ``nlist`` grows with the index; a fixed
+    ``nprobe`` overrides it. Query cost falls roughly by ``nlist / nprobe`` compared
+    with exact search, and raising either setting trades latency for recall.
+
+    The defaults come from ``benchmarks/ann_recall.py`` on a synthetic 128-d gallery:
+    recall@10 only passes 0.95 once about 30% of the lists are scanned (a fixed 8
+    lists gave 0.49 on 100k vectors, although recall@1 was 0.96), where queries are
+    1.4x faster than exact search on 200k vectors and 1.3x on 400k. Lower
+    ``probe_fraction`` if a lower recall@10 is acceptable: at 10% queries are 3.5-5x
+    faster and recall@1 stays above 0.99. Below about 200k vectors an exact scan is as
+    fast as that, so the index searches exactly until ``train_size`` (200k by default)
+    vectors are stored. Re-run the report on real embeddings before tuning.
+
+    With ``pq_m`` set, the probed lists are first scanned on product-quantized codes
+    (``pq_m`` bytes per vector) and only the best ``top_k * refine_factor`` candidates
+    are re-ranked on the exact vectors. In NumPy the code lookups cost more than the
+    BLAS scan they replace, and the exact vectors are still kept for re-ranking, so PQ
+    is slower than plain IVF and lowers recall; it is there for comparison with
+    compiled ANN libraries and is off by default.
+
+    Once trained, new vectors are assigned to the existing lists. Deletes and
+    overwrites leave tombstones that queries skip. Once tombstones exceed
+    ``rebuild_ratio`` of the rows, or the index has grown ``retrain_growth`` times since
+    training, ``rebuild`` compacts the storage and retrains the centroids. With
+    ``auto_rebuild`` (the default) writes only notice that and start the rebuild on a
+    background thread; without it, ``rebuild`` is left to the caller. Rebuilds also
+    store each list's vectors contiguously, so scanning a list reads one slice of
+    memory; vectors added since the last rebuild are scanned from a per-list overflow.
+
+    Scores follow the same conventions as NumpyIndex: squared L2 for ``euclidean``,
+    cosine similarity for ``cosine``.
+    """
+
+    def __init__(self, dimension=128, metric='euclidean', nlist=None, nprobe=None, probe_fraction=0.3,
+                 pq_m=None, refine_factor=4, train_size=None, rebuild_ratio=0.2, retrain_growth=4.0,
+                 auto_rebuild=True, initial_capacity=1024, seed=0):
+        if metric not in ('euclidean', 'cosine'):
+            raise ValueError(f"Unsupported metric {metric!r}. Expected 'euclidean' or 'cosine'.")
+        if not 0 < probe_fraction <= 1:
+            raise ValueError(f"probe_fraction must be in (0, 1], got {probe_fraction}.")
+        if pq_m is not None and dimension % pq_m:
+            raise ValueError(f"pq_m ({pq_m}) must divide the dimension ({dimension}).")
+        self.dimension = dimension
+        self.metric = metric
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.probe_fraction = probe_fraction
+        self.pq_m = pq_m
+        self.refine_factor = refine_factor
+        self.train_size = train_size
+        self.rebuild_ratio = rebuild_ratio
+        self.retrain_growth = retrain_growth
+        self.auto_rebuild = auto_rebuild
+        self.seed = seed
+
+        self._lock = threading.RLock()
+        self._rebuild_lock = threading.Lock()  # one rebuild at a time
+        self._rebuilder = None                 # the background rebuild thread, while one runs
+        capacity = max(initial_capacity, 1)
+        self._matrix = np.empty((capacity, dimension), dtype=np.float32)
+        self._sq_norms = np.empty(capacity, dtype=np.float32)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._labels = np.full(capacity, -1, dtype=np.int32)
+        self._codes = None
+        self._ids = []          # row -> id, None for tombstoned rows
+        self._rows = {}         # id -> live row
+        self._metadata = {}
+        self._size = 0          # rows in use, including tombstones
+        self._tombstones = 0
+
+        self._centroids = None
+        self._centroid_sq_norms = None
+        self._codebooks = None  # (pq_m, 256, dimension // pq_m)
+        self._offsets = None    # list id -> start row of its contiguous block, plus the end of the last
+        self._overflow = 0      # rows added to the lists since the last rebuild
+        self._lists = []        # list id -> python list of overflow rows added since the last rebuild
+        self._list_arrays = []  # list id -> cached numpy array of overflow rows, None when stale
+        self._trained_size = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def is_trained(self):
+        return self._centroids is not None
+
+    # ----------------------------------------------------------------- storage
+
+    def _ensure_capacity(self, size):
+        capacity = self._matrix.shape[0]
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+
+        def grow(array, fill=None):
+            grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+            if fill is not None:
+                grown[self._size:] = fill
+            grown[:self._size] = array[:self._size]
+            return grown
+
+        self._matrix = grow(self._matrix)
+        self._sq_norms = grow(self._sq_norms)
+        self._alive = grow(self._alive, False)
+        self._labels = grow(self._labels, -1)
+        if self._codes is not None:
+            self._codes = grow(self._codes)
+
+    def _as_vector(self, values):
+        vector = np.asarray(values, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dimension:
+            raise ValueError(f"Vector dimension {vector.shape[0]} does not match index dimension {self.dimension}.")
+        if self.metric == 'cosine':
+            norm = np.linalg.norm(vector)
+            vector = vector / norm if norm > 0 else vector
+        return vector
+
+    def _tombstone(self, row):
+        self._alive[row] = False
+        self._ids[row] = None
+        self._tombstones += 1
+
+    def _score(self, sq_distances):
+        # Cosine vectors are unit length, so |a - b|^2 = 2 - 2 cos(a, b)
+        if self.metric == 'cosine':
+            return 1 - sq_distances / 2
+        return sq_distances
+
+    # ---------------------------------------------------------------- training
+
+    def _default_nlist(self, n):
+        return max(1, min(int(4 * np.sqrt(n)), n // 39 or 1))
+
+    def _default_nprobe(self, nlist):
+        if self.nprobe:
+            return min(self.nprobe, nlist)
+        return max(1, int(np.ceil(self.probe_fraction * nlist)))
+
+    def _fit(self, x):
+        # Trains centroids (and PQ codebooks) on x without touching the index
+        nlist = self.nlist or self._default_nlist(len(x))
+        rng = np.random.default_rng(self.seed)
+        # 64 points per centroid is plenty for k-means; cap the sample to bound training time
+        sample = x[rng.choice(len(x), size=min(len(x), 64 * nlist, 131072), replace=False)]
+        centroids = kmeans(sample, nlist, iterations=10, seed=self.seed)
+        codebooks = None
+        if self.pq_m is not None:
+            residuals = sample - centroids[_assign(sample, centroids)]
+            sub = self.dimension // self.pq_m
+            ksub = min(256, len(sample))
+            codebooks = np.stack([
+                kmeans(np.ascontiguousarray(residuals[:, j * sub:(j + 1) * sub]), ksub, iterations=10, seed=self.seed + j)
+                for j in range(self.pq_m)
+            ])
+        logging.info(f"IVF index trained: {nlist} lists on {len(x)} vectors"
+                     + (f", PQ with {self.pq_m} sub-quantizers." if self.pq_m else "."))
+        return centroids, codebooks
+
+    def _quantize(self, x, centroids, codebooks):
+        # Nearest list of every row of x and, with PQ, the codes of its residual
+        labels = _assign(x, centroids)
+        if codebooks is None:
+            return labels, None
+        sub = self.dimension // self.pq_m
+        residuals = x - centroids[labels]
+        codes = np.empty((len(x), self.pq_m), dtype=np.uint8)
+        for j in range(self.pq_m):
+            codes[:, j] = _assign(np.ascontiguousarray(residuals[:, j * sub:(j + 1) * sub]), codebooks[j])
+        return labels, codes
+
+    def _assign_rows(self, rows):
+        labels, codes = self._quantize(self._matrix[rows], self._centroids, self._codebooks)
+        self._labels[rows] = labels
+        if codes is not None:
+            self._codes[rows] = codes
+        return labels
+
+    def _add_to_lists(self, rows):
+        if len(rows) == 0:
+            return
+        labels = self._assign_rows(rows)
+        self._overflow += len(rows)
+        for row, label in zip(rows.tolist(), labels.tolist()):
+            self._lists[label].append(row)
+            self._list_arrays[label] = None
+
+    def rebuild(self, retrain=None):
+        """
+        Compacts away tombstoned rows and, if needed, retrains the centroids.
+
+        This is the index's maintenance call. With ``auto_rebuild`` it runs on a background
+        thread whenever writes make it due; otherwise call it yourself, e.g. from a scheduled
+        job. Training runs on a copy of the vectors without holding the index lock, so
+        queries and writes carry on meanwhile (with the old lists, or exact search before
+        the first training); only the final compaction, a copy of the storage, blocks them.
+
+        Args:
+            retrain (bool, optional): Force (True) or skip (False) retraining. By default the
+                index trains once it holds ``train_size`` vectors, and retrains when it has
+                grown ``retrain_growth`` times since it was last trained.
+        """
+        with self._rebuild_lock:
+            with self._lock:
+                if retrain is None:
+                    retrain = self._retrain_due()
+                retrain = retrain and len(self._rows) >= self._min_train_size()
+                if retrain:
+                    snapshot_size = self._size
+                    live = np.flatnonzero(self._alive[:snapshot_size])
+                    x = self._matrix[live]
+
+            if retrain:
+                centroids, codebooks = self._fit(x)
+                labels, codes = self._quantize(x, centroids, codebooks)
+
+            with self._lock:
+                if retrain:
+                    self._centroids = centroids
+                    self._centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+                    self._codebooks = codebooks
+                    if codebooks is not None:
+                        self._codes = np.zeros((self._matrix.shape[0], self.pq_m), dtype=np.uint8)
+                        self._codes[live] = codes
+                    self._labels[live] = labels
+                    # Rows written while training ran were assigned to the old lists, if any
+                    newer = np.flatnonzero(self._alive[snapshot_size:self._size]) + snapshot_size
+                    if len(newer):
+                        self._assign_rows(newer)
+                    self._trained_size = len(live)
+
+                self._compact(np.flatnonzero(self._alive[:self._size]))
+                count = self._size
+                if self.is_trained:
+                    # Store every list as one contiguous block of rows
+                    order = np.argsort(self._labels[:count], kind='stable')
+                    self._compact(order)
+                    counts = np.bincount(self._labels[:count], minlength=len(self._centroids))
+                    self._offsets = np.concatenate(([0], np.cumsum(counts)))
+                    self._overflow = 0
+                    self._lists = [[] for _ in range(len(self._centroids))]
+                    self._list_arrays = [None] * len(self._lists)
+                logging.info(f"IVF index rebuilt with {count} live vectors.")
+
+    def _compact(self, rows):
+        # Moves the given rows, in this order, to the front of the storage and drops the rest
+        count = len(rows)
+        ids = [self._ids[row] for row in rows.tolist()]
+        self._matrix[:count] = self._matrix[rows]
+        self._sq_norms[:count] = self._sq_norms[rows]
+        self._alive[:count] = True
+        self._alive[count:] = False
+        self._labels[:count] = self._labels[rows]
+        if self._codes is not None:
+            self._codes[:count] = self._codes[rows]
+        self._ids = ids
+        self._rows = {vector_id: row for row, vector_id in enumerate(ids)}
+        self._size = count
+        self._tombstones = 0
+
+    def _min_train_size(self):
+        if self.train_size is not None:
+            return self.train_size
+        return max(200000, 39 * (self.nlist or 1))
+
+    def _retrain_due(self):
+        if not self.is_trained:
+            return len(self._rows) >= self._min_train_size()
+        return len(self._rows) >= self.retrain_growth * max(self._trained_size, 1)
+
+    def _rebuild_due(self):
+        return self._retrain_due() or self._tombstones > self.rebuild_ratio * max(self._size, 1)
+
+    def _maybe_maintain(self):
+        # Called under the lock after every write; the rebuild itself never runs on the writer's thread
+        if self.auto_rebuild and self._rebuilder is None and self._rebuild_due():
+            self._rebuilder = threading.Thread(target=self._rebuild_in_background, name='ivf-rebuild', daemon=True)
+            self._rebuilder.start()
+
+    def _rebuild_in_background(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._rebuild_due():
+                        self._rebuilder = None
+                        return
+                self.rebuild()
+        except Exception as e:
+            logging.error(f"IVF index rebuild failed: {str(e)}")
+            with self._lock:
+                self._rebuilder = None
+
+    def wait_for_rebuild(self, timeout=None):
+        """
+        Blocks until a background rebuild, if one is running, has finished.
+
+        Returns:
+            bool: True if no rebuild is running any more.
+        """
+        rebuilder = self._rebuilder
+        if rebuilder is not None:
+            rebuilder.join(timeout)
+            return not rebuilder.is_alive()
+        return True
+
+    # -------------------------------------------------------------- operations
+
+    def fetch(self, ids):
+        with self._lock:
+            vectors = {}
+            for vector_id in ids:
+                row = self._rows.get(vector_id)
+                if row is None:
+                    continue
+                vectors[vector_id] = {'id': vector_id, 'values': self._matrix[row].tolist()}
+                if vector_id in self._metadata:
+                    vectors[vector_id]['metadata'] = self._metadata[vector_id]
+            return {'vectors': vectors, 'namespace': ''}
+
+    def upsert(self, vectors):
+        parsed = [(vector_id, self._as_vector(values), metadata)
+                  for vector_id, values, metadata in map(_parse_vector, vectors)]
+        with self._lock:
+            self._ensure_capacity(self._size + len(parsed))
+            new_rows = []
+            for vector_id, vector, metadata in parsed:
+                old_row = self._rows.get(vector_id)
+                if old_row is not None:
+                    self._tombstone(old_row)
+                row = self._size
+                self._size += 1
+                self._matrix[row] = vector
+                self._sq_norms[row] = vector @ vector
+                self._alive[row] = True
+                self._ids.append(vector_id)
+                self._rows[vector_id] = row
+                new_rows.append(row)
+                if metadata is not None:
+                    self._metadata[vector_id] = metadata
+            if self.is_trained:
+                self._add_to_lists(np.asarray(new_rows, dtype=np.int64))
+            self._maybe_maintain()
+            return {'upserted_count': len(parsed)}
+
+    def update(self, id, values=None, set_metadata=None):
+        with self._lock:
+            if id not in self._rows:
+                raise KeyError(f"Vector with ID {id} does not exist in the index.")
+            if values is not None:
+                self.upsert([{'id': id, 'values': values}])
+            if set_metadata is not None:
+                self._metadata.setdefault(id, {}).update(set_metadata)
+            return {}
+
+    def delete(self, ids=None, delete_all=False):
+        with self._lock:
+            if delete_all:
+                ids = list(self._rows)
+            for vector_id in ids or []:
+                row = self._rows.pop(vector_id, None)
+                if row is None:
+                    continue
+                self._metadata.pop(vector_id, None)
+                self._tombstone(row)
+            self._maybe_maintain()
+            return {}
+
+    def _list_rows(self, label):
+        rows = self._list_arrays[label]
+        if rows is None:
+            rows = np.asarray(self._lists[label], dtype=np.int64)
+            self._list_arrays[label] = rows
+        return rows
+
+    def _exact(self, query, rows):
+        return np.maximum(self._sq_norms[rows] - 2 * (self._matrix[rows] @ query) + query @ query, 0)
+
+    def _pq_distances(self, query, label, selector):
+        # Asymmetric distance: exact query residual against quantized stored residuals
+        sub = self.dimension // self.pq_m
+        residual = (query - self._centroids[label]).reshape(self.pq_m, 1, sub)
+        table = ((self._codebooks - residual) ** 2).sum(axis=2)  # (pq_m, ksub)
+        return table[np.arange(self.pq_m), self._codes[selector]].sum(axis=1)
+
+    def _scan(self, query, probes):
+        # Rows of the probed lists and their distances: |x|^2 - 2 x.q, or PQ distances with pq_m
+        starts, ends = self._offsets[probes], self._offsets[probes + 1]
+        lengths = ends - starts
+        rows = [np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())]
+        blocks = [(label, slice(start, end)) for label, start, end
+                  in zip(probes.tolist(), starts.tolist(), ends.tolist()) if end > start]
+        if self._overflow:
+            overflow = [(label, self._list_rows(label)) for label in probes.tolist() if self._lists[label]]
+            rows.extend(selector for _, selector in overflow)
+            blocks.extend(overflow)
+        rows = np.concatenate(rows)
+        if not blocks:
+            return rows, np.empty(0, dtype=np.float32)
+        if self.pq_m is not None:
+            return rows, np.concatenate([self._pq_distances(query, label, selector) for label, selector in blocks])
+        # One matrix-vector product per list, on a slice of the storage rather than a gathered copy
+        dots = np.concatenate([self._matrix[selector] @ query for _, selector in blocks])
+        return rows, self._sq_norms[rows] - 2 * dots
+
+    def query(self, vector, top_k=10, include_values=False, include_metadata=False, nprobe=None):
+        """
+        Returns the approximate ``top_k`` nearest vectors, best match first.
+
+        Args:
+            nprobe (int, optional): Lists to scan for this query; defaults to ``nprobe`` or
+                ``probe_fraction`` of the lists.
+        """
+        query = self._as_vector(vector)
+        with self._lock:
+            if not self._rows or top_k <= 0:
+                return {'matches': [], 'namespace': ''}
+
+            if not self.is_trained:
+                candidates = np.flatnonzero(self._alive[:self._size])
+                distances = self._exact(query, candidates)
+            else:
+                nlist = len(self._centroids)
+                nprobe = min(nprobe or self._default_nprobe(nlist), nlist)
+                centroid_distances = self._centroid_sq_norms - 2 * (self._centroids @ query)
+                probes = np.argpartition(centroid_distances, nprobe - 1)[:nprobe]
+                candidates, scanned = self._scan(query, probes)
+                alive = self._alive[candidates]
+                candidates, scanned = candidates[alive], scanned[alive]
+                if self.pq_m is not None:
+                    # Re-rank the best PQ candidates on the exact vectors
+                    keep = min(len(candidates), max(top_k * self.refine_factor, top_k))
+                    if keep < len(candidates):
+                        candidates = candidates[np.argpartition(scanned, keep - 1)[:keep]]
+                    distances = self._exact(query, candidates)
+                else:
+                    distances = np.maximum(scanned + query @ query, 0)
+
+            k = min(top_k, len(candidates))
+            if k == 0:
+                return {'matches': [], 'namespace': ''}
+            top = np.argpartition(distances, k - 1)[:k] if k < len(candidates) else np.arange(len(candidates))
+            top = top[np.argsort(distances[top], kind='stable')]
+            scores = self._score(distances[top])
+
+            matches = []
+            for row, score in zip(candidates[top].tolist(), scores.tolist()):
+                vector_id = self._ids[row]
+                match = {'id': vector_id, 'score': float(score)}
+                if include_values:
+                    match['values'] = self._matrix[row].tolist()
+                if include_metadata and vector_id in self._metadata:
+                    match['metadata'] = self._metadata[vector_id]
+                matches.append(match)
+            return {'matches': matches, 'namespace': ''}
+
+    def export_arrays(self):
+        """
+        Returns a copy of the live vectors as ``(ids, vectors, metadata)``.
+        """
+        with self._lock:
+            rows = np.flatnonzero(self._alive[:self._size])
+            return ([self._ids[row] for row in rows.tolist()], self._matrix[rows],
+                    {vector_id: dict(metadata) for vector_id, metadata in self._metadata.items()})
+
+    def describe_index_stats(self):
+        with self._lock:
+            return {
+                'dimension': self.dimension,
+                'total_vector_count': len(self._rows),
+                'trained': self.is_trained,
+                'nlist': len(self._centroids) if self.is_trained else 0,
+                'nprobe': self._default_nprobe(len(self._centroids)) if self.is_trained else 0,
+                'tombstones': self._tombstones,
+                'rebuild_due': self._rebuild_due(),
+                'rebuilding': self._rebuilder is not None,
+            }
@@ -0,0 +1,264 @@
+# metrics.py
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Latency buckets in seconds, from sub-millisecond cache hits to multi-second cold model calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}.")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count, e.g. index calls by operation and outcome.
+    """
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down, e.g. requests in flight.
+    """
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in cumulative buckets, e.g. stage latencies.
+
+    An observation is one bisect and three additions under a lock, so it is cheap
+    enough to record on every request.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Holds the process's metrics and renders them in the Prometheus text exposition format.
+
+    Besides the metrics created through it, collectors can be registered: callables
+    that return ``(name, help, value)`` tuples at scrape time. They expose stats that
+    already live elsewhere (cache, batcher, admission queue) as gauges without
+    updating anything on the request path.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def register_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """
+        Returns all metrics as Prometheus exposition text.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            for name, help, value in collector():
+                if value is None:
+                    continue
+                lines.extend([f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {_format_value(value)}"])
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'face_pipeline_stage_seconds', "Time spent in each stage of the request pipeline.", ['stage'])
+STAGE_IN_FLIGHT = REGISTRY.gauge(
+    'face_pipeline_stage_in_flight', "Calls currently inside each pipeline stage.", ['stage'])
+MODEL_LOAD_SECONDS = REGISTRY.gauge(
+    'face_model_load_seconds', "Time it took to load each model.", ['model'])
+INDEX_REQUESTS = REGISTRY.counter(
+    'face_index_requests_total', "Index calls by operation and outcome.", ['operation', 'outcome'])
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'face_http_request_seconds', "HTTP request latency until the response starts.", ['route', 'method', 'status'])
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    'face_http_requests_in_flight', "HTTP requests being processed.", ['route'])
+IMPORT_SECONDS = REGISTRY.gauge(
+    'face_import_seconds', "Time it took to import each heavy module.", ['module'])
+STARTUP_SECONDS = REGISTRY.gauge(
+    'face_startup_seconds', "Time spent in each start-up phase.", ['phase'])
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Times a pipeline stage into ``face_pipeline_stage_seconds`` and tracks it as in flight.
+
+    Args:
+        stage (str): The stage name, e.g. ``decode``, ``detect``, ``embed`` or ``index_query``.
+    """
+    STAGE_IN_FLIGHT.inc(stage=stage)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+        STAGE_IN_FLIGHT.dec(stage=stage)
+
+
+def timed_index_call(operation, fn, *args, **kwargs):
+    """
+    Calls an index method, timing it as stage ``index_<operation>`` and counting its outcome.
+    """
+    with stage_timer(f'index_{operation}'):
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            INDEX_REQUESTS.inc(operation=operation, outcome='error')
+            raise
+    INDEX_REQUESTS.inc(operation=operation, outcome='ok')
+    return result
+
+
+async def timed_index_call_async(operation, fn, *args, **kwargs):
+    """
+    Awaits an async index method, timed and counted as by ``timed_index_call``.
+    """
+    with stage_timer(f'index_{operation}'):
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception:
+            INDEX_REQUESTS.inc(operation=operation, outcome='error')
+            raise
+    INDEX_REQUESTS.inc(operation=operation, outcome='ok')
+    return result
+
+
+def stats_collector(prefix, help, get_stats):
+    """
+    Builds a collector exposing the numeric values of a stats dict as ``<prefix>_<key>`` gauges.
+
+    Args:
+        prefix (str): Metric name prefix, e.g. ``face_embedding_cache``.
+        help (str): Help text shared by the gauges.
+        get_stats (callable): Returns the stats dict, or None when the component is disabled.
+    """
+    def collect(stats=None, prefix=prefix):
+        stats = (get_stats() or {}) if stats is None else stats
+        for key, value in stats.items():
+            if isinstance(value, dict):
+                # e.g. admission rejections by reason
+                yield from collect(value, f"{prefix}_{key}")
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield f"{prefix}_{key}", help, value
+    return collect
@@ -0,0 +1,140 @@
+# model_registry.py
+import sys
+import threading
+import time
+from src.exception import CustomException
+from src.logger import logging
+from src.components.metrics import MODEL_LOAD_SECONDS
+from src.components.embedding_backend import create_backend
+
+
+# MTCNN's own default
+DEFAULT_MIN_FACE_SIZE = 20
+
+
+class ModelRegistry:
+    """
+    Process-wide holder for the MTCNN detector and the embedding backend.
+
+    The embedding backend (see ``embedding_backend``) is the DeepFace Keras model by
+    default, or its ONNX export after ``configure_backend('onnx', ...)``. Models are
+    built lazily on first use (or eagerly through ``warm_up``) and then shared by
+    every caller in the process, including the ``asyncio.to_thread`` worker threads
+    used by the FastAPI endpoints. Construction is guarded by a lock
+    so that concurrent first requests build each model exactly once.
+    """
+
+    def __init__(self, model_name='Facenet'):
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._detectors = {}
+        self._embedding_model = None
+        self.backend_settings = {'backend': 'tensorflow'}
+        self._backend = None
+
+    def get_detector(self, min_face_size=None):
+        """
+        Returns the shared MTCNN detector, building it on first use.
+
+        Args:
+            min_face_size (int, optional): Smallest face the detector looks for, in pixels.
+                Each value gets its own detector; None uses MTCNN's default of 20.
+
+        Returns:
+            mtcnn.MTCNN: The shared face detector.
+        """
+        min_face_size = min_face_size or DEFAULT_MIN_FACE_SIZE
+        detector = self._detectors.get(min_face_size)
+        if detector is None:
+            with self._lock:
+                detector = self._detectors.get(min_face_size)
+                if detector is None:
+                    try:
+                        start = time.perf_counter()
+                        from mtcnn import MTCNN
+                        detector = MTCNN(min_face_size=min_face_size)
+                        MODEL_LOAD_SECONDS.set(time.perf_counter() - start, model=f'mtcnn_{min_face_size}')
+                        self._detectors[min_face_size] = detector
+                        logging.info(f"MTCNN Face Detector (min face size {min_face_size}) loaded into model registry.")
+                    except Exception as e:
+                        raise CustomException(e, sys) from e
+        return detector
+
+    def get_embedding_model(self):
+        """
+        Returns the shared DeepFace embedding model, building it on first use.
+
+        Returns:
+            keras.Model: The embedding model named by ``model_name``.
+        """
+        if self._embedding_model is None:
+            with self._lock:
+                if self._embedding_model is None:
+                    try:
+                        start = time.perf_counter()
+                        from deepface import DeepFace
+                        self._embedding_model = DeepFace.build_model(self.model_name)
+                        MODEL_LOAD_SECONDS.set(time.perf_counter() - start, model=self.model_name)
+                        logging.info(f"{self.model_name} embedding model loaded into model registry.")
+                    except Exception as e:
+                        raise CustomException(e, sys) from e
+        return self._embedding_model
+
+    def configure_backend(self, backend='tensorflow', **options):
+        """
+        Selects the embedding backend. A changed selection is built on next use.
+
+        Args:
+            backend (str): ``tensorflow`` or ``onnx``.
+            **options: The ``onnx_*`` and ``haar_redetect`` arguments of ``embedding_backend.create_backend``.
+        """
+        settings = {'backend': backend, **options}
+        with self._lock:
+            if settings != self.backend_settings:
+                self.backend_settings = settings
+                self._backend = None
+
+    def get_embedding_backend(self):
+        """
+        Returns the shared embedding backend. Its model is loaded on first use.
+
+        Returns:
+            EmbeddingBackend: The backend selected by ``configure_backend``.
+        """
+        backend = self._backend
+        if backend is None:
+            with self._lock:
+                if self._backend is None:
+                    settings = dict(self.backend_settings)
+                    self._backend = create_backend(settings.pop('backend'), self, **settings)
+                backend = self._backend
+        return backend
+
+    @property
+    def embedding_name(self):
+        """
+        Name of the embedding backend's model and weights, which keys the embedding cache.
+        """
+        return self.get_embedding_backend().name
+
+    def warm_up(self, min_face_size=None):
+        """
+        Loads both models so that the first request does not pay for construction.
+        """
+        self.get_detector(min_face_size)
+        self.get_embedding_backend().load()
+        logging.info("Model registry warmed up.")
+
+    def is_loaded(self):
+        return bool(self._detectors) and self.get_embedding_backend().is_loaded()
+
+
+registry = ModelRegistry()
+
+
+def get_registry():
+    """
+    Returns the process-wide model registry shared by the detector, the embedding
+    helpers and the Streamlit app.
+    """
+    return registry
@@ -1,10 +1,43 @@
 import asyncio
-import pinecone
+from concurrent.futures import ThreadPoolExecutor
 from src.exception import CustomException
 from src.logger import logging
+from src.components.metrics import timed_index_call, timed_index_call_async
+from src.components.vector_index import QueryResponse, projection_options
 import sys
 
 
+# Limits for the batched insert path
+FETCH_BATCH_SIZE = 1000              # ids per fetch request
+UPSERT_BATCH_SIZE = 100              # vectors per upsert request
+UPSERT_MAX_BYTES = 2 * 1024 * 1024   # estimated payload per upsert request
+MAX_IN_FLIGHT = 4                    # concurrent fetch/upsert requests
+
+# Squared L2 scores under which a match is reported as the same image, or a similar one
+EXACT_MATCH_SCORE = 15
+SIMILAR_MATCH_SCORE = 100
+
+
+def match_message(score):
+    """
+    Returns the verdict the validate endpoints give for a match score (squared L2 distance).
+    """
+    if score < EXACT_MATCH_SCORE:
+        return "Exact image found"
+    if score < SIMILAR_MATCH_SCORE:
+        return "Similar image found"
+    return "No similar image found"
+
+
+async def _index_call(index, operation, *args, **kwargs):
+    # A VectorIndex is awaited through its a<operation> method on the running loop; a
+    # pinecone.Index only has the blocking method, which runs in a worker thread
+    method = getattr(index, f'a{operation}', None)
+    if method is not None:
+        return await timed_index_call_async(operation, method, *args, **kwargs)
+    return await asyncio.to_thread(timed_index_call, operation, getattr(index, operation), *args, **kwargs)
+
+
 
 
 async def insert_to_index(index, user_id, embedding):
@@ -22,16 +55,9 @@ async def insert_to_index(index, user_id, embedding):
     Returns:
         None
     """
-    try:
-        await asyncio.to_thread(_insert_to_index_sync, index, user_id, embedding)
-    except Exception as e:
-        raise CustomException(str(e), sys)
-
-def _insert_to_index_sync(index, user_id, embedding):
-    # Original synchronous code of insert_to_index goes here
     try:
         # Check if the vector with the given ID already exists
-        existing_vector = index.fetch(ids=[user_id])
+        existing_vector = await _index_call(index, 'fetch', ids=[user_id])
         if existing_vector['vectors'].get(user_id) is not None:
             logging.info(f"Vector with ID {user_id} already exists in the index. Skipping insertion.")
             return
@@ -42,11 +68,11 @@ def _insert_to_index_sync(index, user_id, embedding):
 
         # Structure the data correctly for Pinecone's upsert method
         vector_data = {'id': user_id, 'values': embedding}
-        logging.info(f"Inserting {user_id} with embedding: {embedding[:10]}...")
-        index.upsert(vectors=[vector_data])
-        logging.info(f"Inserted embedding for {user_id} into Pinecone index.")
+        await _index_call(index, 'upsert', vectors=[vector_data])
+        logging.info("Inserted embedding for %s into Pinecone index.", user_id)
     except Exception as e:
         logging.error(f"Error inserting data into Pinecone index for {user_id}: {str(e)}")
+        raise CustomException(str(e), sys)
         
         
         
@@ -54,7 +80,7 @@ def _insert_to_index_sync(index, user_id, embedding):
         
         
         
-async def query_index(index, embedding, top_k):
+async def query_index(index, embedding, top_k, projection='ids'):
     """
     Asynchronously queries the Pinecone index with the given embedding vector and returns the query response.
 
@@ -62,26 +88,102 @@ async def query_index(index, embedding, top_k):
         index (PineconeIndex): The Pinecone index to query.
         embedding (numpy.ndarray): The embedding vector to query with.
         top_k (int): The number of nearest neighbors to retrieve.
+        projection (str): What each match carries besides its id and score: ``ids`` (nothing),
+            ``metadata``, ``values`` or ``all``. Vector values are only sent when asked for.
 
     Returns:
-        dict: The query response containing the nearest neighbors and their distances.
+        QueryResponse: The nearest neighbors, best first, as typed matches.
 
     Raises:
         CustomException: If there is an error querying the Pinecone index.
     """
     try:
-        return await asyncio.to_thread(_query_index_sync, index, embedding, top_k)
+        query_response = QueryResponse.decode(await _index_call(index, 'query', top_k=top_k, vector=embedding,
+                                                                **projection_options(projection)))
+        logging.debug("Query returned %d matches.", len(query_response.matches))
+        return query_response
     except Exception as e:
+        logging.error(f"Error querying Pinecone index: {str(e)}")
         raise CustomException(str(e), sys)
 
-def _query_index_sync(index, embedding, top_k):
-    # Original synchronous code of query_index goes here
+def query_index_sync(index, embedding, top_k, projection='ids'):
+    """
+    Blocking version of query_index, for code without an event loop (e.g. the Streamlit
+    app). Takes the same arguments and returns the same QueryResponse.
+    """
     try:
-        query_response = index.query(top_k=top_k, include_values=True, vector=embedding)
-        logging.info(f"Query executed in Pinecone index. Response: {query_response}")
+        query_response = QueryResponse.decode(timed_index_call('query', index.query, top_k=top_k, vector=embedding,
+                                                               **projection_options(projection)))
+        logging.debug("Query returned %d matches.", len(query_response.matches))
         return query_response
     except Exception as e:
         logging.error(f"Error querying Pinecone index: {str(e)}")
+        raise
+
+
+
+async def query_index_batch(index, embeddings, top_k, projection='ids', max_in_flight=MAX_IN_FLIGHT):
+    """
+    Asynchronously queries the index with several embedding vectors at once.
+
+    Backends with ``query_many`` answer all the vectors in one call (one matrix
+    product for the local indexes, concurrent or multi-vector requests for the HTTP
+    client); for Pinecone up to ``max_in_flight`` queries run at once. Either way the
+    faces of one image cost about one round trip instead of one per face.
+
+    Args:
+        index (PineconeIndex): The Pinecone index to query.
+        embeddings (list): The embedding vectors to query with.
+        top_k (int): The number of nearest neighbors to retrieve per vector.
+        projection (str): What each match carries besides its id and score, as for ``query_index``.
+        max_in_flight (int): Concurrent query requests.
+
+    Returns:
+        list: One QueryResponse per embedding, in the same order.
+
+    Raises:
+        CustomException: If any of the queries fails.
+    """
+    try:
+        if not embeddings:
+            return []
+        options = projection_options(projection)
+        if hasattr(index, 'query_many'):
+            responses = await _index_call(index, 'query_many', embeddings, top_k=top_k, **options)
+        else:
+            semaphore = asyncio.Semaphore(max_in_flight)
+
+            async def query_one(embedding):
+                async with semaphore:
+                    return await _index_call(index, 'query', top_k=top_k, vector=embedding, **options)
+            responses = await asyncio.gather(*(query_one(embedding) for embedding in embeddings))
+        logging.debug("Executed %d queries in Pinecone index.", len(responses))
+        return [QueryResponse.decode(response) for response in responses]
+    except Exception as e:
+        raise CustomException(str(e), sys)
+
+def query_index_batch_sync(index, embeddings, top_k, projection='ids', max_in_flight=MAX_IN_FLIGHT):
+    """
+    Blocking version of query_index_batch, for code without an event loop (e.g.
+    video_ingest). Takes the same arguments and returns one QueryResponse per embedding.
+    """
+    if not embeddings:
+        return []
+    options = projection_options(projection)
+
+    query_many = getattr(index, 'query_many', None)
+    if query_many is not None:
+        responses = timed_index_call('query_many', query_many, embeddings, top_k=top_k, **options)
+        logging.debug("Executed %d queries in Pinecone index.", len(responses))
+        return [QueryResponse.decode(response) for response in responses]
+
+    def query_one(embedding):
+        return timed_index_call('query', index.query, top_k=top_k, vector=embedding, **options)
+
+    with ThreadPoolExecutor(max_workers=min(max_in_flight, len(embeddings))) as pool:
+        responses = list(pool.map(query_one, embeddings))
+    logging.debug("Executed %d queries in Pinecone index.", len(responses))
+    return [QueryResponse.decode(response) for response in responses]
         
         
         
@@ -102,22 +204,16 @@ async def remove_from_index(index, ids):
     Returns:
         None
     """
-    try:
-        await asyncio.to_thread(_remove_from_index_sync, index, ids)
-    except Exception as e:
-        raise CustomException(str(e), sys)
-
-def _remove_from_index_sync(index, ids):
-    # Original synchronous code of remove_from_index goes here
     try:
         # Check if ids is a list or a single ID and format it for deletion
         ids_to_delete = ids if isinstance(ids, list) else [ids]
 
         # Perform the deletion
-        delete_response = index.delete(ids=ids_to_delete)
-        logging.info(f"Deleted vectors with IDs: {ids_to_delete}, response: {delete_response}")
+        await _index_call(index, 'delete', ids=ids_to_delete)
+        logging.info("Deleted %d vectors from Pinecone index: %s", len(ids_to_delete), ids_to_delete)
     except Exception as e:
         logging.error(f"Error removing data from Pinecone index: {str(e)}")
+        raise CustomException(str(e), sys)
         
         
         
@@ -127,33 +223,26 @@ def _remove_from_index_sync(index, ids):
 async def update_index(index, vector_id, new_embedding):
     try:
         # Update the vector with the new embedding
-        update_response = await asyncio.to_thread(
-            _update_index_sync, index, vector_id, new_embedding
-        )
+        update_response = await _index_call(index, 'update', id=vector_id, values=new_embedding)
         return update_response, None
     except Exception as e:
         return None, str(e)
-
-# Synchronous function for updating a vector
-def _update_index_sync(index, vector_id, new_values):
-    try:
-        update_response = index.update(
-            id=vector_id,
-            values=new_values
-        )
-        return update_response
-    except Exception as e:
-        raise e
     
     
     
     
     
-async def insert_to_index_full(index, user_ids, embeddings):
+async def insert_to_index_full(index, user_ids, embeddings, fetch_batch_size=FETCH_BATCH_SIZE,
+                               upsert_batch_size=UPSERT_BATCH_SIZE, upsert_max_bytes=UPSERT_MAX_BYTES,
+                               max_in_flight=MAX_IN_FLIGHT):
     """
     Asynchronously inserts vectors with given user IDs and embeddings into the Pinecone index.
     This function supports both single and multiple vector insertions.
 
+    Existing ids are looked up with multi-id fetches of ``fetch_batch_size`` ids, and the
+    new vectors are upserted in chunks of at most ``upsert_batch_size`` vectors and
+    ``upsert_max_bytes`` of estimated payload. Up to ``max_in_flight`` requests run at once.
+
     Args:
         index (PineconeIndex): The Pinecone index to insert vectors into.
         user_ids (list of str): The IDs of the vectors.
@@ -163,36 +252,152 @@ async def insert_to_index_full(index, user_ids, embeddings):
         CustomException: If there is an error inserting data into the Pinecone index.
 
     Returns:
-        None
+        dict: Per-id outcome report with the lists ``inserted``, ``skipped_existing``,
+        ``invalid`` and ``failed`` (ids whose fetch or upsert request failed).
     """
     try:
-        await asyncio.to_thread(_insert_to_index_full_sync, index, user_ids, embeddings)
+        report, candidates = _insert_candidates(user_ids, embeddings)
+        if not candidates:
+            return report
+        semaphore = asyncio.Semaphore(max_in_flight)
+
+        async def fetch_chunk(ids):
+            async with semaphore:
+                try:
+                    return ids, set((await _index_call(index, 'fetch', ids=ids))['vectors']), None
+                except Exception as e:
+                    return ids, _fetched_before_error(e), e
+
+        async def upsert_chunk(vectors):
+            async with semaphore:
+                try:
+                    await _index_call(index, 'upsert', vectors=vectors)
+                    return vectors, None
+                except Exception as e:
+                    return vectors, e
+
+        # Check which ids already exist with one fetch per chunk of ids
+        fetched = await asyncio.gather(*(fetch_chunk(ids) for ids in _chunks(list(candidates), fetch_batch_size)))
+        chunks = _new_vector_chunks(fetched, candidates, report, upsert_batch_size, upsert_max_bytes)
+        _record_upserts(await asyncio.gather(*(upsert_chunk(vectors) for vectors in chunks)), report)
+        return report
     except Exception as e:
         raise CustomException(str(e), sys)
 
-def _insert_to_index_full_sync(index, user_ids, embeddings):
-    try:
-        vector_data = []
-        for user_id, embedding in zip(user_ids, embeddings):
-            # Check if the vector with the given ID already exists
-            existing_vector = index.fetch(ids=[user_id])
-            if existing_vector['vectors'].get(user_id) is not None:
-                logging.info(f"Vector with ID {user_id} already exists in the index. Skipping insertion.")
-                continue
-
-            if not embedding or not isinstance(embedding, list):
-                logging.warning(f"Invalid embedding for {user_id}. Skipping insertion.")
-                continue
-
-            # Structure the data correctly for Pinecone's upsert method
-            vector_data.append({'id': user_id, 'values': embedding})
-
-        if not vector_data:
-            logging.warning("No valid data to insert. Skipping.")
-            return
 
-        logging.info(f"Inserting embeddings for user IDs: {user_ids}...")
-        index.upsert(vectors=vector_data)
-        logging.info("Inserted embeddings into Pinecone index.")
-    except Exception as e:
-        logging.error(f"Error inserting data into Pinecone index: {str(e)}")
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _upsert_chunks(vector_data, max_vectors, max_bytes):
+    # Split by vector count and by an estimate of the JSON payload (about 24 bytes per float)
+    chunk, chunk_bytes = [], 0
+    for vector in vector_data:
+        vector_bytes = len(vector['id']) + 24 * len(vector['values']) + 64
+        if chunk and (len(chunk) >= max_vectors or chunk_bytes + vector_bytes > max_bytes):
+            yield chunk
+            chunk, chunk_bytes = [], 0
+        chunk.append(vector)
+        chunk_bytes += vector_bytes
+    if chunk:
+        yield chunk
+
+
+def insert_to_index_full_sync(index, user_ids, embeddings, fetch_batch_size=FETCH_BATCH_SIZE,
+                              upsert_batch_size=UPSERT_BATCH_SIZE, upsert_max_bytes=UPSERT_MAX_BYTES,
+                              max_in_flight=MAX_IN_FLIGHT):
+    """
+    Blocking version of insert_to_index_full, for scripts and worker processes without
+    an event loop (e.g. bulk_ingest). Takes the same arguments and returns the same report.
+    """
+    report, candidates = _insert_candidates(user_ids, embeddings)
+    if not candidates:
+        return report
+
+    def fetch_chunk(ids):
+        try:
+            return ids, set(timed_index_call('fetch', index.fetch, ids=ids)['vectors']), None
+        except Exception as e:
+            return ids, _fetched_before_error(e), e
+
+    def upsert_chunk(vectors):
+        try:
+            timed_index_call('upsert', index.upsert, vectors=vectors)
+            return vectors, None
+        except Exception as e:
+            return vectors, e
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        # Check which ids already exist with one fetch per chunk of ids
+        fetched = pool.map(fetch_chunk, list(_chunks(list(candidates), fetch_batch_size)))
+        chunks = _new_vector_chunks(fetched, candidates, report, upsert_batch_size, upsert_max_bytes)
+        _record_upserts(pool.map(upsert_chunk, chunks), report)
+    return report
+
+
+def _insert_candidates(user_ids, embeddings):
+    # Returns the empty report and the valid embeddings by id, first occurrence of an id kept
+    report = {'inserted': [], 'skipped_existing': [], 'invalid': [], 'failed': []}
+    candidates = {}
+    for user_id, embedding in zip(user_ids, embeddings):
+        if not embedding or not isinstance(embedding, list):
+            logging.warning(f"Invalid embedding for {user_id}. Skipping insertion.")
+            report['invalid'].append(user_id)
+        elif user_id in candidates:
+            logging.info(f"Vector with ID {user_id} appears twice in the batch. Keeping the first one.")
+            report['skipped_existing'].append(user_id)
+        else:
+            candidates[user_id] = embedding
+    if not candidates:
+        logging.warning("No valid data to insert. Skipping.")
+    return report, candidates
+
+
+def _failed_ids(error, ids):
+    # A sharded index names the ids owned by the shards that failed; otherwise the whole request failed
+    failed = set(getattr(error, 'failed_ids', None) or ids)
+    return [user_id for user_id in ids if user_id in failed]
+
+
+def _fetched_before_error(error):
+    response = getattr(error, 'response', None)
+    return set(response['vectors']) if response else set()
+
+
+def _new_vector_chunks(fetched, candidates, report, upsert_batch_size, upsert_max_bytes):
+    # Records the existing and unfetchable ids, and splits the rest into upsert requests
+    vector_data = []
+    for ids, existing, error in fetched:
+        if error is not None:
+            failed = _failed_ids(error, ids)
+            logging.error(f"Error fetching {len(failed)} of {len(ids)} ids from Pinecone index: {str(error)}")
+            report['failed'].extend(failed)
+            failed = set(failed)
+            ids = [user_id for user_id in ids if user_id not in failed]
+        for user_id in ids:
+            if user_id in existing:
+                report['skipped_existing'].append(user_id)
+            else:
+                # Structure the data correctly for Pinecone's upsert method
+                vector_data.append({'id': user_id, 'values': candidates[user_id]})
+    chunks = list(_upsert_chunks(vector_data, upsert_batch_size, upsert_max_bytes))
+    logging.info(f"Inserting {len(vector_data)} embeddings in {len(chunks)} upsert requests...")
+    return chunks
+
+
+def _record_upserts(upserted, report):
+    for vectors, error in upserted:
+        ids = [vector['id'] for vector in vectors]
+        if error is not None:
+            # Vectors of the shards that did not fail were written all the same
+            failed = _failed_ids(error, ids)
+            logging.error(f"Error inserting {len(failed)} of {len(ids)} vectors into Pinecone index: {str(error)}")
+            report['failed'].extend(failed)
+            failed = set(failed)
+            report['inserted'].extend(user_id for user_id in ids if user_id not in failed)
+        else:
+            report['inserted'].extend(ids)
+    logging.info(f"Inserted {len(report['inserted'])} embeddings into Pinecone index "
+                 f"({len(report['skipped_existing'])} existing, {len(report['invalid'])} invalid, "
+                 f"{len(report['failed'])} failed).")
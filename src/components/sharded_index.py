@@ -0,0 +1,303 @@
+"""
+Sharded index: ids hashed to N shards, queries scattered to all of them and merged.
+
+Each shard is any VectorIndex, normally an IndexClient talking to an index server
+process on this machine or another node. ``ShardCluster`` starts such processes
+locally and ``python -m src.components.sharded_index`` runs one from the command
+line, printing the hosts to put in ``INDEX_SHARD_HOSTS``.
+
+Usage:
+    python -m src.components.sharded_index --shards 4 --base-port 8100 --data-dir /data/shards
+"""
+import argparse
+import hashlib
+import heapq
+import os
+import signal
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from src.logger import logging
+from src.components.vector_index import VectorIndex, _parse_vector
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def shard_for(vector_id, shards):
+    """
+    Returns the shard of an id. Uses BLAKE2b rather than ``hash()``, which is salted per process.
+    """
+    digest = hashlib.blake2b(str(vector_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % shards
+
+
+class ShardUnavailable(Exception):
+    """
+    Raised when no shard answered a query in time, or a write could not reach its shard.
+    """
+
+
+class ShardRequestError(ShardUnavailable):
+    """
+    Raised when a fetch, upsert or delete failed on some of the shards owning its ids.
+
+    The shards that succeeded are not rolled back, so after a failed write the ids of
+    ``applied`` shards hold the new state and those in ``failed_ids`` may not.
+
+    Attributes:
+        failures (dict): The error message of each failed shard, by shard number.
+        failed_ids (list): The ids owned by the failed shards.
+        applied (list): The shards whose part of the request succeeded.
+        response (dict): The response of the shards that succeeded, e.g. the vectors a fetch found.
+    """
+
+    def __init__(self, message, failures, failed_ids, applied, response):
+        super().__init__(message)
+        self.failures = failures
+        self.failed_ids = failed_ids
+        self.applied = applied
+        self.response = response
+
+
+class ShardedIndex(VectorIndex):
+    """
+    ``VectorIndex`` over several shards, each holding the ids that hash to it.
+
+    Writes go only to the shards that own the ids, concurrently. A query goes to
+    every shard at once and the per-shard top-k lists are merged into the global
+    top-k. A shard that fails or does not answer within ``shard_timeout_s`` is left
+    out: the response then carries ``partial: True`` and the missing shards, or,
+    with ``allow_partial=False``, the query fails.
+
+    Writes are not atomic across shards: each shard applies its part on its own and
+    nothing is rolled back. When a shard fails, the write raises ShardRequestError
+    listing the failed shards and the ids they own, while the other shards keep
+    their part. Every write is keyed by id, so retrying the failed ids is safe.
+    """
+
+    def __init__(self, shards, metric='euclidean', shard_timeout_s=1.0, allow_partial=True):
+        """
+        Args:
+            shards (list): The shard indexes, in a fixed order (the order defines the id routing).
+            metric (str): The shards' metric; ``euclidean`` scores are distances (lower is
+                closer), the others similarities.
+            shard_timeout_s (float): How long a query waits for each shard.
+            allow_partial (bool): Answer from the shards that responded when others did not.
+        """
+        if not shards:
+            raise ValueError("A sharded index needs at least one shard.")
+        self.shards = list(shards)
+        self.metric = metric
+        self.shard_timeout_s = shard_timeout_s
+        self.allow_partial = allow_partial
+        self._pool = ThreadPoolExecutor(max_workers=4 * len(self.shards), thread_name_prefix='shard')
+        self._lock = threading.Lock()
+        self.partial_queries = 0
+        self.shard_failures = [0] * len(self.shards)
+
+    def _group(self, items, key=lambda item: item):
+        groups = {}
+        for item in items:
+            groups.setdefault(shard_for(key(item), len(self.shards)), []).append(item)
+        return groups
+
+    def _run_on_owners(self, operation, calls, ids_by_shard, combine):
+        # calls: {shard: (fn, args, kwargs)} for the shards owning the ids; waits for all of them and
+        # returns combine(results), or raises with it when some shards failed
+        futures = {shard: self._pool.submit(fn, *args, **kwargs) for shard, (fn, args, kwargs) in calls.items()}
+        results, failures = {}, {}
+        for shard, future in futures.items():
+            try:
+                results[shard] = future.result()
+            except Exception as e:
+                failures[shard] = str(e)
+        if failures:
+            with self._lock:
+                for shard in failures:
+                    self.shard_failures[shard] += 1
+            failed_ids = [vector_id for shard in sorted(failures) for vector_id in ids_by_shard.get(shard, [])]
+            logging.warning(f"{operation} failed on shards {sorted(failures)} ({len(failed_ids)} ids) "
+                            f"and succeeded on {sorted(results)}: {failures}")
+            raise ShardRequestError(f"{operation} failed on shards {sorted(failures)}: {failures}",
+                                    failures, failed_ids, sorted(results), combine(results.values()))
+        return combine(results.values())
+
+    def _scatter(self, method, *args, **kwargs):
+        # Runs a read on every shard and returns {shard: result} for those that answered in time
+        futures = {self._pool.submit(getattr(shard, method), *args, **kwargs): number
+                   for number, shard in enumerate(self.shards)}
+        done, _ = wait(futures, timeout=self.shard_timeout_s)
+        results, missing = {}, []
+        for future, number in futures.items():
+            if future in done and future.exception() is None:
+                results[number] = future.result()
+            else:
+                missing.append(number)
+                error = future.exception() if future in done else f"no answer in {self.shard_timeout_s}s"
+                logging.warning(f"Shard {number} left out of {method}: {error}")
+        if missing:
+            with self._lock:
+                for number in missing:
+                    self.shard_failures[number] += 1
+                self.partial_queries += 1
+            if not results or not self.allow_partial:
+                raise ShardUnavailable(f"Shards {missing} did not answer {method}.")
+        return results, sorted(missing)
+
+    def _merge(self, responses, top_k, missing):
+        matches = [match for response in responses for match in response['matches']]
+        if self.metric == 'euclidean':
+            merged = heapq.nsmallest(top_k, matches, key=lambda match: match['score'])
+        else:
+            merged = heapq.nlargest(top_k, matches, key=lambda match: match['score'])
+        response = {'matches': merged, 'namespace': ''}
+        if missing:
+            response.update(partial=True, missing_shards=missing)
+        return response
+
+    def query(self, vector, top_k=10, include_values=False, include_metadata=False):
+        results, missing = self._scatter('query', vector, top_k=top_k, include_values=include_values,
+                                         include_metadata=include_metadata)
+        return self._merge(results.values(), top_k, missing)
+
+    def query_many(self, vectors, top_k=10, include_values=False, include_metadata=False):
+        results, missing = self._scatter('query_many', vectors, top_k=top_k, include_values=include_values,
+                                         include_metadata=include_metadata)
+        return [self._merge([responses[i] for responses in results.values()], top_k, missing)
+                for i in range(len(vectors))]
+
+    def fetch(self, ids):
+        groups = self._group(ids)
+        calls = {shard: (self.shards[shard].fetch, (group,), {}) for shard, group in groups.items()}
+
+        def combine(responses):
+            vectors = {}
+            for response in responses:
+                vectors.update(response['vectors'])
+            return {'vectors': vectors, 'namespace': ''}
+        return self._run_on_owners('fetch', calls, groups, combine)
+
+    def upsert(self, vectors):
+        """
+        Upserts each shard's vectors on that shard, concurrently.
+
+        Raises:
+            ShardRequestError: If some shards failed; the others keep their vectors.
+        """
+        groups = self._group(vectors, key=lambda vector: _parse_vector(vector)[0])
+        calls = {shard: (self.shards[shard].upsert, (group,), {}) for shard, group in groups.items()}
+        ids_by_shard = {shard: [_parse_vector(vector)[0] for vector in group] for shard, group in groups.items()}
+        return self._run_on_owners('upsert', calls, ids_by_shard, lambda results: {
+            'upserted_count': sum(result['upserted_count'] for result in results)})
+
+    def update(self, id, values=None, set_metadata=None):
+        return self.shards[shard_for(id, len(self.shards))].update(id, values=values, set_metadata=set_metadata)
+
+    def delete(self, ids=None, delete_all=False):
+        if delete_all:
+            groups = {}
+            calls = {shard: (index.delete, (), {'delete_all': True}) for shard, index in enumerate(self.shards)}
+        else:
+            groups = self._group(ids or [])
+            calls = {shard: (self.shards[shard].delete, (), {'ids': group}) for shard, group in groups.items()}
+        return self._run_on_owners('delete', calls, groups, lambda results: {})
+
+    def describe_index_stats(self):
+        stats = [shard.describe_index_stats() for shard in self.shards]
+        return {'dimension': stats[0]['dimension'],
+                'total_vector_count': sum(shard['total_vector_count'] for shard in stats),
+                'shards': [shard['total_vector_count'] for shard in stats]}
+
+    def stats(self):
+        with self._lock:
+            return {'shards': len(self.shards), 'partial_queries': self.partial_queries,
+                    'shard_failures': sum(self.shard_failures)}
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        for shard in self.shards:
+            if hasattr(shard, 'close'):
+                shard.close()
+
+
+class ShardCluster:
+    """
+    Starts one index server process per shard on this machine.
+
+    Example:
+        with ShardCluster(4) as cluster:
+            index = ShardedIndex([IndexClient(host) for host in cluster.hosts])
+    """
+
+    def __init__(self, shards, dimension=128, metric='euclidean', host='127.0.0.1', base_port=0, data_dir=None):
+        """
+        Args:
+            shards (int): Number of shard processes.
+            base_port (int): Port of the first shard, the others follow; 0 picks free ports.
+            data_dir (str, optional): Makes each shard durable under ``<data_dir>/shard-<n>``.
+        """
+        self.processes = []
+        self.hosts = []
+        # The shard processes import this package whatever their working directory
+        env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')]))}
+        try:
+            for number in range(shards):
+                command = [sys.executable, '-m', 'src.components.index_server', '--host', host,
+                           '--port', str(base_port + number if base_port else 0),
+                           '--dimension', str(dimension), '--metric', metric]
+                if data_dir:
+                    command += ['--data-dir', os.path.join(data_dir, f"shard-{number}")]
+                process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, env=env)
+                self.processes.append(process)
+                # The server prints its address once it is listening
+                line = process.stdout.readline()
+                if not line.startswith("Index server listening on "):
+                    raise RuntimeError(f"Shard {number} did not start: {line!r}")
+                self.hosts.append(line.rsplit(' ', 1)[1].strip())
+        except Exception:
+            self.stop()
+            raise
+        logging.info(f"Started {shards} index shards: {self.hosts}")
+
+    def stop(self):
+        for process in self.processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        for process in self.processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            process.stdout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--base-port', type=int, default=8100)
+    parser.add_argument('--dimension', type=int, default=128)
+    parser.add_argument('--metric', default='euclidean')
+    parser.add_argument('--data-dir', help="Make each shard durable under this directory")
+    args = parser.parse_args(argv)
+
+    cluster = ShardCluster(args.shards, args.dimension, args.metric, args.host, args.base_port, args.data_dir)
+    print(f"INDEX_SHARD_HOSTS: {cluster.hosts}", flush=True)
+    try:
+        for process in cluster.processes:
+            process.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cluster.stop()
+
+
+if __name__ == "__main__":
+    main()
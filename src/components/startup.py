@@ -0,0 +1,67 @@
+# startup.py
+import importlib
+import sys
+import threading
+import time
+from src.logger import logging
+from src.components.metrics import IMPORT_SECONDS
+
+
+def timed_import(module_name):
+    """
+    Imports a module and records how long the import took.
+
+    Modules that are already imported cost nothing and are reported as 0 seconds, so
+    calling this after something else pulled the module in does not double count.
+
+    Args:
+        module_name (str): The dotted module name, e.g. ``tensorflow``.
+
+    Returns:
+        float: The seconds the import took.
+    """
+    if module_name in sys.modules:
+        return 0.0
+    start = time.perf_counter()
+    importlib.import_module(module_name)
+    elapsed = time.perf_counter() - start
+    IMPORT_SECONDS.set(elapsed, module=module_name)
+    logging.info(f"Imported {module_name} in {elapsed:.2f}s.")
+    return elapsed
+
+
+class Readiness:
+    """
+    Tracks the start-up checks a worker must pass before it should receive traffic.
+
+    Each check (e.g. ``index``, ``models``) starts as pending and is marked ready or
+    failed once; the worker is ready when every check is ready. The details, including
+    timings and failure messages, are what ``/readyz`` returns.
+    """
+
+    def __init__(self, *checks):
+        self._lock = threading.Lock()
+        self._checks = {name: {'status': 'pending'} for name in checks}
+        self.started = time.monotonic()
+
+    def mark_ready(self, name, **details):
+        with self._lock:
+            self._checks[name] = {'status': 'ready', **details}
+
+    def mark_failed(self, name, error):
+        with self._lock:
+            self._checks[name] = {'status': 'failed', 'error': error}
+
+    @property
+    def ready(self):
+        with self._lock:
+            return all(check['status'] == 'ready' for check in self._checks.values())
+
+    def status(self):
+        with self._lock:
+            checks = {name: dict(check) for name, check in self._checks.items()}
+        return {
+            'status': 'ready' if all(check['status'] == 'ready' for check in checks.values()) else 'not_ready',
+            'uptime_s': round(time.monotonic() - self.started, 3),
+            'checks': checks,
+        }
@@ -0,0 +1,525 @@
+# vector_index.py
+import asyncio
+import sys
+import threading
+import numpy as np
+from src.exception import CustomException
+from src.logger import logging
+
+
+METRICS = ('euclidean', 'cosine', 'dotproduct')
+
+# What a query returns besides each match's id and score, as query() keyword arguments
+PROJECTIONS = {
+    'ids': {'include_values': False, 'include_metadata': False},
+    'metadata': {'include_values': False, 'include_metadata': True},
+    'values': {'include_values': True, 'include_metadata': False},
+    'all': {'include_values': True, 'include_metadata': True},
+}
+
+# Queries scored at once by NumpyIndex.query_many, bounded so the score matrix stays small
+QUERY_BLOCK_ELEMENTS = 1 << 24
+
+
+def projection_options(projection):
+    """
+    Returns the ``include_values``/``include_metadata`` arguments for a projection name.
+
+    Raises:
+        ValueError: If the projection is not one of PROJECTIONS.
+    """
+    try:
+        return PROJECTIONS[projection]
+    except KeyError:
+        raise ValueError(f"Unknown projection {projection!r}. Expected one of {tuple(PROJECTIONS)}.") from None
+
+
+class Match:
+    """
+    One query match. ``values`` and ``metadata`` are None unless the projection asked for them.
+
+    Items can also be read as ``match['id']``, so code written against the Pinecone
+    dict responses keeps working.
+    """
+    __slots__ = ('id', 'score', 'values', 'metadata')
+
+    def __init__(self, id, score, values=None, metadata=None):
+        self.id = id
+        self.score = score
+        self.values = values
+        self.metadata = metadata
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        return default if value is None else value
+
+    def to_dict(self):
+        match = {'id': self.id, 'score': self.score}
+        if self.values is not None:
+            match['values'] = self.values
+        if self.metadata is not None:
+            match['metadata'] = self.metadata
+        return match
+
+    def __repr__(self):
+        return f"Match(id={self.id!r}, score={self.score!r})"
+
+
+class QueryResponse:
+    """
+    Decoded query response: the matches, best first, and the namespace.
+
+    ``partial`` is True when a sharded index answered without some of its shards,
+    listed in ``missing_shards``; the matches then cover only the shards that answered.
+    """
+    __slots__ = ('matches', 'namespace', 'partial', 'missing_shards')
+
+    def __init__(self, matches, namespace='', partial=False, missing_shards=()):
+        self.matches = matches
+        self.namespace = namespace
+        self.partial = partial
+        self.missing_shards = list(missing_shards)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def to_dict(self):
+        response = {'matches': [match.to_dict() for match in self.matches], 'namespace': self.namespace}
+        if self.partial:
+            response.update(partial=True, missing_shards=self.missing_shards)
+        return response
+
+    def __repr__(self):
+        if self.partial:
+            return f"QueryResponse(matches={self.matches!r}, missing_shards={self.missing_shards!r})"
+        return f"QueryResponse(matches={self.matches!r})"
+
+    @classmethod
+    def decode(cls, response):
+        """
+        Builds a QueryResponse from a backend response: a dict from the local indexes
+        and the HTTP client, or a ``pinecone`` QueryResponse object.
+        """
+        matches = []
+        for match in response['matches']:
+            # Pinecone returns values=[] when they were not requested
+            matches.append(Match(match['id'], float(match['score']), match.get('values') or None,
+                                 match.get('metadata') or None))
+        return cls(matches, response.get('namespace', '') or '', bool(response.get('partial', False)),
+                   response.get('missing_shards') or ())
+
+
+class VectorIndex:
+    """
+    Interface for the index backends used by pinecone_module_fastapi.
+
+    It is the subset of ``pinecone.Index`` that the module calls, with the same
+    argument names and the same response shapes, so a Pinecone index and any local
+    backend can be passed to ``insert_to_index``, ``query_index`` and the other
+    functions interchangeably.
+    """
+
+    def fetch(self, ids):
+        raise NotImplementedError
+
+    def upsert(self, vectors):
+        raise NotImplementedError
+
+    def query(self, vector, top_k=10, include_values=False, include_metadata=False):
+        raise NotImplementedError
+
+    def query_many(self, vectors, top_k=10, include_values=False, include_metadata=False):
+        """
+        Queries several vectors in one call and returns one response per vector, in order.
+        Backends override it when they can do better than one query at a time.
+        """
+        return [self.query(vector, top_k=top_k, include_values=include_values, include_metadata=include_metadata)
+                for vector in vectors]
+
+    def delete(self, ids=None, delete_all=False):
+        raise NotImplementedError
+
+    def update(self, id, values=None, set_metadata=None):
+        raise NotImplementedError
+
+    def describe_index_stats(self):
+        raise NotImplementedError
+
+    # Awaitable counterparts, used by pinecone_module_fastapi on the app's event loop. They run
+    # the blocking method in a worker thread; backends that do I/O natively override them.
+
+    async def afetch(self, ids):
+        return await asyncio.to_thread(self.fetch, ids)
+
+    async def aupsert(self, vectors):
+        return await asyncio.to_thread(self.upsert, vectors)
+
+    async def aquery(self, vector, top_k=10, include_values=False, include_metadata=False):
+        return await asyncio.to_thread(self.query, vector, top_k, include_values, include_metadata)
+
+    async def aquery_many(self, vectors, top_k=10, include_values=False, include_metadata=False):
+        return await asyncio.to_thread(self.query_many, vectors, top_k, include_values, include_metadata)
+
+    async def adelete(self, ids=None, delete_all=False):
+        return await asyncio.to_thread(self.delete, ids, delete_all)
+
+    async def aupdate(self, id, values=None, set_metadata=None):
+        return await asyncio.to_thread(self.update, id, values, set_metadata)
+
+    async def adescribe_index_stats(self):
+        return await asyncio.to_thread(self.describe_index_stats)
+
+
+def _parse_vector(vector):
+    # Pinecone accepts both {'id': ..., 'values': ..., 'metadata': ...} and (id, values[, metadata])
+    if isinstance(vector, dict):
+        return vector['id'], vector['values'], vector.get('metadata')
+    if len(vector) == 3:
+        return vector
+    vector_id, values = vector
+    return vector_id, values, None
+
+
+class NumpyIndex(VectorIndex):
+    """
+    In-process exact-search index.
+
+    Embeddings live in one contiguous float32 matrix with an id-to-row map, so a
+    query is a single matrix-vector product followed by ``argpartition`` for the
+    top-k. Deleting a vector moves the last row into its slot, keeping the matrix
+    dense without shifting the rest of it.
+
+    Scores follow Pinecone's conventions: ``euclidean`` returns the squared L2
+    distance (lower is closer), ``cosine`` the cosine similarity and ``dotproduct``
+    the inner product (higher is closer).
+    """
+
+    def __init__(self, dimension=128, metric='euclidean', initial_capacity=1024):
+        if metric not in METRICS:
+            raise ValueError(f"Unsupported metric {metric!r}. Expected one of {METRICS}.")
+        self.dimension = dimension
+        self.metric = metric
+        self._lock = threading.RLock()
+        self._matrix = np.empty((max(initial_capacity, 1), dimension), dtype=np.float32)
+        self._sq_norms = np.empty(self._matrix.shape[0], dtype=np.float32)
+        self._ids = []
+        self._rows = {}
+        self._metadata = {}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _ensure_capacity(self, size):
+        capacity = self._matrix.shape[0]
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        matrix = np.empty((capacity, self.dimension), dtype=np.float32)
+        matrix[:len(self._ids)] = self._matrix[:len(self._ids)]
+        sq_norms = np.empty(capacity, dtype=np.float32)
+        sq_norms[:len(self._ids)] = self._sq_norms[:len(self._ids)]
+        self._matrix, self._sq_norms = matrix, sq_norms
+
+    def _as_vector(self, values):
+        vector = np.asarray(values, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dimension:
+            raise ValueError(f"Vector dimension {vector.shape[0]} does not match index dimension {self.dimension}.")
+        return vector
+
+    def _set_row(self, row, vector):
+        self._matrix[row] = vector
+        self._sq_norms[row] = vector @ vector
+
+    def fetch(self, ids):
+        """
+        Fetches vectors by id.
+
+        Args:
+            ids (list of str): The ids to fetch. Unknown ids are left out of the response.
+
+        Returns:
+            dict: ``{'vectors': {id: {'id': id, 'values': [...]}}, 'namespace': ''}``
+        """
+        with self._lock:
+            vectors = {}
+            for vector_id in ids:
+                row = self._rows.get(vector_id)
+                if row is None:
+                    continue
+                vectors[vector_id] = {'id': vector_id, 'values': self._matrix[row].tolist()}
+                if vector_id in self._metadata:
+                    vectors[vector_id]['metadata'] = self._metadata[vector_id]
+            return {'vectors': vectors, 'namespace': ''}
+
+    def upsert(self, vectors):
+        """
+        Inserts vectors, overwriting any existing vector with the same id.
+
+        Args:
+            vectors (list): Dicts with ``id``, ``values`` and optional ``metadata`` keys,
+                or ``(id, values[, metadata])`` tuples.
+
+        Returns:
+            dict: ``{'upserted_count': n}``
+        """
+        parsed = [(vector_id, self._as_vector(values), metadata)
+                  for vector_id, values, metadata in map(_parse_vector, vectors)]
+        with self._lock:
+            self._ensure_capacity(len(self._ids) + len(parsed))
+            for vector_id, vector, metadata in parsed:
+                row = self._rows.get(vector_id)
+                if row is None:
+                    row = len(self._ids)
+                    self._ids.append(vector_id)
+                    self._rows[vector_id] = row
+                self._set_row(row, vector)
+                if metadata is not None:
+                    self._metadata[vector_id] = metadata
+            return {'upserted_count': len(parsed)}
+
+    def update(self, id, values=None, set_metadata=None):
+        """
+        Updates the values and/or metadata of an existing vector.
+
+        Raises:
+            KeyError: If no vector with this id exists.
+        """
+        with self._lock:
+            row = self._rows.get(id)
+            if row is None:
+                raise KeyError(f"Vector with ID {id} does not exist in the index.")
+            if values is not None:
+                self._set_row(row, self._as_vector(values))
+            if set_metadata is not None:
+                self._metadata.setdefault(id, {}).update(set_metadata)
+            return {}
+
+    def delete(self, ids=None, delete_all=False):
+        """
+        Deletes vectors by id. Unknown ids are ignored, as Pinecone does.
+        """
+        with self._lock:
+            if delete_all:
+                self._ids, self._rows, self._metadata = [], {}, {}
+                return {}
+            for vector_id in ids or []:
+                row = self._rows.pop(vector_id, None)
+                if row is None:
+                    continue
+                self._metadata.pop(vector_id, None)
+                # Move the last row into the freed slot so the matrix stays dense
+                last = len(self._ids) - 1
+                if row != last:
+                    moved_id = self._ids[last]
+                    self._matrix[row] = self._matrix[last]
+                    self._sq_norms[row] = self._sq_norms[last]
+                    self._ids[row] = moved_id
+                    self._rows[moved_id] = row
+                self._ids.pop()
+            return {}
+
+    def _scores(self, query):
+        size = len(self._ids)
+        matrix = self._matrix[:size]
+        products = matrix @ query
+        if self.metric == 'euclidean':
+            return np.maximum(self._sq_norms[:size] - 2 * products + query @ query, 0)
+        if self.metric == 'cosine':
+            norms = np.sqrt(self._sq_norms[:size]) * np.sqrt(query @ query)
+            return products / np.maximum(norms, np.finfo(np.float32).tiny)
+        return products
+
+    def query(self, vector, top_k=10, include_values=False, include_metadata=False):
+        """
+        Returns the ``top_k`` nearest vectors to the query vector, best match first.
+
+        Returns:
+            dict: ``{'matches': [{'id': ..., 'score': ...}, ...], 'namespace': ''}``
+        """
+        query = self._as_vector(vector)
+        with self._lock:
+            size = len(self._ids)
+            if size == 0 or top_k <= 0:
+                return {'matches': [], 'namespace': ''}
+            scores = self._scores(query)
+            # Rank on distances: negate similarities so that lower is always better
+            keys = scores if self.metric == 'euclidean' else -scores
+            k = min(top_k, size)
+            top = np.argpartition(keys, k - 1)[:k] if k < size else np.arange(size)
+            top = top[np.argsort(keys[top], kind='stable')]
+            return {'matches': self._matches(top, scores[top], include_values, include_metadata), 'namespace': ''}
+
+    def query_many(self, vectors, top_k=10, include_values=False, include_metadata=False):
+        """
+        Returns the ``top_k`` nearest vectors for each query vector.
+
+        A block of queries is scored with one matrix-matrix product instead of one
+        matrix-vector product per query, which reads the stored matrix once per block.
+
+        Returns:
+            list: One ``{'matches': [...], 'namespace': ''}`` response per query vector.
+        """
+        queries = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        if len(queries) and queries.shape[1] != self.dimension:
+            raise ValueError(f"Vector dimension {queries.shape[1]} does not match index dimension {self.dimension}.")
+        with self._lock:
+            size = len(self._ids)
+            if size == 0 or top_k <= 0:
+                return [{'matches': [], 'namespace': ''} for _ in range(len(queries))]
+            k = min(top_k, size)
+            block = max(1, QUERY_BLOCK_ELEMENTS // size)
+            responses = []
+            for start in range(0, len(queries), block):
+                scores = self._scores_many(queries[start:start + block])
+                keys = scores if self.metric == 'euclidean' else -scores
+                top = np.argpartition(keys, k - 1, axis=1)[:, :k] if k < size \
+                    else np.broadcast_to(np.arange(size), keys.shape)
+                order = np.argsort(np.take_along_axis(keys, top, axis=1), axis=1, kind='stable')
+                top = np.take_along_axis(top, order, axis=1)
+                for rows, row_scores in zip(top, np.take_along_axis(scores, top, axis=1)):
+                    responses.append({'matches': self._matches(rows, row_scores, include_values, include_metadata),
+                                      'namespace': ''})
+            return responses
+
+    def _scores_many(self, queries):
+        size = len(self._ids)
+        products = queries @ self._matrix[:size].T
+        if self.metric == 'euclidean':
+            return np.maximum(self._sq_norms[:size] - 2 * products + (queries * queries).sum(axis=1)[:, None], 0)
+        if self.metric == 'cosine':
+            norms = np.sqrt(self._sq_norms[:size]) * np.sqrt((queries * queries).sum(axis=1))[:, None]
+            return products / np.maximum(norms, np.finfo(np.float32).tiny)
+        return products
+
+    def _matches(self, rows, scores, include_values, include_metadata):
+        matches = []
+        for row, score in zip(rows.tolist(), scores.tolist()):
+            vector_id = self._ids[row]
+            match = {'id': vector_id, 'score': score}
+            if include_values:
+                match['values'] = self._matrix[row].tolist()
+            if include_metadata and vector_id in self._metadata:
+                match['metadata'] = self._metadata[vector_id]
+            matches.append(match)
+        return matches
+
+    def describe_index_stats(self):
+        with self._lock:
+            return {'dimension': self.dimension, 'total_vector_count': len(self._ids)}
+
+    def export_arrays(self):
+        """
+        Returns a consistent copy of the contents as ``(ids, vectors, metadata)``.
+        """
+        with self._lock:
+            size = len(self._ids)
+            return (list(self._ids), self._matrix[:size].copy(),
+                    {vector_id: dict(metadata) for vector_id, metadata in self._metadata.items()})
+
+    def load_arrays(self, ids, vectors, metadata=None):
+        """
+        Replaces the contents with ``vectors`` (shape ``(len(ids), dimension)``) without copying them.
+
+        ``vectors`` may be a memory-mapped snapshot: it is used in place until the
+        index next grows, so loading costs one pass to compute the norms.
+        """
+        if vectors.shape != (len(ids), self.dimension):
+            raise ValueError(f"Expected vectors of shape {(len(ids), self.dimension)}, got {vectors.shape}.")
+        sq_norms = np.empty(max(len(ids), 1), dtype=np.float32)
+        for start in range(0, len(ids), 65536):
+            chunk = vectors[start:start + 65536]
+            sq_norms[start:start + len(chunk)] = np.einsum('ij,ij->i', chunk, chunk)
+        with self._lock:
+            self._matrix = vectors if len(ids) else np.empty((1, self.dimension), dtype=np.float32)
+            self._sq_norms = sq_norms
+            self._ids = list(ids)
+            self._rows = {vector_id: row for row, vector_id in enumerate(self._ids)}
+            self._metadata = dict(metadata or {})
+
+
+def create_index(config, asynchronous=False):
+    """
+    Creates the index backend selected by ``INDEX_BACKEND`` in config.json.
+
+    Args:
+        config (dict): The loaded config.json. ``INDEX_BACKEND`` is ``pinecone`` (default),
+            ``http`` (async REST client for ``INDEX_HOST``), ``sharded`` (scatter-gather over the
+            index servers in ``INDEX_SHARD_HOSTS``), ``numpy`` (exact) or ``ivf`` (approximate);
+            ``DIMENSIONS`` and ``INDEX_METRIC`` configure the local backends, ``IVF_NLIST``,
+            ``IVF_NPROBE``, ``IVF_PROBE_FRACTION``, ``IVF_TRAIN_SIZE`` and ``IVF_PQ_M`` the IVF
+            one. With ``INDEX_PERSIST_PATH`` set, a local backend is made durable (see DurableIndex).
+        asynchronous (bool): The index is used through its ``a*`` methods on an event loop (the
+            app). The ``http`` backend is then an AsyncHttpIndex, whose requests run on that loop;
+            otherwise it is an IndexClient, for synchronous code such as the ingest CLIs.
+
+    Returns:
+        An object with the pinecone.Index methods used by pinecone_module_fastapi.
+
+    Raises:
+        CustomException: If the backend is unknown or cannot be created.
+    """
+    backend = config.get('INDEX_BACKEND', 'pinecone')
+    try:
+        if backend == 'pinecone':
+            import pinecone
+            pinecone.init(api_key=config['API_KEY_PINECONE'], environment=config['ENVIRONMENT'])
+            index = pinecone.Index(config['INDEX_NAME'])
+        elif backend == 'http':
+            from src.components.index_client import AsyncHttpIndex, IndexClient
+            index = (AsyncHttpIndex if asynchronous else IndexClient)(
+                config['INDEX_HOST'], api_key=config.get('API_KEY_PINECONE'),
+                timeout=config.get('INDEX_TIMEOUT_S', 5.0),
+                max_retries=config.get('INDEX_MAX_RETRIES', 3),
+                max_connections=config.get('INDEX_MAX_CONNECTIONS', 32),
+                multi_query_size=config.get('INDEX_MULTI_QUERY_SIZE'))
+        elif backend == 'sharded':
+            from src.components.index_client import IndexClient
+            from src.components.sharded_index import ShardedIndex
+            # A request to a shard is abandoned at the shard timeout, so a stuck shard does not pin threads
+            shard_timeout = config.get('INDEX_SHARD_TIMEOUT_S', 1.0)
+            shards = [IndexClient(host, api_key=config.get('API_KEY_PINECONE'), timeout=shard_timeout,
+                                  max_retries=config.get('INDEX_MAX_RETRIES', 3),
+                                  max_connections=config.get('INDEX_MAX_CONNECTIONS', 32),
+                                  multi_query_size=config.get('INDEX_MULTI_QUERY_SIZE'))
+                      for host in config['INDEX_SHARD_HOSTS']]
+            index = ShardedIndex(shards, metric=config.get('INDEX_METRIC', 'euclidean'),
+                                 shard_timeout_s=shard_timeout,
+                                 allow_partial=config.get('INDEX_ALLOW_PARTIAL', True))
+        elif backend in ('numpy', 'ivf'):
+            if backend == 'numpy':
+                def factory():
+                    return NumpyIndex(dimension=config.get('DIMENSIONS', 128),
+                                      metric=config.get('INDEX_METRIC', 'euclidean'))
+            else:
+                from src.components.ivf_index import IVFIndex
+
+                def factory():
+                    return IVFIndex(dimension=config.get('DIMENSIONS', 128),
+                                    metric=config.get('INDEX_METRIC', 'euclidean'),
+                                    nlist=config.get('IVF_NLIST'),
+                                    nprobe=config.get('IVF_NPROBE'),
+                                    probe_fraction=config.get('IVF_PROBE_FRACTION', 0.3),
+                                    train_size=config.get('IVF_TRAIN_SIZE'),
+                                    pq_m=config.get('IVF_PQ_M'))
+            if config.get('INDEX_PERSIST_PATH'):
+                # Write-ahead log plus memory-mapped snapshots, recovered on start-up
+                from src.components.durable_index import DurableIndex
+                index = DurableIndex(config['INDEX_PERSIST_PATH'], factory,
+                                     sync=config.get('INDEX_WAL_SYNC', 'always'),
+                                     snapshot_every=config.get('INDEX_SNAPSHOT_EVERY', 100000))
+            else:
+                index = factory()
+        else:
+            raise ValueError(f"Unknown INDEX_BACKEND {backend!r}. Expected 'pinecone', 'http', 'sharded', 'numpy' or 'ivf'.")
+    except Exception as e:
+        raise CustomException(e, sys) from e
+    logging.info(f"Using {backend} index backend.")
+    return index
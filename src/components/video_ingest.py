@@ -0,0 +1,419 @@
+"""
+Video and frame-stream ingestion: faces tracked across frames, each track embedded a few times.
+
+Frames are decoded with OpenCV and sampled adaptively: every --min-interval-ms while
+faces are in view, backing off to --max-interval-ms when none are, and skipping
+detection altogether while the scene does not change. MTCNN boxes are linked into
+tracks by IoU, and each track keeps its sharpest crops (variance of the Laplacian),
+so a face in view for ten seconds is embedded --embeddings-per-track times instead
+of once per frame. When a track ends its crops are embedded in batches and matched
+against the index; the matches are reported per track, best first, with the same
+scores and messages as ``/ValidateImage``.
+
+The source is a video file, a camera number or any URL OpenCV can open.
+
+Usage:
+    python -m src.components.video_ingest kiosk.mp4 --config config.json --output tracks.json
+    python -m src.components.video_ingest 0 --min-interval-ms 100 --embeddings-per-track 5
+"""
+import argparse
+import heapq
+import itertools
+import json
+import time
+import numpy as np
+from src.logger import logging
+from src.components.face_detection import FaceDetector
+from src.components.model_registry import get_registry
+from src.components.metrics import stage_timer
+
+
+def iou(a, b):
+    """
+    Intersection over union of two ``[x, y, width, height]`` boxes.
+    """
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    union = aw * ah + bw * bh - w * h
+    return w * h / union if union else 0.0
+
+
+def sharpness(face_bgr, size=160):
+    """
+    Variance of the Laplacian of a face crop: higher is sharper.
+
+    The crop is resized to the embedding model's input size first, so faces of
+    different sizes are compared at the resolution the model sees them.
+    """
+    import cv2
+    gray = cv2.resize(cv2.cvtColor(face_bgr, cv2.COLOR_BGR2GRAY), (size, size), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+class AdaptiveSampler:
+    """
+    Decides which decoded frames go to face detection.
+
+    While faces are in view a frame is sampled every ``min_interval_s``. After each
+    sample without faces the interval doubles, up to ``max_interval_s``. With no face
+    being tracked, a sampled frame whose thumbnail differs from the last detected
+    frame by less than ``motion_threshold`` grey levels on average is not detected.
+    """
+
+    def __init__(self, min_interval_s=0.2, max_interval_s=1.0, motion_threshold=2.0):
+        self.min_interval_s = min_interval_s
+        self.max_interval_s = max_interval_s
+        self.motion_threshold = motion_threshold
+        self.interval_s = min_interval_s
+        self.next_due_s = 0.0
+        self._thumbnail = None
+
+    def due(self, timestamp):
+        return timestamp >= self.next_due_s
+
+    def still(self, frame):
+        import cv2
+        thumbnail = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (64, 36),
+                               interpolation=cv2.INTER_AREA).astype(np.int16)
+        if self._thumbnail is not None and np.abs(thumbnail - self._thumbnail).mean() < self.motion_threshold:
+            return True
+        # Compared with the last detected frame, so slow changes still add up to a detection
+        self._thumbnail = thumbnail
+        return False
+
+    def observe(self, timestamp, active):
+        """
+        Schedules the next sample after the one at ``timestamp``; ``active`` is whether
+        faces are in view or being tracked.
+        """
+        if active:
+            self.interval_s = self.min_interval_s
+        else:
+            self.interval_s = min(self.interval_s * 2, self.max_interval_s)
+        self.next_due_s = timestamp + self.interval_s
+
+
+class Track:
+    """
+    One face followed across frames, with its sharpest crops.
+    """
+
+    def __init__(self, track_id, box, timestamp):
+        self.track_id = track_id
+        self.box = box
+        self.first_s = timestamp
+        self.last_s = timestamp
+        self.hits = 0
+        self.embeddings = []
+        self.sharpness = []
+        self._candidates = []  # min-heap of (sharpness, sequence, timestamp, crop)
+        self._sequence = itertools.count()
+
+    def add(self, box, timestamp, face_bgr, keep, min_side):
+        self.box = box
+        self.last_s = timestamp
+        self.hits += 1
+        if min(face_bgr.shape[:2]) < min_side:
+            return
+        score = sharpness(face_bgr)
+        if len(self._candidates) < keep:
+            heapq.heappush(self._candidates, (score, next(self._sequence), timestamp, np.ascontiguousarray(face_bgr)))
+        elif score > self._candidates[0][0]:
+            heapq.heapreplace(self._candidates, (score, next(self._sequence), timestamp,
+                                                 np.ascontiguousarray(face_bgr)))
+
+    def crops(self):
+        # Sharpest first
+        return [crop for _, _, _, crop in sorted(self._candidates, key=lambda candidate: -candidate[0])]
+
+    def release_crops(self):
+        self.sharpness = [round(score, 1) for score, _, _, _ in sorted(self._candidates, reverse=True)]
+        self._candidates = []
+
+    def to_dict(self):
+        return {'track_id': self.track_id, 'start_s': round(self.first_s, 3), 'end_s': round(self.last_s, 3),
+                'detections': self.hits, 'embedded': len(self.embeddings),
+                'sharpness': self.sharpness, 'last_box': [int(v) for v in self.box]}
+
+
+class IoUTracker:
+    """
+    Links detections of consecutive sampled frames into tracks by box overlap.
+
+    Each detection is matched greedily, highest IoU first, to the track whose last box
+    it overlaps by at least ``iou_threshold``; unmatched detections start new tracks.
+    A track not seen for ``max_age_s`` ends.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_age_s=1.0, keep=3, min_side=40):
+        """
+        Args:
+            iou_threshold (float): Smallest overlap that continues a track.
+            max_age_s (float): Seconds a track survives without a detection.
+            keep (int): Sharpest crops kept per track, i.e. embeddings per track.
+            min_side (int): Crops smaller than this (pixels) extend a track but are not embedded.
+        """
+        self.iou_threshold = iou_threshold
+        self.max_age_s = max_age_s
+        self.keep = keep
+        self.min_side = min_side
+        self.active = []
+        self._ids = itertools.count(1)
+
+    def update(self, faces, timestamp):
+        """
+        Adds the faces detected in the frame at ``timestamp``.
+
+        Args:
+            faces (list): ``FaceDetector.detect_faces`` results (``box`` and RGB ``face``).
+
+        Returns:
+            list: The tracks that ended.
+        """
+        pairs = sorted(((iou(track.box, face['box']), t, f) for t, track in enumerate(self.active)
+                        for f, face in enumerate(faces)), reverse=True)
+        matched_tracks, matched_faces = set(), set()
+        for overlap, t, f in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if t in matched_tracks or f in matched_faces:
+                continue
+            matched_tracks.add(t)
+            matched_faces.add(f)
+            self._add(self.active[t], faces[f], timestamp)
+        for f, face in enumerate(faces):
+            if f not in matched_faces:
+                track = Track(next(self._ids), face['box'], timestamp)
+                self._add(track, face, timestamp)
+                self.active.append(track)
+
+        ended = [track for track in self.active if timestamp - track.last_s > self.max_age_s]
+        self.active = [track for track in self.active if timestamp - track.last_s <= self.max_age_s]
+        return ended
+
+    def _add(self, track, face, timestamp):
+        # The detector crops in RGB; the embedding model expects BGR
+        track.add(face['box'], timestamp, face['face'][:, :, ::-1], self.keep, self.min_side)
+
+    def finish(self):
+        ended, self.active = self.active, []
+        return ended
+
+
+def open_source(source):
+    import cv2
+    capture = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+    if not capture.isOpened():
+        raise ValueError(f"Video source {source} cannot be opened.")
+    return capture
+
+
+def iter_tracks(source, detector=None, sampler=None, tracker=None, min_hits=2, batch_size=16, stats=None):
+    """
+    Decodes a video, tracks the faces in it and yields each track once it has ended.
+
+    Tracks are embedded in batches of about ``batch_size`` crops, so they are yielded
+    a few at a time, with their ``embeddings`` filled in. Tracks with fewer than
+    ``min_hits`` detections (usually false detections or faces passing the edge of the
+    frame) are dropped.
+
+    Args:
+        source (str or int): A video file, camera number or stream URL.
+        detector (FaceDetector, optional): Defaults to one using the registry's MTCNN.
+        sampler (AdaptiveSampler, optional): Which frames to detect.
+        tracker (IoUTracker, optional): How detections become tracks.
+        stats (dict, optional): Filled with frame, detection and embedding counts.
+
+    Yields:
+        Track: Ended tracks with their embeddings.
+    """
+    detector = detector or FaceDetector()
+    sampler = sampler or AdaptiveSampler()
+    tracker = tracker or IoUTracker()
+    stats = stats if stats is not None else {}
+    stats.update(frames=0, sampled=0, still=0, detected=0, faces=0, tracks=0, embeddings=0)
+    backend = get_registry().get_embedding_backend()
+    pending = []
+
+    def flush():
+        crops = [crop for track in pending for crop in track.crops()]
+        embeddings = []
+        if crops:
+            with stage_timer('embed'):
+                embeddings = backend.embed(crops)
+        offset = 0
+        for track in pending:
+            count = len(track.crops())
+            track.embeddings = embeddings[offset:offset + count]
+            offset += count
+            track.release_crops()
+        stats['embeddings'] += len(crops)
+        stats['tracks'] += len(pending)
+        done = list(pending)
+        pending.clear()
+        return done
+
+    def end(tracks):
+        pending.extend(track for track in tracks if track.hits >= min_hits)
+        if sum(len(track.crops()) for track in pending) >= batch_size:
+            return flush()
+        return []
+
+    import cv2
+    capture = open_source(source)
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    # Live streams often report no frame rate; their frames are timed by the wall clock
+    fps = fps if 0 < fps < 1000 else None
+    started = time.monotonic()
+    try:
+        for frame_number in itertools.count():
+            # grab() skips the colour conversion and copy of frames that are not sampled
+            if not capture.grab():
+                break
+            stats['frames'] += 1
+            timestamp = frame_number / fps if fps else time.monotonic() - started
+            if not sampler.due(timestamp):
+                continue
+            ok, frame = capture.retrieve()
+            if not ok:
+                break
+            stats['sampled'] += 1
+            if not tracker.active and sampler.still(frame):
+                stats['still'] += 1
+                sampler.observe(timestamp, active=False)
+                continue
+            faces = detector.detect_faces(frame)
+            stats['detected'] += 1
+            stats['faces'] += len(faces)
+            yield from end(tracker.update(faces, timestamp))
+            sampler.observe(timestamp, active=bool(faces or tracker.active))
+        yield from end(tracker.finish())
+        yield from flush()
+    finally:
+        capture.release()
+        stats['elapsed_s'] = round(time.monotonic() - started, 3)
+        stats['video_s'] = round(stats['frames'] / fps, 3) if fps else stats['elapsed_s']
+
+
+def match_tracks(index, tracks, top_k=5):
+    """
+    Matches each track's embeddings against the index and merges them per track.
+
+    Every embedding of a track is queried (in one batch for all the tracks). An id's
+    score is its best (lowest) squared L2 distance over the track's embeddings, and
+    ``votes`` counts the embeddings that returned it.
+
+    Returns:
+        list: One dict per track with its summary and its ``matches``, best first.
+    """
+    from src.components.pinecone_module_fastapi import match_message, query_index_batch_sync
+    embeddings = [embedding for track in tracks for embedding in track.embeddings]
+    responses = iter(query_index_batch_sync(index, embeddings, top_k))
+    results = []
+    for track in tracks:
+        best = {}
+        for _ in track.embeddings:
+            for match in next(responses).matches:
+                entry = best.setdefault(match.id, {'id': match.id, 'score': match.score, 'votes': 0})
+                entry['score'] = min(entry['score'], match.score)
+                entry['votes'] += 1
+        matches = sorted(best.values(), key=lambda match: (match['score'], -match['votes']))[:top_k]
+        for match in matches:
+            match['message'] = match_message(match['score'])
+        results.append({**track.to_dict(), 'matches': matches})
+    return results
+
+
+def process_video(source, index=None, top_k=5, **options):
+    """
+    Tracks the faces of a video and matches each track against the index.
+
+    Args:
+        source (str or int): A video file, camera number or stream URL.
+        index: The index to match against; None only tracks and embeds.
+        top_k (int): Matches reported per track.
+        **options: Passed to ``iter_tracks``.
+
+    Returns:
+        dict: ``tracks`` (one entry per track, in the order they ended) and ``stats``.
+    """
+    stats = {}
+    results = []
+    batch = []
+    for track in iter_tracks(source, stats=stats, **options):
+        batch.append(track)
+        # Tracks arrive a few at a time; match them together
+        if index is not None and len(batch) >= 8:
+            results.extend(match_tracks(index, batch, top_k))
+            batch = []
+    if index is not None:
+        results.extend(match_tracks(index, batch, top_k))
+    else:
+        results.extend(track.to_dict() for track in batch)
+    logging.info(f"Video {source}: {stats['tracks']} face tracks from {stats['faces']} detections in "
+                 f"{stats['frames']} frames, {stats['embeddings']} embeddings.")
+    return {'tracks': results, 'stats': stats}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help="Video file, camera number or stream URL")
+    parser.add_argument('--config', default='config.json', help="config.json selecting the index and embedding backend")
+    parser.add_argument('--no-match', action='store_true', help="Only track and embed; do not query the index")
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--min-interval-ms', type=float, default=200, help="Sampling interval while faces are in view")
+    parser.add_argument('--max-interval-ms', type=float, default=1000, help="Longest sampling interval with no faces")
+    parser.add_argument('--motion-threshold', type=float, default=2.0,
+                        help="Mean grey-level change below which a face-less frame is not detected")
+    parser.add_argument('--iou', type=float, default=0.3, help="Smallest box overlap that continues a track")
+    parser.add_argument('--max-age-ms', type=float, default=1000, help="How long a track survives unseen")
+    parser.add_argument('--embeddings-per-track', type=int, default=3)
+    parser.add_argument('--min-hits', type=int, default=2, help="Detections needed to report a track")
+    parser.add_argument('--min-face-side', type=int, default=40, help="Smaller crops are not embedded")
+    parser.add_argument('--detection-max-side', type=int, default=960)
+    parser.add_argument('--min-face-size', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--output', help="Write the tracks and their matches as JSON")
+    args = parser.parse_args(argv)
+
+    with open(args.config) as f:
+        config = json.load(f)
+    get_registry().configure_backend(config.get('EMBEDDING_BACKEND', 'tensorflow'),
+                                     onnx_model_path=config.get('EMBEDDING_ONNX_PATH'),
+                                     onnx_intra_op_threads=config.get('EMBEDDING_ONNX_INTRA_OP_THREADS'),
+                                     onnx_inter_op_threads=config.get('EMBEDDING_ONNX_INTER_OP_THREADS'),
+                                     haar_redetect=config.get('EMBEDDING_HAAR_REDETECT', True))
+    index = None
+    if not args.no_match:
+        from src.components.vector_index import create_index
+        index = create_index(config)
+
+    try:
+        report = process_video(
+            args.source, index, args.top_k,
+            detector=FaceDetector(max_side=args.detection_max_side, min_face_size=args.min_face_size),
+            sampler=AdaptiveSampler(args.min_interval_ms / 1000, args.max_interval_ms / 1000, args.motion_threshold),
+            tracker=IoUTracker(args.iou, args.max_age_ms / 1000, args.embeddings_per_track, args.min_face_side),
+            min_hits=args.min_hits, batch_size=args.batch_size)
+    finally:
+        if index is not None and hasattr(index, 'close'):
+            index.close()
+
+    stats = report['stats']
+    for track in report['tracks']:
+        best = track.get('matches', [])[:1]
+        summary = f"{best[0]['id']} ({best[0]['score']:.1f}, {best[0]['message']})" if best else "no match"
+        print(f"track {track['track_id']:>4} {track['start_s']:>8.1f}s-{track['end_s']:.1f}s "
+              f"{track['detections']:>4} detections, {track['embedded']} embedded: {summary}")
+    print(f"{stats['frames']} frames ({stats['video_s']:.1f}s of video) in {stats['elapsed_s']:.1f}s: "
+          f"{stats['detected']} detected, {stats['still']} skipped as still, {stats['faces']} faces, "
+          f"{stats['tracks']} tracks, {stats['embeddings']} embeddings")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,211 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import random
+import threading
+import time
 from datetime import datetime
 
-LOG_FILE = f"{datetime.now().strftime('%Y_%m_%d_%H_%M_%S')}.log"
+LOG_FILE = f"{datetime.now().strftime('%Y_%m_%d_%H_%M_%S')}_{os.getpid()}.log"
 logs_path = os.path.join(os.getcwd(), "logs")
 os.makedirs(logs_path, exist_ok=True)
 
 LOG_FILE_PATH = os.path.join(logs_path, LOG_FILE)
 
-logging.basicConfig(
-    filename=LOG_FILE_PATH,
-    format="[ %(asctime)s ] %(lineno)d %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-)
\ No newline at end of file
+TEXT_FORMAT = "[ %(asctime)s ] %(lineno)d %(name)s - %(levelname)s - %(message)s"
+
+# Defaults, overridden from config.json through configure_logging()
+LOG_SETTINGS = {
+    'level': 'INFO',
+    'format': 'json',
+    'max_bytes': 50 * 1024 * 1024,
+    'backup_count': 5,
+    'max_field_chars': 2048,
+    'queue_size': 10000,
+    'sample_rates': {},
+}
+
+# Attributes every LogRecord has; anything else was passed through extra= and becomes a JSON field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def _truncate(value, limit):
+    if len(value) <= limit:
+        return value
+    return f"{value[:limit]}...[{len(value) - limit} chars truncated]"
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object per line.
+
+    The message, the traceback and every field passed through ``extra=`` are cut to
+    ``max_field_chars``, so an accidental log of a vector or an id list stays small.
+    """
+
+    def __init__(self, max_field_chars=2048):
+        super().__init__()
+        self.max_field_chars = max_field_chars
+
+    def format(self, record):
+        limit = self.max_field_chars
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'line': record.lineno,
+            'process': record.process,
+            'thread': record.threadName,
+            'message': _truncate(record.getMessage(), limit),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value if isinstance(value, (int, float, bool, type(None))) else _truncate(str(value), limit)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = _truncate(record.exc_text, limit * 4)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    The original plain-text line format, with the message cut to ``max_field_chars``.
+    """
+
+    def __init__(self, max_field_chars=2048):
+        super().__init__(TEXT_FORMAT)
+        self.max_field_chars = max_field_chars
+
+    def formatMessage(self, record):
+        record.message = _truncate(record.message, self.max_field_chars)
+        return super().formatMessage(record)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fraction of the records of chatty loggers.
+
+    Rates are keyed by logger name or by module name (most of this code base logs
+    through the root logger, so e.g. ``{"face_detection": 0.01}`` keeps 1% of the
+    detector's per-image records). Warnings and errors are never dropped.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = dict(rates or {})
+        self.sampled_out = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self.rates.get(record.name, self.rates.get(record.module))
+        if rate is None or random.random() < rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # The request thread only copies the record onto the queue; formatting and the file write happen on the
+    # listener thread. A full queue drops the record instead of blocking the caller.
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.exc_info:
+            # Tracebacks hold frames alive; render them now, they are rare
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_lock = threading.Lock()
+_queue_handler = None
+_listener = None
+
+
+def configure_logging(**settings):
+    """
+    Sets up, or reconfigures, the process's logging pipeline.
+
+    Records go through a bounded in-memory queue to a background thread that
+    formats them (JSON by default) and writes them to a size-rotated file, so a log
+    call on the request path costs a few microseconds.
+
+    Args:
+        **settings: Any of the keys of LOG_SETTINGS, e.g. ``level='DEBUG'``,
+            ``format='text'`` or ``sample_rates={'face_detection': 0.1}``.
+    """
+    global _queue_handler, _listener
+    unknown = set(settings) - set(LOG_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown logging settings: {sorted(unknown)}")
+
+    with _lock:
+        LOG_SETTINGS.update({key: value for key, value in settings.items() if value is not None})
+        if _listener is not None:
+            # Drains the queue before the handlers are replaced
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            logging.getLogger().removeHandler(_queue_handler)
+
+        formatter_class = JsonFormatter if LOG_SETTINGS['format'] == 'json' else TextFormatter
+        file_handler = logging.handlers.RotatingFileHandler(
+            LOG_FILE_PATH, maxBytes=LOG_SETTINGS['max_bytes'], backupCount=LOG_SETTINGS['backup_count'],
+            encoding='utf-8')
+        file_handler.setFormatter(formatter_class(LOG_SETTINGS['max_field_chars']))
+
+        _queue_handler = _QueueHandler(queue.Queue(maxsize=LOG_SETTINGS['queue_size']))
+        _queue_handler.addFilter(SamplingFilter(LOG_SETTINGS['sample_rates']))
+        _listener = logging.handlers.QueueListener(_queue_handler.queue, file_handler)
+        _listener.start()
+
+        root = logging.getLogger()
+        root.setLevel(LOG_SETTINGS['level'])
+        root.addHandler(_queue_handler)
+
+
+def get_logging_stats():
+    """
+    Returns the queue depth and the records dropped by a full queue or by sampling.
+    """
+    handler = _queue_handler
+    if handler is None:
+        return None
+    return {
+        'queued': handler.queue.qsize(),
+        'dropped': handler.dropped,
+        'sampled_out': sum(f.sampled_out for f in handler.filters if isinstance(f, SamplingFilter)),
+    }
+
+
+def flush_logging(timeout=5.0):
+    """
+    Waits until the records queued so far have been written.
+    """
+    deadline = time.monotonic() + timeout
+    while _queue_handler is not None and _queue_handler.queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+@atexit.register
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+configure_logging()
@@ -1,13 +1,15 @@
 import streamlit as st
 from PIL import Image
 import os
+import sys
 import asyncio
-import pinecone
 import tempfile
 import cv2
 from deepface import DeepFace
 from src.components.deepface_module_fastapi import _extract_embedding_sync
-from src.components.pinecone_module_fastapi import _query_index_sync
+from src.components.pinecone_module_fastapi import EXACT_MATCH_SCORE, SIMILAR_MATCH_SCORE, match_message, query_index_sync
+from src.components.model_registry import get_registry
+from src.components.vector_index import create_index
 from src.exception import CustomException
 import json
 
@@ -25,18 +27,23 @@ def resize_image(image, size=(500, 700)):
     return image.resize(size, Image.Resampling.LANCZOS)
 
 
-# Pinecone configuration
-API_KEY_PINECONE = config['API_KEY_PINECONE']
-ENVIRONMENT = config['ENVIRONMENT']
-INDEX_NAME = config['INDEX_NAME']
-DIMENSIONS = 128
+# Index backend (Pinecone or the local NumPy index), selected by INDEX_BACKEND.
+# Cached so that a local index survives Streamlit reruns.
+@st.cache_resource
+def load_index():
+    return create_index(config)
 
-# Initialize Pinecone index
-pinecone.init(      
-	api_key=API_KEY_PINECONE,      
-	environment=ENVIRONMENT      
-)      
-index = pinecone.Index(INDEX_NAME)
+index = load_index()
+
+
+# Load MTCNN and Facenet once per Streamlit server process; reruns reuse the registry
+@st.cache_resource
+def load_models():
+    registry = get_registry()
+    registry.warm_up()
+    return registry
+
+load_models()
 
 
 # Async functions
@@ -48,7 +55,7 @@ async def extract_embedding(image_input):
 
 async def query_index(index, embedding, top_k):
     try:
-        return await asyncio.to_thread(_query_index_sync, index, embedding, top_k)
+        return await asyncio.to_thread(query_index_sync, index, embedding, top_k)
     except Exception as e:
         raise CustomException(str(e), sys)
 
@@ -95,18 +102,18 @@ if st.button("Search"):
                 match_id = match['id']
                 score = match['score']
 
-                if score < 100:
+                if score < SIMILAR_MATCH_SCORE:
                     image_path = os.path.join(r"C:\Users\Nitish Kundu\Documents\image_data\images", match_id + ".jpg")
                     if os.path.exists(image_path):
                         matched_image = Image.open(image_path)
                         resized_matched_image = resize_image(matched_image)
                         col2.image(resized_matched_image, caption=f"Matched Image: {match_id}")
                         col2.write(f"Score: {score}")
-                        if score < 15:
-                            col2.success("Exact image found")
+                        if score < EXACT_MATCH_SCORE:
+                            col2.success(match_message(score))
                         else:
-                            col2.warning("Similar image found")
+                            col2.warning(match_message(score))
                 else:
-                    col2.error("No similar image found")
+                    col2.error(match_message(score))
     else:
         st.error("Please upload an image before searching.")
\ No newline at end of file
@@ -0,0 +1,67 @@
+import asyncio
+import hashlib
+from fastapi.testclient import TestClient
+import app_fastapi
+from src.components.admission import AdmissionController
+from src.components.vector_index import NumpyIndex
+
+
+async def fake_extract_embedding(image_input):
+    # A deterministic embedding per file content, so no models are needed
+    digest = hashlib.sha256(image_input).digest()
+    return [float(byte) for byte in digest * 4], None
+
+
+in_flight = {'now': 0, 'peak': 0}
+
+
+async def slow_extract_embedding(image_input):
+    # Holds its admission slot long enough for the other files to be turned away
+    in_flight['now'] += 1
+    in_flight['peak'] = max(in_flight['peak'], in_flight['now'])
+    await asyncio.sleep(0.2)
+    in_flight['now'] -= 1
+    return await fake_extract_embedding(image_input)
+
+
+def main():
+    # Runs from a directory whose config.json the app can load; the index is replaced below
+    app_fastapi.extract_embedding = fake_extract_embedding
+    headers = {'access_token': app_fastapi.API_KEY}
+    with TestClient(app_fastapi.app) as client:
+        app_fastapi.index = NumpyIndex()
+
+        # a.jpg and a.png share the id "a": only the first upload is inserted
+        files = [('files', ('a.jpg', b'first', 'image/jpeg')), ('files', ('a.png', b'second', 'image/png')),
+                 ('files', ('b.jpg', b'third', 'image/jpeg'))]
+        response = client.post('/AddImagesToIndexMultiple', files=files, headers=headers)
+        assert response.status_code == 200, response.text
+        body = response.json()
+        statuses = [(result['filename'], result['status']) for result in body['results']]
+        assert statuses == [('a.jpg', 'inserted'), ('a.png', 'skipped_existing'), ('b.jpg', 'inserted')], statuses
+        assert body['ids'] == ['a', 'b'], body['ids']
+        stored = app_fastapi.index.query([float(byte) for byte in hashlib.sha256(b'first').digest() * 4], top_k=1)
+        assert stored['matches'][0]['id'] == 'a' and stored['matches'][0]['score'] < 1e-3, stored
+        print(f"Same-stem uploads: {statuses}")
+
+        # Sent again, both stems already exist
+        response = client.post('/AddImagesToIndexMultiple', files=files, headers=headers)
+        statuses = [result['status'] for result in response.json()['results']]
+        assert statuses == ['skipped_existing'] * 3, statuses
+        print(f"Repeated upload: {statuses}")
+
+        # Every file takes its own admission slot: with one slot and no queue, one runs and the rest are rejected
+        app_fastapi.admission = AdmissionController(max_concurrency=1, max_queue=0)
+        app_fastapi.extract_embedding = slow_extract_embedding
+        files = [('files', (f'c{i}.jpg', f'upload {i}'.encode(), 'image/jpeg')) for i in range(3)]
+        response = client.post('/AddImagesToIndexMultiple', files=files, headers=headers)
+        assert response.status_code == 200, response.text
+        statuses = sorted(result['status'] for result in response.json()['results'])
+        assert statuses == ['inserted', 'rejected', 'rejected'], statuses
+        assert in_flight['peak'] == 1, in_flight
+        assert all('retry_after' in result for result in response.json()['results'] if result['status'] == 'rejected')
+        print(f"Admitted per file: {statuses}")
+
+
+if __name__ == "__main__":
+    main()
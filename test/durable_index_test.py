@@ -0,0 +1,95 @@
+import argparse
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from src.components.durable_index import DurableIndex
+from src.components.vector_index import NumpyIndex
+
+BATCH = 500
+
+
+def gallery(size):
+    return np.random.default_rng(0).standard_normal((size, 128)).astype(np.float32)
+
+
+def writer(path, size):
+    # Prints each write once it is acknowledged; the parent kills this process at some point
+    vectors = gallery(size)
+    index = DurableIndex(path, NumpyIndex, snapshot_every=size // BATCH // 3)
+    for start in range(0, size, BATCH):
+        index.upsert([(f"id-{i}", vectors[i]) for i in range(start, min(start + BATCH, size))])
+        print(f"upsert {start} {min(start + BATCH, size)}", flush=True)
+        if start:
+            index.delete(ids=[f"id-{start - 1}"])
+            print(f"delete {start - 1}", flush=True)
+    print("done", flush=True)
+    time.sleep(60)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vectors', type=int, default=50000)
+    parser.add_argument('--writer', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.writer:
+        writer(args.writer, args.vectors)
+        return
+
+    path = tempfile.mkdtemp(prefix='durable-index-')
+    process = subprocess.Popen([sys.executable, __file__, '--writer', path, '--vectors', str(args.vectors)],
+                               stdout=subprocess.PIPE, text=True, env={**os.environ, 'PYTHONPATH': os.getcwd()})
+    inserted, deleted = 0, set()
+    for line in process.stdout:
+        parts = line.split()
+        if parts[0] == 'upsert':
+            inserted = int(parts[2])
+        elif parts[0] == 'delete':
+            deleted.add(f"id-{parts[1]}")
+        if inserted >= args.vectors * 0.8 or parts[0] == 'done':
+            break
+    process.send_signal(signal.SIGKILL)
+    process.wait()
+    print(f"Writer killed after {inserted} acknowledged inserts and {len(deleted)} deletes.")
+
+    # Simulate a write torn by the crash at the end of the newest WAL segment
+    wal = os.path.join(path, 'wal')
+    with open(os.path.join(wal, sorted(os.listdir(wal))[-1]), 'ab') as f:
+        f.write(b'\x40\x00\x00\x00torn')
+
+    start = time.perf_counter()
+    index = DurableIndex(path, NumpyIndex)
+    print(f"Recovered {len(index)} vectors in {(time.perf_counter() - start) * 1000:.0f} ms: {index.stats()}")
+
+    vectors = gallery(args.vectors)
+    expected = [f"id-{i}" for i in range(inserted) if f"id-{i}" not in deleted]
+    assert set(index.fetch(expected)['vectors']) == set(expected), "Acknowledged inserts are missing."
+    assert not set(index.fetch(sorted(deleted))['vectors']), "Acknowledged deletes came back."
+    sample = np.random.default_rng(1).choice(len(expected), 200)
+    for i in sample:
+        vector_id = expected[i]
+        assert np.array_equal(index.fetch([vector_id])['vectors'][vector_id]['values'],
+                              vectors[int(vector_id[3:])].tolist())
+
+    start = time.perf_counter()
+    first = index.query(vectors[0] + 0.01, top_k=5)
+    print(f"First query after restart in {(time.perf_counter() - start) * 1000:.1f} ms, top match "
+          f"{first['matches'][0]['id']}")
+
+    # Writes keep working after recovery and survive the next restart too
+    index.upsert([("after-restart", vectors[0])])
+    index.snapshot()
+    index.close()
+    index = DurableIndex(path, NumpyIndex)
+    assert index.fetch(["after-restart"])['vectors'] and len(index) == len(expected) + 1
+    print(f"Snapshot after restart recovered: {index.stats()}")
+    index.close()
+    shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import asyncio
+import time
+import numpy as np
+from src.components.index_client import AsyncIndexClient, IndexClient, IndexRequestError
+from src.components.index_server import FaultInjector, IndexServer
+from src.components.vector_index import NumpyIndex
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def timed_queries(client, queries, top_k):
+    latencies = []
+
+    async def one(query):
+        start = time.perf_counter()
+        response = await client.query(query, top_k=top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        return response
+
+    responses = await asyncio.gather(*(one(query) for query in queries), return_exceptions=True)
+    return responses, latencies
+
+
+async def main():
+    rng = np.random.default_rng(0)
+    gallery = rng.standard_normal((2000, 128)).astype(np.float32)
+    queries = gallery[rng.choice(len(gallery), 300, replace=False)] + 0.01
+    expected = NumpyIndex()
+    expected.upsert([(f"id-{i}", row) for i, row in enumerate(gallery)])
+
+    # 5% errors, 2% dropped connections and 2% of requests 300 ms slow
+    faults = FaultInjector(latency_ms=1, jitter_ms=2, slow_rate=0.02, slow_ms=300, error_rate=0.05, drop_rate=0.02,
+                           seed=1)
+    with IndexServer(faults=faults) as server:
+        # Loading goes through the blocking facade, as the _sync helpers use it
+        index = IndexClient(server.url, timeout=5.0, max_retries=5)
+        for start in range(0, len(gallery), 500):
+            index.upsert([(f"id-{i}", gallery[i]) for i in range(start, min(start + 500, len(gallery)))])
+        print(f"Loaded: {index.describe_index_stats()}")
+
+        client = AsyncIndexClient(server.url, timeout=5.0, max_retries=5, max_connections=16)
+        responses, latencies = await timed_queries(client, queries, top_k=5)
+        failed = [response for response in responses if isinstance(response, Exception)]
+        correct = sum(1 for query, response in zip(queries, responses)
+                      if not isinstance(response, Exception)
+                      and response['matches'][0]['id'] == expected.query(query, top_k=1)['matches'][0]['id'])
+        print(f"{len(queries)} concurrent queries: {correct} correct, {len(failed)} failed, "
+              f"p50 {percentile(latencies, 0.5):.1f} ms, p99 {percentile(latencies, 0.99):.1f} ms, {client.stats()}")
+        assert not failed and correct == len(queries)
+
+        batched = index.query_many(queries[:20], top_k=1)
+        assert [r['matches'][0]['id'] for r in batched] == \
+               [expected.query(q, top_k=1)['matches'][0]['id'] for q in queries[:20]]
+        print(f"query_many: {len(batched)} responses in order")
+
+        # A deadline shorter than the injected latency fails fast instead of hanging
+        server.faults.latency_ms = 500
+        start = time.perf_counter()
+        try:
+            await client.query(queries[0], top_k=1, timeout=0.2)
+            raise AssertionError("The query should have timed out.")
+        except IndexRequestError as e:
+            print(f"Deadline enforced after {(time.perf_counter() - start) * 1000:.0f} ms: {e}")
+        server.faults.latency_ms = 0
+
+        # A permanently failing server exhausts the retries and surfaces the error
+        server.faults.error_rate = 1.0
+        try:
+            await client.query(queries[0], top_k=1)
+            raise AssertionError("The query should have failed.")
+        except IndexRequestError as e:
+            print(f"Gave up after retries with status {e.status}: {client.stats()}")
+
+        await client.aclose()
+        index.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
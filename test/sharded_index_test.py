@@ -0,0 +1,79 @@
+import asyncio
+import os
+import signal
+import time
+import numpy as np
+from src.components.index_client import IndexClient
+from src.components.pinecone_module_fastapi import (insert_to_index_full, query_index, query_index_batch,
+                                                    remove_from_index)
+from src.components.sharded_index import ShardCluster, ShardedIndex, shard_for
+from src.components.vector_index import NumpyIndex
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def main(shards=4, size=40000, top_k=10):
+    rng = np.random.default_rng(0)
+    gallery = rng.standard_normal((size, 128)).astype(np.float32)
+    queries = gallery[rng.choice(size, 200, replace=False)] + 0.01
+    ids = [f"id-{i}" for i in range(size)]
+    expected = NumpyIndex()
+    expected.upsert(list(zip(ids, gallery)))
+
+    with ShardCluster(shards) as cluster:
+        index = ShardedIndex([IndexClient(host) for host in cluster.hosts], shard_timeout_s=0.5)
+
+        # The batched insert path checks existence and upserts through the shards
+        start = time.perf_counter()
+        report = await insert_to_index_full(index, ids, [row.tolist() for row in gallery])
+        print(f"Inserted {len(report['inserted'])} vectors into {shards} shards in "
+              f"{time.perf_counter() - start:.1f}s: {index.describe_index_stats()['shards']}")
+        assert len(report['inserted']) == size
+
+        # Merged top-k equals exact search over the whole gallery
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            response = await query_index(index, query, top_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            assert [match.id for match in response.matches] == \
+                   [match['id'] for match in expected.query(query, top_k=top_k)['matches']]
+        print(f"{len(queries)} scatter-gather queries match exact search: "
+              f"p50 {percentile(latencies, 0.5):.1f} ms, p99 {percentile(latencies, 0.99):.1f} ms")
+
+        batched = await query_index_batch(index, list(queries[:16]), top_k)
+        assert [r.matches[0].id for r in batched] == \
+               [expected.query(q, top_k=1)['matches'][0]['id'] for q in queries[:16]]
+
+        await remove_from_index(index, ids[:100])
+        assert not index.fetch(ids[:100])['vectors'] and index.describe_index_stats()['total_vector_count'] == size - 100
+
+        # A frozen shard is left out after the timeout instead of stalling the query
+        frozen = cluster.processes[1]
+        os.kill(frozen.pid, signal.SIGSTOP)
+        try:
+            start = time.perf_counter()
+            response = index.query(queries[0], top_k=top_k)
+            elapsed = (time.perf_counter() - start) * 1000
+            assert response['partial'] and response['missing_shards'] == [1]
+            decoded = await query_index(index, queries[0], top_k)
+            assert decoded.partial and decoded.missing_shards == [1]
+            print(f"Partial result from {shards - 1} shards after {elapsed:.0f} ms: {index.stats()}")
+
+            # A write is not rolled back on the shards that took it; the frozen shard's ids are reported
+            new_ids = [f"new-{i}" for i in range(40)]
+            report = await insert_to_index_full(index, new_ids, [row.tolist() for row in gallery[:40]])
+            frozen_ids = [vector_id for vector_id in new_ids if shard_for(vector_id, shards) == 1]
+            assert sorted(report['failed']) == sorted(frozen_ids)
+            assert sorted(report['inserted']) == sorted(set(new_ids) - set(frozen_ids))
+            print(f"Write with a frozen shard: {len(report['inserted'])} inserted, {len(report['failed'])} failed")
+        finally:
+            os.kill(frozen.pid, signal.SIGCONT)
+        index.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())